@@ -89,7 +89,13 @@ VERSION = 0.17
 #  
 ################################################################################
 
-import re, os, os.path, sys, tempfile, traceback, time
+import os, os.path, sys, threading, traceback
+
+# With arguments, run from the command line and skip the GUI (and its imports) entirely.
+# (the Finder passes a -psn argument when it launches the app bundle)
+if __name__ == '__main__' and [ arg for arg in sys.argv[1:] if not arg.startswith('-psn') ]:
+  from bdtw.cli import main
+  sys.exit(main([ arg for arg in sys.argv[1:] if not arg.startswith('-psn') ]))
 
 # Set default template selections. Note that there's no default for the BibDesk Document--that automatically gets the frontmost window.
 defaults = { 'citep template': u'/Users/username/Library/Application Support/BibDesk/Templates/BDtW-AuthorYearParenCite.txt',
@@ -135,29 +141,21 @@ except ImportError:
 bibdesk = app('BibDesk')
 msword = app('Microsoft Word')
 
+from bdtw.cache import RenderCache
+from bdtw.fields import find_bibliography_options, parse_bibliography_options
+from bdtw.pipeline import REFERENCE_ORDERS, Cancelled, Options, create_bibliography, open_library, remove_bibliography
+from bdtw.profiler import Profiler
+from bdtw.settings import DocumentSettings
+from bdtw.word import WordDocument
+from bdtw.worker import ThrottledInterface, Worker
 
-################################################################################
-###   Small class to hold data for a single citation
-class Citation:
-  def __init__(self, citekey):
-    self.citekey = citekey   # citation key from BibDesk
-    self.publication = None  # link to BibDesk publication item (the entry in the BibDesk file)
-    self.authorname = ''     # the author name (used when sorting by author)
-    self.citenum = 0
-
-
-# The bibliography orders that we support
-REFERENCE_ORDERS = [
-  [ 'Appearance', 'Order of appearance in document' ],
-  [ 'LastName', 'Alphabetical by author last names' ],
-  [ 'CiteKey', 'Alphabetical by citation key' ],
-]
+
+# The entry in the BibDesk document list that lets the user pick a .bib file instead
+BIBFILE_CHOICE = 'Other BibTeX file...'
 
 # The location of BibDesk's templates directory
 TEMPLATE_DIR = os.path.join(os.path.expanduser('~'), 'Library', 'Application Support', 'BibDesk', 'Templates')
 
-# the timeout to use on long commands (like active_document.fields.get())
-TIMEOUT = 600   # 10 minutes
 
 #################################################################################
 ###  The main frame of the program
@@ -200,7 +198,7 @@ class MainFrame(wx.Dialog):
     refsizer1.AddSpacer(wx.Size(padding,padding))
     refsizer1.Add(wx.StaticLine(self), flag=wx.EXPAND | wx.ALL | wx.ALIGN_CENTER_VERTICAL)
     refsizer1.AddSpacer(wx.Size(padding,padding))
-    refsizer2 = wx.FlexGridSizer(3, 3, padding, padding)
+    refsizer2 = wx.FlexGridSizer(4, 3, padding, padding)
     refsizer2.AddGrowableCol(1)
     refsizer1.Add(refsizer2, flag=wx.EXPAND | wx.ALL | wx.ALIGN_CENTER_VERTICAL)
     
@@ -219,6 +217,15 @@ class MainFrame(wx.Dialog):
     self.wxreforder = wx.Choice(self, choices=[ r[1] for r in REFERENCE_ORDERS ])
     self.wxreforder.SetSelection(0)
     refsizer2.Add(self.wxreforder, flag=wx.EXPAND | wx.ALL | wx.ALIGN_CENTER_VERTICAL)
+    refsizer2.Add(wx.Size(0,0))
+    refsizer2.Add(wx.Size(0,0))
+    self.wxincremental = wx.CheckBox(self, label='Only update citations that changed (uncheck to rebuild everything)')
+    self.wxincremental.SetValue(True)
+    refsizer2.Add(self.wxincremental, flag=wx.EXPAND | wx.ALL | wx.ALIGN_CENTER_VERTICAL)
+    refsizer2.Add(wx.Size(0,0))
+    refsizer2.Add(wx.Size(0,0))
+    self.wxplaceholders = wx.CheckBox(self, label='Show citations that are not in the library as [key?]')
+    refsizer2.Add(self.wxplaceholders, flag=wx.EXPAND | wx.ALL | wx.ALIGN_CENTER_VERTICAL)
     
     # template section
     bibbox = wx.StaticBox(self, label='Bibliography Style')
@@ -274,11 +281,6 @@ class MainFrame(wx.Dialog):
     self.SetSize([bestsize[0]+padding+padding, bestsize[1]+padding+padding])  # extra padding for border on all sides
     self.CenterOnScreen()
     
-    # default the bibdesk file if only one is open
-    docnames = [ d.name.get() for d in bibdesk.documents.get() ]
-    if len(docnames) == 1:
-      self.wxbibfile.SetLabel(docnames[0])
-      
     # set default options defined in the 'defaults' dictionary
     self.wxciteptemplate.SetValue( defaults['citep template'] )
     self.wxcitettemplate.SetValue( defaults['citet template'] )
@@ -287,8 +289,9 @@ class MainFrame(wx.Dialog):
         if code == defaults['sort order']:
             self.wxreforder.SetSelection(i)
     
-    # set up the options with the default from the word document
-    self.parseBibliographyOptions()
+    # set up the options with the default from the word document (the dialog shows while they load)
+    self.settings = DocumentSettings()
+    self.loadBibliographyOptions()
     
     # bind button events
     self.wxbtnformatbib.Bind(wx.EVT_BUTTON, self.createBibliography)
@@ -307,9 +310,11 @@ class MainFrame(wx.Dialog):
   
   def selectBibDeskFile(self, event):
     docnames = [ d.name.get() for d in bibdesk.documents.get() ]
-    assert len(docnames) > 0, 'Please open a bibliography document in BibDesk first.'
     docnames.sort()
+    docnames.append(BIBFILE_CHOICE)
     bibfile = wx.GetSingleChoice('Please select the BibDesk document to use:', caption='BibDesk to Word', parent=self, choices=docnames)
+    if bibfile == BIBFILE_CHOICE:  # read a .bib file directly instead of going through BibDesk
+      bibfile = wx.FileSelector('Please select a BibTeX file:', parent=self, wildcard="BibTeX Files (*.bib)|*.bib")
     if bibfile != '':
       self.wxbibfile.SetLabel(bibfile)
     
@@ -334,264 +339,187 @@ class MainFrame(wx.Dialog):
       self.wxcitettemplate.SetValue(bibtemplate)
       
     
-  def parseBibliographyOptions(self):
-    '''Parses the bibliography options from the bibliography field and sets the GUI accordingly'''
-    # find the bibliography field
-    doc = msword.active_document
-    fields = doc.fields.get(timeout=TIMEOUT)
-    try:
-      if fields != k.missing_value:
-        for field in doc.fields.get(timeout=TIMEOUT):
-          if field.field_type.get() == k.field_addin and 'bibliography' in re.split('\W+', field.field_code.content.get().strip())[1:2]:
-            # we found it -- now parse and set program options
-            bibdata = re.search('{(.*)}', field.field_code.content.get()).group(1)
-            for part in bibdata.split(';'):
-              key, value = part.split(':')
-              if key == 'bib_file':
-                self.wxbibfile.SetLabel(value)
-              elif key == 'bib_template':
-                self.wxbibtemplate.SetValue(value)
-              elif key == 'citep_template':
-                self.wxciteptemplate.SetValue(value)
-              elif key == 'citet_template':
-                self.wxcitettemplate.SetValue(value)
-              elif key == 'ref_order':
-                for i, code in enumerate([ r[0] for r in REFERENCE_ORDERS ]):
-                  if code == value:
-                    self.wxreforder.SetSelection(i)
-            return
-    except Exception, e:
-      wx.MessageBox('An unknown error occurred while parsing your previous bibliography settings.  Please set them in the dialog again.\n\n' + str(e), 'BibDesk To Word')          
+  def loadBibliographyOptions(self):
+    '''Reads the bibliography options from the bibliography field, and the open BibDesk documents,
+       on a worker thread so the dialog doesn't wait for them.  The options seen last time in the
+       same (unchanged) document file are used without looking through the fields at all.'''
+    self.wxbtnformatbib.Disable()  # until we know the settings
+    self.wxbtnremovebib.Disable()
+    def load():
+      docnames = [ d.name.get() for d in bibdesk.documents.get() ]
+      worddoc = WordDocument(msword.active_document)
+      path = worddoc.path()
+      stored = path and self.settings.get(path)
+      if stored == None:
+        stored = find_bibliography_options(worddoc)
+        if path:
+          self.settings.put(path, stored)
+      return docnames, stored
+    Worker(load, (), lambda result, error: wx.CallAfter(self.bibliographyOptionsLoaded, result, error)).start()
+    
+    
+  def bibliographyOptionsLoaded(self, result, error):
+    '''Called on the GUI thread with what loadBibliographyOptions found, and sets the GUI accordingly'''
+    self.wxbtnformatbib.Enable()
+    self.wxbtnremovebib.Enable()
+    if error != None:
+      wx.MessageBox('An unknown error occurred while parsing your previous bibliography settings.  Please set them in the dialog again.\n\n' + str(error[1]), 'BibDesk To Word')          
+      return
+    docnames, stored = result
+    # default the bibdesk file if only one is open
+    if len(docnames) == 1:
+      self.wxbibfile.SetLabel(docnames[0])
+    # now set program options from the bibliography field
+    for key, value in stored.items():
+      if key == 'bib_file':
+        self.wxbibfile.SetLabel(value)
+      elif key == 'bib_template':
+        self.wxbibtemplate.SetValue(value)
+      elif key == 'citep_template':
+        self.wxciteptemplate.SetValue(value)
+      elif key == 'citet_template':
+        self.wxcitettemplate.SetValue(value)
+      elif key == 'ref_order':
+        for i, code in enumerate([ r[0] for r in REFERENCE_ORDERS ]):
+          if code == value:
+            self.wxreforder.SetSelection(i)
       
 
   def createBibliography(self, event):
-    '''Main function of the program -- creates the bibliography by linking between the two applications'''
+    '''Main function of the program -- creates the bibliography by linking between the two applications.
+       The work is done on a worker thread, so the dialog stays responsive and the run can be cancelled.'''
     # first ensure the user options pass muster
     bibfile = self.wxbibfile.GetLabel()
     assert bibfile.strip() != '', 'Please enter a valid BibDesk file name.'
-    try:
-      bibdoc = bibdesk.documents[its.name == bibfile].get()[0]
-    except IndexError:
-      try:
-        bibfile = bibfile + '.bib'
-        bibdoc = bibdesk.documents[its.name == bibfile].get()[0]
-      except IndexError:
-        assert False, 'Please ensure the selected BibDesk document (' + self.wxbibfile.GetLabel() + ') is open in BibDesk.'
-    assert not ':' in bibfile and not ';' in bibfile, 'The BibDesk file name cannot contain a colon or semicolon.'
-    bibtemplate = self.wxbibtemplate.GetValue()
-    assert bibtemplate != '' and os.path.isfile(bibtemplate), 'Please enter a valid bibliography template file name.'
-    assert not ':' in bibtemplate and not ';' in bibtemplate, 'The bibliography template file name cannot contain a colon or semicolon.'
-    citeptemplate = self.wxciteptemplate.GetValue()
-    assert citeptemplate != '' and os.path.isfile(citeptemplate), 'Please enter a valid \\cite template file name.'
-    assert not ':' in citeptemplate and not ';' in citeptemplate, 'The reference template file name cannot contain a colon or semicolon.'
-    citettemplate = self.wxcitettemplate.GetValue()
-    assert citettemplate != '' and os.path.isfile(citettemplate), 'Please enter a valid \\citet template file name.'
-    assert not ':' in citettemplate and not ';' in citettemplate, 'The reference template file name cannot contain a colon or semicolon.'
+    library = open_library(bibfile)
+    options = Options(library.name, self.wxbibtemplate.GetValue(), self.wxciteptemplate.GetValue(), self.wxcitettemplate.GetValue(), 
+                      REFERENCE_ORDERS[self.wxreforder.GetSelection()][0], self.wxincremental.GetValue(), self.wxplaceholders.GetValue())
+    options.validate()
     
     # ensure the Word file is open
-    doc = msword.active_document
-    assert doc.name.get() != k.missing_value, 'Please open a Word document to create the bibliography in.'
+    worddoc = WordDocument.active()
     
     # the progress bar we'll use throughout
-    progress = wx.ProgressDialog(parent=self, title='BibDesk to Word', message='                                                           ', maximum=5)
+    progress = wx.ProgressDialog(parent=self, title='BibDesk to Word', message='                                                           ', maximum=5,
+                                 style=wx.PD_APP_MODAL | wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME)
     progress.Show()
-    try:
-      # search for both \cite{*} and \bibliography{*} and turn into fields
-      progress.Update(0, 'Finding new citations...')
-      for textcommand in [ 'cite', 'citep', 'citet', 'nocite', 'bibliography' ]:
-        # set up the search word
-        findobject = msword.selection.find_object
-        findobject.forward.set(True)
-        findobject.match_wildcards.set(True)
-        findobject.wrap.set(k.find_stop)
-        findobject.content.set('\\\\' + textcommand + '\\{*\\}')     
-        # go to the beginning of the document
-        doc.create_range(start=0,end_=0).select()                    
-        # loop through all fields
-        while findobject.execute_find():     
-          citetext = msword.selection.content.get()[1:]  # take off the leading backslash
-          if citetext == '':
-            break
-          # make a new quote field (will change to ADDIN later)                        
-          doc.make(new=k.field, at=msword.selection.text_object, with_properties={k.field_type: k.field_quote, k.field_text: '*'})
-          #for some reason, make doesn't return the new field correctly, so find it manually
-          newfield = doc.create_range(start=msword.selection.selection_end.get(), end_=msword.selection.selection_end.get()+1).fields[1]
-          newfield.field_code.content.set(' ADDIN ' + citetext)
-          newfield.result_range.content.set('')
-          newfield.show_codes.set(True)
-          msword.selection.content.set('')  # erases the previous text (now that we have a field instead)
-
-      # search the fields for the bibliography
-      progress.Update(1, 'Updating the bibliography field...')
-      bibfield = None
-      for field in doc.fields.get(timeout=TIMEOUT):
-        if field.field_type.get() == k.field_addin and 'bibliography' in re.split('\W+', field.field_code.content.get().strip())[1:2]:
-          bibfield = field
-          break
-      if bibfield == None:
-        # get the name of the front-most BibDesk document
-        bibname = bibdesk.documents[1].name.get()
-        result = wx.MessageBox('No \\bibliography cite found.  Add one for ' + bibname + ' at the end of the document?', 'Bibliography Not Found', wx.YES_NO)
-        if result != wx.YES:
-          return
-        # add a blank line to the end of the document
-        msword.insert(text='\n', at=doc.text_object.characters[-1]) 
-        # make a new quote field (will change to ADDIN later)                        
-        doc.make(new=k.field, at=doc.text_object.characters[-1], with_properties={k.field_type: k.field_quote, k.field_text: '*'})
-        bibfield = doc.text_object.fields[-1]
-        bibfield.result_range.content.set('')
-        bibfield.show_codes.set(True)
-  
-      # update the bibliography field with values from the dialog
-      bibdata = []
-      bibdata.append('bib_file:' + bibfile)
-      bibdata.append('bib_template:' + bibtemplate)
-      bibdata.append('citep_template:' + citeptemplate)
-      bibdata.append('citet_template:' + citettemplate)
-      bibdata.append('ref_order:' + REFERENCE_ORDERS[self.wxreforder.GetSelection()][0])
-      bibfield.field_code.content.set(' ADDIN bibliography{' + ';'.join(bibdata) + '}')
-
-      # create a list of all citations in order of appearance in document
-      progress.Update(2, 'Adding in-text citation numbers...')
-      citations = []     # ordered list of all citations in document
-      citationsmap = {}  # fast access to citations in document by citekey
-      for field in doc.fields.get(timeout=TIMEOUT):
-        addin_type = re.split('\W+', field.field_code.content.get().strip())[1]
-        if field.field_type.get() == k.field_addin and addin_type in ('cite', 'citep', 'citet', 'nocite'):
-          citekeys = re.search('\{(.*)\}', field.field_code.content.get()).group(1)
-          for citekey in citekeys.split(','):  # in case there are more than one citation in this \cite
-            if not citekey in citationsmap:
-              # create a new citation object
-              progress.Update(2, 'Adding in-text citation numbers (' + str(len(citations)) + ')...')      
-              pubs = bibdoc.publications[its.cite_key == citekey].get()
-              if len(pubs) == 0:
-                wx.MessageBox('No BibDesk entry found for cite key: ' + citekey, 'Citation Skipped')
-              elif len(pubs) >= 2:
-                wx.MessageBox('More than one BibDesk entry matched cite key: ' + citekey, 'Citation Skipped')
-              else:
-                cite = Citation(citekey)
-                cite.publication = pubs[0]
-                citations.append(cite)
-                citationsmap[citekey] = cite
-
-      # go through and set the index number of each cite, according to the sort order 
-      progress.Update(3, 'Sorting and updating index numbers...')
-      if REFERENCE_ORDERS[self.wxreforder.GetSelection()][0] == 'Appearance':
-        pass # (the default sort is by appearance in the document)
-      elif REFERENCE_ORDERS[self.wxreforder.GetSelection()][0] == 'LastName':
-        citations.sort(key=lambda cite: [ author.abbreviated_normalized_name.get() for author in cite.publication.authors.get() ])
-      elif REFERENCE_ORDERS[self.wxreforder.GetSelection()][0] == 'CiteKey':
-        citations.sort(key=lambda cite: cite.publication.cite_key.get())
-      # set the numbers based on the sort order (these are used only if we are doing numbered references)
-      for i, cite in enumerate(citations):
-        cite.citenum = i+1
-        
-      # set the text of the cite fields
-      docfields = doc.fields.get(timeout=TIMEOUT)
-      assert docfields != k.missing_value, 'No citations found in document.'
-      for fieldindex, field in enumerate(docfields):
-        progress.Update(4, 'Formatting citations (%s/%s)...' % (fieldindex, len(docfields)))
-        addin_type = re.split('\W+', field.field_code.content.get().strip())[1]
-        if field.field_type.get() == k.field_addin and addin_type in ('cite', 'citep', 'citet', 'nocite'):
-          citekeys = re.search('\{(.*)\}', field.field_code.content.get()).group(1)
-          cites = []
-          for citekey in citekeys.split(','):
-            if citationsmap.has_key(citekey):
-              cites.append(citationsmap[citekey])
-          if len(cites) > 0:
-            # sort the cites numerically so they appear in order of the bibliography
-            cites.sort(lambda x, y: cmp(x.citenum, y.citenum))
-            # format the citation depending on the type
-            template = addin_type == 'citet' and citettemplate or citeptemplate
-            if addin_type == 'nocite':
-              field.result_range.content.set('')
-#              field.result_range.style.set(k.style_normal)
-              field.show_codes.set(True)
-
-            elif os.path.splitext(template)[1].lower() == '.txt':  # if a text template, just have BibDesk give us the references
-              citetext = bibdoc.templated_text(using=mactypes.File(template), in_=[ c.publication for c in cites ]).splitlines()
-              field.result_range.content.set(citetext)
-#              field.result_range.style.set(k.style_normal)
-              field.show_codes.set(False)  # show the bibliography text
-              # convert the item index (which starts at 1 for each cite) to our actual bibliography indices, if itemIndex was used in the template
-              for i, c in enumerate(cites):
-                field.result_range.find_object.execute_find(find_text=':::Index:' + str(i+1) + ':::', replace_with=str(c.citenum), replace=k.replace_all)
-            
-            else:  # a word document or other rich text, so export to a file and then read back in
-              f = tempfile.NamedTemporaryFile() # this creates a temp file on the system
-              tempname = f.name
-              f.close()
-              bibdoc.export(to=mactypes.File(tempname), using_template=mactypes.File(template), in_=[ c.publication for c in cites ])
-              field.result_range.content.set('')
-              doc.insert_file(file_name=mactypes.File(tempname).hfspath, at=field.result_range)
-              os.remove(tempname)
-              # sometimes a hard return is included after insert_file -- not sure why
-              todelete = doc.create_range(start=field.result_range.end_of_content.get()-1, end_=field.result_range.end_of_content.get())
-              if todelete.content.get() == chr(13):
-                todelete.content.set('')
-              field.show_codes.set(False)  # show the bibliography text
-              # convert the item index (which starts at 1 for each cite) to our actual bibliography indices, if itemIndex was used in the template
-              for i, c in enumerate(cites):
-                field.result_range.find_object.execute_find(find_text=':::Index:' + str(i+1) + ':::', replace_with=str(c.citenum), replace=k.replace_all)
-
-      # create the bibliography and insert into the bibliography field's result range
-      progress.Update(5, 'Creating the bibliography...')
-      if os.path.splitext(bibtemplate)[1].lower() == '.txt':  # if a text template, just have BibDesk give us the references
-        bibliography = bibdoc.templated_text(using=mactypes.File(bibtemplate), for_=[ c.publication for c in citations ])
-        bibfield.result_range.content.set(bibliography)
-      else:  # a word document or other rich text, so export to a file and then read back in
-        f = tempfile.NamedTemporaryFile() # this creates a temp file on the system
-        tempname = f.name
-        f.close()
-        bibdoc.export(to=mactypes.File(tempname), using_template=mactypes.File(bibtemplate), for_=[ c.publication for c in citations ])
-        bibfield.result_range.content.set('')
-        doc.insert_file(file_name=mactypes.File(tempname).hfspath, at=bibfield.result_range)
-        os.remove(tempname)
-        bibfield.show_codes.set(False)  # show the bibliography text
-
-      # close out dialog now that we're done
-      wx.MessageBox('The bibliography was sucessfully created/updated.', 'Bibliography Complete')
-
-    # ensure the progress dialog is removed
-    finally:
-      progress.Destroy()    
-  
+    ui = WxInterface(progress)
+    
+    # set BDTW_PROFILE to a filename to get a report of the Apple Events sent
+    profiler = None
+    if os.environ.get('BDTW_PROFILE'):
+      profiler = Profiler()
+      worddoc = profiler.attach(worddoc)
+      library = profiler.attach(library)
+      ui = profiler.interface(ui)
+      options.render_ahead = 0  # format in step with the writes, so each event is charged to its own field
+      
+    def run():
+      # formatted output is cached between runs; if the cache can't be opened we just format everything
+      # (it is opened for each run and closed when the run ends, so what the run used is written out
+      # and no database connection is held open while the window sits idle)
+      try:
+        cache = RenderCache()
+      except Exception, e:
+        traceback.print_exc(file=sys.__stderr__)
+        cache = None
+      try:
+        summary = create_bibliography(worddoc, library, options, ui, cache)
+        if summary != None:  # the document now holds these options; show them straight away next time
+          path = worddoc.path()
+          if path:
+            self.settings.put(path, parse_bibliography_options(';'.join(options.code_parts())))
+        if profiler != None and summary != None:
+          profiler.write_report(os.environ['BDTW_PROFILE'], summary['citations'])
+        return summary
+      finally:
+        if cache != None:
+          cache.close()
+    Worker(run, (), lambda summary, error: wx.CallAfter(self.bibliographyCreated, progress, ui, summary, error)).start()
+    
+    
+  def bibliographyCreated(self, progress, ui, summary, error):
+    '''Called on the GUI thread when the worker started by createBibliography is done'''
+    progress.Destroy()
+    if error != None:
+      show_worker_error(error)
+    elif summary != None:
+      # close out dialog now that we're done; problem citations are listed here rather than as they come up
+      message = 'The bibliography was sucessfully created/updated.'
+      if len(ui.diagnostics) > 0:
+        message += '\n\nSome citations were skipped:\n\n' + ui.diagnostics.summary()
+      wx.MessageBox(message, 'Bibliography Complete')
+      
 
   def removeBibliography(self, event):
-    '''Removes the bibliography, including all codes'''
+    '''Removes the bibliography, including all codes (on a worker thread, like createBibliography)'''
     # ensure the Word file is open
-    doc = msword.active_document
-    assert doc.name.get() != k.missing_value, 'Please open a Word document to create the bibliography in.'
+    worddoc = WordDocument.active()
+    fieldcount = remove_bibliography(worddoc, dry_run=True)
 
-    fields = doc.fields.get(timeout=TIMEOUT)
-    assert fields != k.missing_value, 'There are no bibliography codes in the Word document.'
-
-    progress = wx.ProgressDialog(parent=self, title='BibDesk to Word', message='     Removing bibliography fields...     ', maximum=len(fields))
+    progress = wx.ProgressDialog(parent=self, title='BibDesk to Word', message='     Removing bibliography fields...     ', maximum=fieldcount,
+                                 style=wx.PD_APP_MODAL | wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME)
     progress.Show()
-    try:
-      # go backwards since we are removing items
-      for i, field in enumerate(reversed(fields)):
-        # update the progress bar
-        progress.Update(i+1)
-      
-        # if we are on a cite 
-        fieldname = re.split('\W+', field.field_code.content.get().strip())[1]
-        if field.field_type.get() == k.field_addin and fieldname in ('cite', 'citep', 'citet', 'nocite'):
-          fieldstart = field.field_code.content.start_of_content.get()
-          newrange = doc.create_range(start=fieldstart-1, end_=fieldstart-1)
-          doc.insert(at=newrange, text='\\' + fieldname + re.search('(\{.*\})', field.field_code.content.get()).group(1))
-          field.delete()
-        elif field.field_type.get() == k.field_addin and fieldname == 'bibliography':
-          fieldstart = field.field_code.content.start_of_content.get()
-          newrange = doc.create_range(start=fieldstart-1, end_=fieldstart-1)
-          doc.insert(at=newrange, text='\\bibliography{}')  # leaves the location, but resets the options
-          field.delete()
-        
+    ui = WxInterface(progress)
+    Worker(remove_bibliography, ( worddoc, ui ), lambda removed, error: wx.CallAfter(self.bibliographyRemoved, progress, error)).start()
+    
+    
+  def bibliographyRemoved(self, progress, error):
+    '''Called on the GUI thread when the worker started by removeBibliography is done'''
+    progress.Destroy()
+    if error != None:
+      show_worker_error(error)
+    else:
       # show a finished box
       wx.MessageBox('All citation and bibliography fields have been removed.', 'Removal Complete')
+    
+
+#################################################################################
+###   Talking to the user during a run
+
+class WxInterface(ThrottledInterface):
+  '''Shows the pipeline's progress and questions with wx dialogs.  The pipeline runs
+     on a worker thread, so everything that touches the screen is handed to the GUI
+     thread with wx.CallAfter.  Warnings are not shown as they come up; the dialog
+     lists them all at the end.'''
+  def __init__(self, progress):
+    ThrottledInterface.__init__(self)
+    self.progress_dialog = progress
+    
+    
+  def show_progress(self, stage, message):
+    wx.CallAfter(self._update, stage, message)
+    
+    
+  def _update(self, stage, message):
+    if self.cancelled():
+      return
+    keepgoing = self.progress_dialog.Update(stage, message)
+    if isinstance(keepgoing, tuple):  # ( continue, skip ) in newer versions of wx
+      keepgoing = keepgoing[0]
+    if not keepgoing:  # the Cancel button was pressed
+      self.cancel()
+      self.progress_dialog.Update(stage, 'Stopping after the current citation...')
+      
+      
+  def confirm(self, message, title):
+    # ask on the GUI thread and wait for the answer
+    answer = []
+    answered = threading.Event()
+    def ask():
+      answer.append(wx.MessageBox(message, title, wx.YES_NO) == wx.YES)
+      answered.set()
+    wx.CallAfter(ask)
+    answered.wait()
+    return answer[0]
+    
 
-    finally:
-      progress.Destroy()
+def show_worker_error(error):
+  '''Shows what went wrong on a worker thread (error is its sys.exc_info())'''
+  if isinstance(error[1], Cancelled):
+    wx.MessageBox(str(error[1]), 'Cancelled')
+  else:
+    sys.excepthook(*error)  # (the app's errorhandler)
     
 
 #################################################################################
@@ -0,0 +1,156 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Regenerates the bibliographies of many .docx files at once.
+
+The library is read (and the templates compiled) once, in the parent process,
+and the documents are spread over a pool of worker processes that inherit
+them when they are forked, so no worker reads the .bib file again.  Each worker opens its own connection to
+the render cache (SQLite handles the sharing).  Documents are worked on with
+bdtw.docx, so no Word is involved; a BibDesk library can't be shared with
+other processes, so batches that use one run in this process, one document
+after another.
+'''
+
+import os, time, traceback
+
+from bdtw.bibdesk import BibDeskDocument
+from bdtw.bibtex import BibTeXLibrary
+from bdtw.pipeline import Interface, create_bibliography, remove_bibliography
+from bdtw.template import load_template
+
+# the files a directory is searched for
+DOCUMENT_EXTENSIONS = ( '.docx', )
+
+
+class DocumentResult:
+  '''What happened to one document of a batch'''
+  def __init__(self, filename):
+    self.filename = filename
+    self.summary = None     # create_bibliography's summary
+    self.removed = None     # the number of fields removed, when removing
+    self.warnings = []
+    self.diagnostics = []   # the problem citations found (see bdtw.diagnostics)
+    self.error = None       # why the document failed, if it did
+    self.traceback = None   # for errors other than the user-facing (assertion) ones
+    self.seconds = 0.0
+    
+    
+def find_documents(paths, manifests=()):
+  '''Returns the documents to work on: paths to files are used as they are,
+     directories are searched (recursively) for .docx files, and each manifest is a
+     text file naming one document or directory per line (relative to the manifest;
+     blank lines and lines starting with # are skipped)'''
+  documents = []
+  for path in paths:
+    if os.path.isdir(path):
+      for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+          # skip the lock files Word leaves next to open documents
+          if os.path.splitext(filename)[1].lower() in DOCUMENT_EXTENSIONS and not filename.startswith('~$'):
+            documents.append(os.path.join(dirpath, filename))
+    else:
+      documents.append(path)
+  for manifest in manifests:
+    f = open(manifest)
+    try:
+      lines = [ line.strip() for line in f ]
+    finally:
+      f.close()
+    base = os.path.dirname(manifest)
+    documents.extend(find_documents([ os.path.join(base, line) for line in lines if line and not line.startswith('#') ]))
+  return documents
+  
+  
+def run_batch(documents, library, options_for, processes=None, use_cache=True, remove=False, templates=(), dry_run=False):
+  '''Creates (or with remove, removes) the bibliography of each .docx file in
+     documents and saves it (with dry_run, only counts what remove would remove).  options_for is called with each document and returns
+     its Options.  processes is the size of the pool (None for one per processor).
+     The .txt templates listed in templates are compiled up front, for the workers
+     to inherit.  Returns a DocumentResult per document, in the order given.'''
+  if isinstance(library, BibTeXLibrary):
+    library.load()  # read once here; the workers inherit it
+  for template in templates:
+    if os.path.splitext(template)[1].lower() == '.txt' and os.path.isfile(template):
+      load_template(template)
+  if isinstance(library, BibDeskDocument):
+    processes = 1   # its connection to BibDesk can't be shared
+  if processes == 1 or len(documents) < 2:
+    _start_worker(library, options_for, use_cache, remove, dry_run)
+    try:
+      return [ _run_document(filename) for filename in documents ]
+    finally:
+      _stop_worker()
+  import multiprocessing
+  pool = multiprocessing.Pool(processes, _start_worker, ( library, options_for, use_cache, remove, dry_run ))
+  try:
+    return pool.map(_run_document, documents, 1)  # one at a time, so a long document doesn't hold up a queue
+  finally:
+    pool.close()
+    pool.join()
+  
+  
+################################################################################
+###   The workers
+
+# what each worker needs, set when it starts
+_worker = {}
+
+def _start_worker(library, options_for, use_cache, remove, dry_run):
+  cache = None
+  if use_cache and not remove:
+    from bdtw.cache import RenderCache
+    try:
+      cache = RenderCache()
+    except Exception:
+      pass  # run without it
+  _worker.update(library=library, options_for=options_for, cache=cache, remove=remove, dry_run=dry_run)
+  
+  
+def _stop_worker():
+  if _worker.get('cache') != None:
+    _worker['cache'].close()
+  _worker.clear()
+  
+  
+def _run_document(filename):
+  '''Works on one document; never raises, since the result has to get back to the parent'''
+  from bdtw.docx import DocxDocument
+  result = DocumentResult(filename)
+  start = time.time()
+  ui = Interface()
+  try:
+    worddoc = DocxDocument.open_file(filename)
+    if _worker['remove']:
+      result.removed = remove_bibliography(worddoc, ui, _worker['dry_run'])
+    else:
+      options = _worker['options_for'](worddoc)
+      options.validate()
+      result.summary = create_bibliography(worddoc, _worker['library'], options, ui, _worker['cache'])
+    if not _worker['dry_run']:
+      worddoc.save()
+  except AssertionError, e:
+    result.error = str(e)
+  except Exception, e:
+    result.error = '%s: %s' % ( e.__class__.__name__, e )
+    result.traceback = traceback.format_exc()
+  result.warnings = ui.warnings
+  result.diagnostics = ui.diagnostics.report()
+  result.seconds = time.time() - start
+  return result
@@ -0,0 +1,133 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''A thin wrapper around the appscript reference to a BibDesk document.
+
+Like bdtw.word, this keeps the BibDesk Apple Events in one place.  The main
+thing it adds is the publication index: rather than asking BibDesk for each cite
+key separately, we fetch every cite key and publication of the document in bulk
+and resolve the keys ourselves.
+'''
+
+from bdtw import TIMEOUT
+from bdtw.cache import hash_text
+
+# appscript and mactypes are imported by the methods that talk to BibDesk, so runs
+# against a .bib file (and --help) never load them
+
+
+class PublicationIndex:
+  '''Maps cite keys to publications.  Keys are matched without regard to case,
+     the same as BibDesk does when asked for its.cite_key == key.  If the content
+     hashes were fetched along with the publications, they are kept too.'''
+  def __init__(self, citekeys, publications, hashes=None):
+    self.publications = {}   # lowercased cite key -> publication
+    self.duplicates = set()  # lowercased cite keys that more than one publication has
+    self.hashes = {}         # lowercased cite key -> content hash (when given)
+    if hashes == None:
+      hashes = [ None ] * len(citekeys)
+    for citekey, publication, pubhash in zip(citekeys, publications, hashes):
+      key = citekey.lower()
+      if key in self.publications:
+        self.duplicates.add(key)
+      else:
+        self.publications[key] = publication
+        if pubhash != None:
+          self.hashes[key] = pubhash
+        
+        
+  def __len__(self):
+    return len(self.publications)
+    
+    
+  def is_missing(self, citekey):
+    '''Returns whether no publication has the given cite key'''
+    return citekey.lower() not in self.publications
+    
+    
+  def is_duplicate(self, citekey):
+    '''Returns whether more than one publication has the given cite key'''
+    return citekey.lower() in self.duplicates
+    
+    
+  def get(self, citekey):
+    '''Returns the publication for a cite key, or None if the key is missing or ambiguous'''
+    key = citekey.lower()
+    if key in self.duplicates:
+      return None
+    return self.publications.get(key)
+    
+
+class BibDeskDocument:
+  '''Wraps an appscript reference to a BibDesk document'''
+  def __init__(self, bibdoc, name=None):
+    self.bibdoc = bibdoc
+    self.name = name  # the document name, which is what we store in the bibliography options
+    
+    
+  @classmethod
+  def named(cls, name):
+    '''Returns the open BibDesk document with the given name (the .bib may be left off)'''
+    from appscript import app, its
+    for candidate in ( name, name + '.bib' ):
+      docs = app('BibDesk').documents[its.name == candidate].get()
+      if len(docs) > 0:
+        return cls(docs[0], candidate)
+    assert False, 'Please ensure the selected BibDesk document (' + name + ') is open in BibDesk.'
+    
+    
+  def publication_index(self, citekeys=None):
+    '''Fetches the cite keys, publications, and BibTeX of the document in bulk and
+       indexes them (the BibTeX is hashed for content_hash, so the digest and the cache
+       don't have to ask publication by publication).  The citekeys argument is accepted
+       for compatibility with BibTeXLibrary; BibDesk gives us the whole document either way.'''
+    publications = self.bibdoc.publications.get(timeout=TIMEOUT)
+    citekeys = self.bibdoc.publications.cite_key.get(timeout=TIMEOUT)
+    bibtex = self.bibdoc.publications.BibTeX_string.get(timeout=TIMEOUT)
+    return PublicationIndex(citekeys, publications, [ hash_text(text) for text in bibtex ])
+    
+    
+  def sort_fields(self, publications):
+    '''Returns ( abbreviated normalized author names, cite key, year, title ) for each
+       publication (used for sorting).  Each is fetched for the whole document in one
+       request, which is far cheaper than asking publication by publication.'''
+    everything = self.bibdoc.publications
+    rows = zip(everything.authors.abbreviated_normalized_name.get(timeout=TIMEOUT),
+               everything.cite_key.get(timeout=TIMEOUT),
+               everything.fields[u'Year'].value.get(timeout=TIMEOUT),
+               everything.title.get(timeout=TIMEOUT))
+    byreference = dict(zip(everything.get(timeout=TIMEOUT), rows))
+    return [ byreference[publication] for publication in publications ]
+    
+    
+  def content_hash(self, publication):
+    '''Returns a hash of everything BibDesk knows about a publication (used as a cache key).
+       This asks for the one publication; publication_index hashes them all at once.'''
+    return hash_text(publication.BibTeX_string.get())
+    
+    
+  def templated_text(self, template, publications):
+    '''Has BibDesk format the publications with a text template'''
+    import mactypes
+    return self.bibdoc.templated_text(using=mactypes.File(template), for_=publications)
+    
+    
+  def export(self, filename, template, publications):
+    '''Has BibDesk format the publications with a rich text template into a file'''
+    import mactypes
+    self.bibdoc.export(to=mactypes.File(filename), using_template=mactypes.File(template), for_=publications)
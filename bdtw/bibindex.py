@@ -0,0 +1,304 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''A persistent, memory-mapped index of a .bib file.
+
+Resolving a document's citations against a .bib file means reading all of it,
+which takes seconds for a big library on every run, changed or not.  The index
+keeps what a lookup needs in a binary file of its own (next to the render
+cache, named for the .bib file's path), along with the size and modification
+time of the .bib file it was built from; when those change, it is rebuilt.
+It holds:
+
+  - the cite keys, lowercased and sorted, each with the byte offset and length
+    of its entry in the .bib file, a checksum of the entry's text, and the
+    entry's sort fields (what bdtw.sorting needs to know about it), and
+  - the file's @string macros.
+
+Both files are opened with mmap.  A lookup is a binary search of the key table,
+and only the entries a document cites are read and parsed.  A rebuild scans
+the whole file again, but entries whose text (and the macros) haven't changed
+keep their sort fields from the old index instead of being parsed.
+
+Entries looked up in the index are parsed with all of the file's macros, not
+just the ones defined above them, which only matters in a file that defines a
+macro twice.  The file has to be in an ASCII-compatible encoding such as UTF-8
+or Latin-1 (see index_supported).
+'''
+
+import hashlib, io, mmap, os, struct, tempfile, zlib
+
+from bdtw.bibtex import _parse_fields, _resolve_crossrefs, iter_entries, scan_entries
+from bdtw.cache import default_cache_path
+
+# the start of every index file; changes whenever the layout does
+MAGIC = 'BDTWIX01'
+
+# magic, .bib size and mtime, entry count, offset of the strings, offset and length of the macros, hash of the macros
+HEADER = struct.Struct('<8sQdIQQI20s')
+
+# one per entry, sorted by key: key offset and length (in the strings), entry offset and length
+# (in the .bib file), checksum of the entry's text, sort fields offset and length (in the strings)
+RECORD = struct.Struct('<IHQIIII')
+
+# separators in the stored sort fields and macros
+FIELD_SEPARATOR = u'\x1e'
+NAME_SEPARATOR = u'\x1f'
+
+
+def default_index_dir():
+  '''Returns where indexes are kept by default: beside the render cache'''
+  return os.path.join(os.path.dirname(default_cache_path()), 'bib-index')
+  
+
+def index_supported(encoding):
+  '''Returns whether files in an encoding can be indexed (the BibTeX syntax has to be plain ASCII bytes)'''
+  try:
+    return u'@{}()=,"#\n'.encode(encoding) == '@{}()=,"#\n'
+  except LookupError:
+    return False
+    
+    
+def index_path(bibfile, encoding, directory=None):
+  '''Returns the filename of the index of a .bib file'''
+  name = hashlib.sha1(os.path.abspath(bibfile).encode('utf-8') + '|' + encoding).hexdigest()[:20]
+  return os.path.join(directory or default_index_dir(), name + '.bdtwindex')
+  
+
+def open_index(bibfile, encoding='utf-8', directory=None):
+  '''Returns the BibIndex of a .bib file, building or rebuilding it first if it is
+     missing or out of date.  Raises IOError or OSError if that can't be done.'''
+  filename = index_path(bibfile, encoding, directory)
+  old = None
+  if os.path.exists(filename):
+    try:
+      old = BibIndex(filename, bibfile, encoding)
+    except ValueError:
+      pass  # damaged or from another version; start over
+    else:
+      if old.is_current():
+        return old
+  try:
+    build_index(bibfile, filename, encoding, old)
+  finally:
+    if old != None:
+      old.close()
+  return BibIndex(filename, bibfile, encoding)
+  
+  
+################################################################################
+###   Building
+
+def encode_sort_fields(fields):
+  '''Returns the stored form of an entry's sort fields (see bibtex.Entry.sort_fields)'''
+  authors, citekey, year, title = fields
+  return FIELD_SEPARATOR.join([ NAME_SEPARATOR.join(authors), citekey, year, title ]).encode('utf-8')
+  
+  
+def decode_sort_fields(data):
+  authors, citekey, year, title = data.decode('utf-8').split(FIELD_SEPARATOR)
+  return ( authors and authors.split(NAME_SEPARATOR) or [], citekey, year, title )
+  
+
+def _encode_macros(macros):
+  return FIELD_SEPARATOR.join([ name + NAME_SEPARATOR + value for name, value in sorted(macros.items()) ]).encode('utf-8')
+  
+
+def _parse_entry(text, macros):
+  '''Returns the Entry for the text of one entry'''
+  for entry in iter_entries(io.StringIO(text), macros):
+    return entry
+    
+    
+def build_index(bibfile, filename, encoding='utf-8', old=None):
+  '''Writes the index of a .bib file.  Sort fields are taken from old (a BibIndex of an
+     earlier version of the file) for entries that haven't changed.'''
+  f = open(bibfile, 'rb')
+  try:
+    st = os.fstat(f.fileno())
+    # first pass: find the entries and the macros, without parsing the entries
+    spans = []  # ( lowercased key, entry offset, entry length, checksum )
+    macros = {}
+    for entrytype, body, offset, length in scan_entries(f):
+      if entrytype == 'string':
+        for name, value in _parse_fields(body.decode(encoding, 'replace'), macros):
+          macros[name] = value
+        continue
+      comma = body.find(',')
+      key = (comma < 0 and body or body[:comma]).strip().decode(encoding, 'replace')
+      spans.append(( key.lower().encode('utf-8'), offset, length, zlib.crc32(body) & 0xffffffff ))
+    spans.sort()
+    macrodata = _encode_macros(macros)
+    macrohash = hashlib.sha1(macrodata).digest()
+    reusable = {}
+    if old != None and old.macrohash == macrohash:
+      reusable = old.sort_fields_by_checksum()
+      
+    # second pass: the sort fields of new and changed entries
+    bib = st.st_size > 0 and mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) or ''
+    strings = io.BytesIO()
+    records = []
+    for key, offset, length, checksum in spans:
+      sortdata = reusable.get(( key, checksum ))
+      if sortdata == None:
+        entry = _parse_entry(bib[offset:offset+length].decode(encoding, 'replace'), macros)
+        sortdata = 'crossref' not in entry.fields and encode_sort_fields(entry.sort_fields()) or ''  # (with a crossref, the parent's fields count)
+      keyoffset = strings.tell()
+      strings.write(key)
+      records.append(RECORD.pack(keyoffset, len(key), offset, length, checksum, strings.tell(), len(sortdata)))
+      strings.write(sortdata)
+    if bib:
+      bib.close()
+  finally:
+    f.close()
+    
+  # written to a temp file and renamed, so a reader never sees half an index
+  directory = os.path.dirname(filename)
+  if directory and not os.path.isdir(directory):
+    os.makedirs(directory)
+  stringsoffset = HEADER.size + RECORD.size * len(records)
+  macrosoffset = stringsoffset + strings.tell()
+  fd, tempname = tempfile.mkstemp(dir=directory or '.', suffix='.tmp')
+  out = os.fdopen(fd, 'wb')
+  try:
+    out.write(HEADER.pack(MAGIC, st.st_size, st.st_mtime, len(records), stringsoffset, macrosoffset, len(macrodata), macrohash))
+    out.write(''.join(records))
+    out.write(strings.getvalue())
+    out.write(macrodata)
+    out.close()
+    os.rename(tempname, filename)
+  except:
+    out.close()
+    os.remove(tempname)
+    raise
+    
+    
+################################################################################
+###   Reading
+
+class BibIndex:
+  '''An index file opened for lookups'''
+  def __init__(self, filename, bibfile, encoding='utf-8'):
+    self.filename = filename
+    self.bibfile = bibfile
+    self.encoding = encoding
+    f = open(filename, 'rb')
+    try:
+      self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+      f.close()
+    if len(self.data) < HEADER.size or self.data[:len(MAGIC)] != MAGIC:
+      self.data.close()
+      raise ValueError('Not a BibDeskToWord index: ' + filename)
+    magic, self.size, self.mtime, self.count, self.stringsoffset, macrosoffset, macroslength, self.macrohash = HEADER.unpack_from(self.data, 0)
+    self._macros = ( macrosoffset, macroslength )
+    self.macros = None  # parsed the first time an entry is read
+    
+    
+  def close(self):
+    self.data.close()
+    
+    
+  def is_current(self):
+    '''Returns whether the .bib file is still the one the index was made from'''
+    st = os.stat(self.bibfile)
+    return st.st_size == self.size and st.st_mtime == self.mtime
+    
+    
+  def _record(self, i):
+    return RECORD.unpack_from(self.data, HEADER.size + RECORD.size * i)
+    
+    
+  def _key(self, i):
+    keyoffset, keylength = RECORD.unpack_from(self.data, HEADER.size + RECORD.size * i)[:2]
+    start = self.stringsoffset + keyoffset
+    return self.data[start:start+keylength]
+    
+    
+  def find(self, citekey):
+    '''Returns the record numbers of the entries with a cite key (ignoring case)'''
+    key = citekey.lower().encode('utf-8')
+    lo, hi = 0, self.count
+    while lo < hi:  # (bisect_left, on the mapped table)
+      mid = ( lo + hi ) // 2
+      if self._key(mid) < key:
+        lo = mid + 1
+      else:
+        hi = mid
+    found = []
+    while lo < self.count and self._key(lo) == key:
+      found.append(lo)
+      lo += 1
+    return found
+    
+    
+  def entries(self, citekeys):
+    '''Returns the entries with the given cite keys, in file order, along with any
+       entries they crossref, with the crossref fields filled in'''
+    if self.macros == None:
+      self.macros = {}
+      offset, length = self._macros
+      for item in self.data[offset:offset+length].decode('utf-8').split(FIELD_SEPARATOR):
+        if item:
+          name, value = item.split(NAME_SEPARATOR, 1)
+          self.macros[name] = value
+    bib = None
+    f = open(self.bibfile, 'rb')
+    try:
+      if self.size > 0:
+        bib = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      entries = []
+      wanted, seen = list(citekeys), set()
+      while wanted:
+        found = []
+        for citekey in wanted:
+          if citekey.lower() not in seen:
+            seen.add(citekey.lower())
+            found.extend(self.find(citekey))
+        wanted = []
+        for i in found:
+          entry = self._entry(bib, i)
+          entries.append(( self._record(i)[2], entry ))
+          if 'crossref' in entry.fields:
+            wanted.append(entry.fields['crossref'])  # pick up the parents in another round
+    finally:
+      if bib != None:
+        bib.close()
+      f.close()
+    entries = [ entry for offset, entry in sorted(entries) ]
+    _resolve_crossrefs(entries)
+    return entries
+    
+    
+  def _entry(self, bib, i):
+    keyoffset, keylength, offset, length, checksum, sortoffset, sortlength = self._record(i)
+    entry = _parse_entry(bib[offset:offset+length].decode(self.encoding, 'replace'), self.macros)
+    if sortlength > 0:
+      start = self.stringsoffset + sortoffset
+      entry._sortfields = decode_sort_fields(self.data[start:start+sortlength])
+    return entry
+    
+    
+  def sort_fields_by_checksum(self):
+    '''Returns { ( key, checksum ): stored sort fields } for every entry, for reuse in a rebuild'''
+    stored = {}
+    for i in xrange(self.count):
+      keyoffset, keylength, offset, length, checksum, sortoffset, sortlength = self._record(i)
+      key = self.data[self.stringsoffset+keyoffset:self.stringsoffset+keyoffset+keylength]
+      stored[( key, checksum )] = self.data[self.stringsoffset+sortoffset:self.stringsoffset+sortoffset+sortlength]
+    return stored
@@ -0,0 +1,552 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''A small streaming reader for BibTeX files.
+
+This lets the program resolve citations straight from a .bib file instead of
+asking a running BibDesk for every publication.  The file is read in chunks
+and handed out one entry at a time, so only the current entry (plus the @string
+macros) is ever held as raw text.  Entries are split out with plain string
+searches and brace counting, which keeps even very large libraries fast.
+
+When only some cite keys are wanted, they are looked up in a persistent index
+of the file (bdtw.bibindex) instead, so an unchanged file is never read in full
+twice.
+
+Supported: @string macros (and the standard month macros), # concatenation,
+brace and quote delimited values, @comment/@preamble skipping, crossref
+inheritance, and BibTeX's rules for splitting author names into first, von,
+last and jr parts.
+'''
+
+import io, re, unicodedata
+
+from bdtw.bibdesk import PublicationIndex
+from bdtw.cache import hash_text
+from bdtw.template import load_template
+
+# how much of the file to read at a time
+CHUNK_SIZE = 256 * 1024
+
+# the standard macros every BibTeX style defines
+MONTH_MACROS = {
+  'jan': u'January', 'feb': u'February', 'mar': u'March', 'apr': u'April',
+  'may': u'May', 'jun': u'June', 'jul': u'July', 'aug': u'August',
+  'sep': u'September', 'oct': u'October', 'nov': u'November', 'dec': u'December',
+}
+
+# entry types that don't hold a publication
+SKIP_TYPES = ( 'comment', 'preamble' )
+
+ENTRY_START_RE = re.compile(r'@\s*([A-Za-z]+)\s*([{(])')
+FIELD_NAME_RE = re.compile(r'[\s,]*([^\s=,{}"#()]+)\s*=\s*')
+BARE_VALUE_RE = re.compile(r'[^\s,#{}"()]+')
+CONCAT_RE = re.compile(r'\s*#\s*')
+AND_RE = re.compile(r'\s+and\s+', re.IGNORECASE)
+BRACE_RE = re.compile(r'[{}]')
+
+
+################################################################################
+###   Converting TeX markup to plain text
+
+# accent commands and the unicode combining characters they stand for
+ACCENTS = {
+  '`': u'\u0300', "'": u'\u0301', '^': u'\u0302', '~': u'\u0303', '=': u'\u0304',
+  'u': u'\u0306', '.': u'\u0307', '"': u'\u0308', 'r': u'\u030a', 'H': u'\u030b',
+  'v': u'\u030c', 'd': u'\u0323', 'c': u'\u0327', 'k': u'\u0328', 'b': u'\u0331',
+}
+
+# commands that stand for a single character
+SYMBOLS = {
+  'ss': u'\u00df', 'o': u'\u00f8', 'O': u'\u00d8', 'ae': u'\u00e6', 'AE': u'\u00c6',
+  'oe': u'\u0153', 'OE': u'\u0152', 'aa': u'\u00e5', 'AA': u'\u00c5', 'l': u'\u0142',
+  'L': u'\u0141', 'i': u'\u0131', 'j': u'\u0237', '&': u'&', '%': u'%', '$': u'$',
+  '_': u'_', '#': u'#', '{': u'{', '}': u'}',
+}
+
+ACCENT_RE = re.compile(r'\\([`\'^~=".]|[uvHckbdr](?=[\s{]))\s*(?:\{\s*)?(\\[ij]\b|[A-Za-z])\s*\}?')
+SYMBOL_RE = re.compile(r'\\([A-Za-z]+|[&%$_#{}])\s?')
+DASHES = ( (u'---', u'\u2014'), (u'--', u'\u2013') )
+
+
+def _accent(m):
+  letter = m.group(2)
+  if letter.startswith('\\'):
+    letter = SYMBOLS.get(letter[1:], letter[1:])
+  return unicodedata.normalize('NFC', letter + ACCENTS[m.group(1)])
+  
+  
+def _symbol(m):
+  if m.group(1) in SYMBOLS:
+    return SYMBOLS[m.group(1)]
+  return m.group(0)  # leave other commands (\emph etc.) for the brace stripping below
+  
+  
+def detex(text):
+  '''Converts the common TeX accents and symbols in a value to unicode and drops grouping braces'''
+  if '\\' in text:
+    text = ACCENT_RE.sub(_accent, text)
+    text = SYMBOL_RE.sub(_symbol, text)
+    text = re.sub(r'\\[A-Za-z]+\s*', u'', text)  # any formatting commands we don't know
+  for tex, char in DASHES:
+    text = text.replace(tex, char)
+  text = text.replace(u'~', u'\u00a0')
+  return text.replace(u'{', u'').replace(u'}', u'')
+
+
+################################################################################
+###   Author names
+
+class Author:
+  '''One name from an author or editor list, split the way BibTeX splits it'''
+  def __init__(self, first, von, last, jr):
+    self.first = first
+    self.von = von
+    self.last = last
+    self.jr = jr
+    
+    
+  def __repr__(self):
+    return 'Author(%r)' % self.normalized_name
+    
+    
+  @property
+  def last_name(self):
+    '''The last name including any von part, e.g. "van Gogh"'''
+    return ' '.join([ p for p in ( self.von, self.last ) if p ])
+    
+    
+  @property
+  def normalized_name(self):
+    '''"von Last, Jr., First" -- the form BibDesk sorts by'''
+    parts = [ self.last_name ]
+    if self.jr:
+      parts.append(self.jr)
+    if self.first:
+      parts.append(self.first)
+    return ', '.join(parts)
+    
+    
+  @property
+  def abbreviated_normalized_name(self):
+    '''"von Last, Jr., F. M." -- same as normalized_name with initials for first names'''
+    parts = [ self.last_name ]
+    if self.jr:
+      parts.append(self.jr)
+    if self.first:
+      parts.append(' '.join([ _initial(name) for name in self.first.split() ]))
+    return ', '.join(parts)
+    
+    
+  def template_value(self, key):
+    '''Returns the value of a BibDesk template key (see bdtw.template)'''
+    if key == 'firstName':
+      return self.first
+    if key == 'vonPart':
+      return self.von
+    if key == 'lastName':
+      return self.last
+    if key == 'jrPart':
+      return self.jr
+    if key == 'name':  # First von Last, Jr
+      return ', '.join([ p for p in ( ' '.join([ p for p in ( self.first, self.last_name ) if p ]), self.jr ) if p ])
+    if key == 'normalizedName':
+      return self.normalized_name
+    if key == 'abbreviatedNormalizedName':
+      return self.abbreviated_normalized_name
+    return None
+    
+
+def _initial(name):
+  '''Returns the initial of a first name ("Jean-Paul" becomes "J.-P.")'''
+  return '-'.join([ part[:1] + '.' for part in name.split('-') if part ])
+
+
+def _split_depth0(text, sep_re):
+  '''Splits text on a regex, ignoring matches inside braces'''
+  parts = []
+  depth = 0
+  start = 0
+  pos = 0
+  for m in sep_re.finditer(text):
+    depth += text.count('{', pos, m.start()) - text.count('}', pos, m.start())
+    pos = m.start()
+    if depth == 0:
+      parts.append(text[start:m.start()])
+      start = m.end()
+  parts.append(text[start:])
+  return parts
+  
+  
+def _is_von(word):
+  '''BibTeX treats a word starting with a lowercase letter as part of the von part'''
+  for ch in re.sub(r'^\{*\\[A-Za-z]+\s*|[{}\\]', '', word):
+    if ch.isalpha():
+      return ch.islower()
+  return False
+  
+  
+def parse_name(name):
+  '''Splits a single name into an Author, following BibTeX's three name forms'''
+  parts = [ p.strip() for p in _split_depth0(name.strip(), re.compile(',')) ]
+  if len(parts) == 1:
+    # First von Last
+    words = _split_depth0(parts[0], re.compile(r'\s+'))
+    last = words[-1:]
+    rest = words[:-1]
+    vonidx = [ i for i, w in enumerate(rest) if _is_von(w) ]
+    if vonidx:
+      first, von, last = rest[:vonidx[0]], rest[vonidx[0]:vonidx[-1]+1], rest[vonidx[-1]+1:] + last
+    else:
+      first, von = rest, []
+    jr = []
+  else:
+    # von Last, First   or   von Last, Jr, First
+    words = _split_depth0(parts[0], re.compile(r'\s+'))
+    vonidx = [ i for i, w in enumerate(words[:-1]) if _is_von(w) ]
+    split = vonidx and vonidx[-1] + 1 or 0
+    von, last = words[:split], words[split:]
+    if len(parts) == 2:
+      jr, first = [], parts[1].split()
+    else:
+      jr, first = parts[1].split(), ', '.join(parts[2:]).split()
+  return Author(*[ detex(' '.join(p)) for p in ( first, von, last, jr ) ])
+  
+  
+def parse_names(value):
+  '''Splits an author or editor field into a list of Authors'''
+  value = value.strip()
+  if value == '':
+    return []
+  return [ parse_name(name) for name in _split_depth0(value, AND_RE) if name.strip() not in ( '', 'others' ) ]
+  
+
+################################################################################
+###   Entries
+
+class Entry:
+  '''A single publication from the .bib file'''
+  def __init__(self, entrytype, citekey, fields):
+    self.type = entrytype     # article, book, ... (lowercase)
+    self.citekey = citekey
+    self.fields = fields      # lowercase field name -> raw value (macros expanded, TeX kept)
+    self._authors = None
+    self._sortfields = None   # see sort_fields (bdtw.bibindex fills this in from its index)
+    
+    
+  def __repr__(self):
+    return 'Entry(%r)' % self.citekey
+    
+    
+  def field(self, name):
+    '''Returns the plain-text value of a field (TeX converted), or '' if it isn't set'''
+    return detex(self.fields.get(name.lower(), u''))
+    
+    
+  def sort_fields(self):
+    '''Returns ( abbreviated normalized author names, cite key, year, title ), which is
+       what bdtw.sorting needs to know about an entry'''
+    if self._sortfields == None:
+      self._sortfields = ( [ a.abbreviated_normalized_name for a in self.authors ], self.citekey, self.field('year'), self.field('title') )
+    return self._sortfields
+    
+    
+  @property
+  def authors(self):
+    '''The parsed author list, falling back to the editors when there are no authors'''
+    if self._authors == None:
+      self._authors = parse_names(self.fields.get('author') or self.fields.get('editor') or u'')
+    return self._authors
+    
+    
+  def template_value(self, key):
+    '''Returns the value of a BibDesk template key (see bdtw.template)'''
+    if key == 'fields':
+      return _TemplateFields(self)
+    if key == 'citeKey':
+      return self.citekey
+    if key == 'pubType':
+      return self.type
+    if key == 'authors':
+      return 'author' in self.fields and self.authors or []
+    if key == 'editors':
+      return parse_names(self.fields.get('editor', u''))
+    if key == 'authorsOrEditors':
+      return self.authors
+    if key == 'title':
+      return self.field('title')
+    return None
+    
+
+class _TemplateFields:
+  '''The fields key of an Entry in a template: <$fields.Year/>'''
+  def __init__(self, entry):
+    self.entry = entry
+    
+    
+  def template_value(self, key):
+    return self.entry.field(key)
+    
+
+def iter_entries(fileobj, macros=None, chunk_size=CHUNK_SIZE):
+  '''Reads a .bib file object incrementally and yields an Entry for each publication.
+     @string definitions are added to the macros dictionary as they are seen.'''
+  if macros == None:
+    macros = {}
+  for entrytype, body, offset, length in scan_entries(fileobj, chunk_size):
+    if entrytype == 'string':
+      for name, value in _parse_fields(body, macros):
+        macros[name] = value
+      continue
+    yield make_entry(entrytype, body, macros)
+    
+    
+def scan_entries(fileobj, chunk_size=CHUNK_SIZE):
+  '''Reads a .bib file object incrementally and yields ( entry type, body, offset, length )
+     for each @entry (@string included, @comment and @preamble skipped).  The body is
+     what is between the entry's braces; offset and length locate the whole entry,
+     from the @ to the closing brace, in the file.  Works the same on a text file
+     (unicode, offsets in characters) and on a binary one (bytes, offsets in bytes);
+     the syntax characters are all ASCII, so an ASCII-compatible encoding can be
+     scanned without decoding it.'''
+  buf = fileobj.read(0)  # u'' or ''
+  base = 0  # offset of buf in the file
+  pos = 0
+  eof = False
+  while True:
+    start = buf.find('@', pos)
+    m = end = None
+    if start >= 0:
+      m = ENTRY_START_RE.match(buf, start)
+      if m == None and (eof or len(buf) - start >= 100):
+        pos = start + 1  # a stray @ outside of an entry
+        continue
+      if m != None:
+        end = _entry_end(buf, m.end(), m.group(2) == '(' and ')' or '}')
+        if end < 0 and eof:
+          end = len(buf)  # unterminated last entry -- take what is there
+    elif eof:
+      return
+    if m == None or end < 0:
+      # we need more of the file; keep only what we haven't used yet
+      keep = len(buf)
+      if start >= 0:
+        keep = start
+      base += keep
+      buf = buf[keep:]
+      pos = 0
+      more = fileobj.read(chunk_size)
+      eof = len(more) == 0
+      buf += more
+      continue
+    pos = end + 1
+    entrytype = m.group(1).lower()
+    if entrytype in SKIP_TYPES:
+      continue
+    yield entrytype, buf[m.end():end], base + start, min(end + 1, len(buf)) - start
+      
+      
+def make_entry(entrytype, body, macros):
+  '''Returns the Entry for the body of an entry (the text between its braces)'''
+  comma = body.find(u',')
+  if comma < 0:
+    citekey, body = body.strip(), u''
+  else:
+    citekey, body = body[:comma].strip(), body[comma+1:]
+  return Entry(entrytype, citekey, dict(_parse_fields(body, macros)))
+  
+  
+def _entry_end(buf, pos, closer):
+  '''Returns the index of the character that closes the entry starting at pos, or -1
+     if the buffer doesn't hold the whole entry yet'''
+  search = pos
+  while True:
+    nextentry = buf.find('\n@', search)
+    stop = nextentry < 0 and len(buf) or nextentry
+    depth = 1 + buf.count('{', pos, stop) - buf.count('}', pos, stop)
+    if closer == '}' and depth == 0 or closer == ')' and depth == 1:
+      return buf.rfind(closer, pos, stop)
+    if nextentry < 0:
+      return -1
+    search = nextentry + 1
+    
+    
+def _parse_fields(body, macros):
+  '''Yields (name, value) for each "name = value" in an entry body'''
+  pos = 0
+  length = len(body)
+  while pos < length:
+    m = FIELD_NAME_RE.match(body, pos)
+    if m == None:
+      return
+    name = m.group(1).lower()
+    pos = m.end()
+    pieces = []
+    while pos < length:
+      ch = body[pos]
+      if ch == u'{':
+        end = _matching_brace(body, pos)
+        pieces.append(body[pos+1:end])
+        pos = end + 1
+      elif ch == u'"':
+        end = _closing_quote(body, pos)
+        pieces.append(body[pos+1:end])
+        pos = end + 1
+      else:
+        bare = BARE_VALUE_RE.match(body, pos)
+        if bare == None:
+          break
+        word = bare.group(0)
+        if word.isdigit():
+          pieces.append(word)
+        else:
+          pieces.append(macros.get(word.lower(), MONTH_MACROS.get(word.lower(), word)))
+        pos = bare.end()
+      concat = CONCAT_RE.match(body, pos)
+      if concat == None:
+        break
+      pos = concat.end()
+    yield name, u''.join(pieces)
+    
+    
+def _matching_brace(text, pos):
+  '''Returns the index of the brace closing the one at pos'''
+  depth = 0
+  for m in BRACE_RE.finditer(text, pos):
+    depth += m.group(0) == u'{' and 1 or -1
+    if depth == 0:
+      return m.start()
+  return len(text)
+  
+
+def _closing_quote(text, pos):
+  '''Returns the index of the double quote ending the value that starts at pos
+     (quotes inside braces don't count)'''
+  depth = 0
+  for i in range(pos+1, len(text)):
+    ch = text[i]
+    if ch == u'{':
+      depth += 1
+    elif ch == u'}':
+      depth -= 1
+    elif ch == u'"' and depth == 0:
+      return i
+  return len(text)
+  
+
+################################################################################
+###   The library backend
+
+class BibTeXLibrary:
+  '''A .bib file used in place of a BibDesk document to resolve citations'''
+  def __init__(self, filename, encoding='utf-8', indexed=True):
+    self.filename = filename
+    self.name = filename  # what we store in the bibliography options
+    self.encoding = encoding
+    self.indexed = indexed  # look cite keys up in a persistent index of the file (see bdtw.bibindex)
+    self.loaded = None  # the index of the whole file, once load has been called
+    
+    
+  def load(self):
+    '''Reads the whole file now, and answers publication_index from memory from then on.
+       Worth it when one library serves many documents.'''
+    self.loaded = None
+    self.loaded = self.publication_index()
+    
+    
+  def entries(self, citekeys=None):
+    '''Returns the entries of the file, with crossref fields filled in.  If citekeys is
+       given, only those entries (and the entries they crossref) are kept in memory.'''
+    wanted = citekeys != None and set([ key.lower() for key in citekeys ]) or None
+    entries = self._read(wanted)
+    if wanted != None:
+      # pick up crossref parents we skipped over on the first pass
+      parents = set([ e.fields['crossref'].lower() for e in entries if 'crossref' in e.fields ])
+      parents -= set([ e.citekey.lower() for e in entries ])
+      if parents:
+        entries.extend(self._read(parents))
+    _resolve_crossrefs(entries)
+    return entries
+    
+    
+  def _read(self, wanted):
+    f = io.open(self.filename, encoding=self.encoding, errors='replace')
+    try:
+      return [ e for e in iter_entries(f) if wanted == None or e.citekey.lower() in wanted ]
+    finally:
+      f.close()
+      
+      
+  def publication_index(self, citekeys=None):
+    '''Returns a PublicationIndex of the entries, the same as BibDeskDocument.publication_index'''
+    if self.loaded != None:
+      return self.loaded
+    entries = None
+    if citekeys != None and self.indexed:
+      entries = self._indexed_entries(citekeys)
+    if entries == None:
+      entries = self.entries(citekeys)
+    return PublicationIndex([ e.citekey for e in entries ], entries)
+    
+    
+  def _indexed_entries(self, citekeys):
+    '''Returns the entries for some cite keys by way of the file's index (building it
+       if need be), or None if the file can't be indexed'''
+    from bdtw.bibindex import index_supported, open_index  # (bdtw.bibindex imports this module)
+    if not index_supported(self.encoding):
+      return None
+    try:
+      index = open_index(self.filename, self.encoding)
+    except ( IOError, OSError ):
+      return None  # we just read the file instead
+    try:
+      return index.entries(citekeys)
+    finally:
+      index.close()
+    
+    
+  def sort_fields(self, publications):
+    '''Returns ( abbreviated normalized author names, cite key, year, title ) for each
+       entry (used for sorting), the same as BibDeskDocument.sort_fields'''
+    return [ p.sort_fields() for p in publications ]
+    
+    
+  def content_hash(self, publication):
+    '''Returns a hash of the type, key, and fields of an entry (used as a cache key)'''
+    parts = [ publication.type, publication.citekey ] + [ name + '=' + value for name, value in sorted(publication.fields.items()) ]
+    return hash_text(u'\n'.join(parts))
+    
+    
+  def templated_text(self, template, publications):
+    '''Formats entries with a .txt template, the way BibDesk would (see bdtw.template)'''
+    return load_template(template).render(publications)
+    
+    
+  def export(self, filename, template, publications):
+    assert False, 'Rich text templates need BibDesk; please use .txt templates or open the file in BibDesk and select it there.'
+    
+
+def _resolve_crossrefs(entries):
+  '''Copies fields the entries don't have from the entries they crossref'''
+  bykey = dict([ ( e.citekey.lower(), e ) for e in entries ])
+  for entry in entries:
+    parent = bykey.get(entry.fields.get('crossref', u'').lower())
+    if parent != None and parent is not entry:
+      for name, value in parent.fields.items():
+        if name not in entry.fields:
+          entry.fields[name] = value
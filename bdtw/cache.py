@@ -0,0 +1,257 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''A persistent cache of formatted citation and bibliography text.
+
+Formatting is the slowest thing we ask BibDesk to do, and most of it gives the
+same answer on every run: a citation only formats differently when its template,
+its publications, or its numbers change.  The cache remembers BibDesk's output
+keyed on exactly those three things, so re-running after a small edit only
+formats what actually changed.
+
+The cache is a SQLite file.  SQLite does the locking, so several copies of the
+program (or several batch workers) can share one cache safely.  Within a run,
+the cache may be used from the thread that formats citations ahead of the
+writes (see bdtw.prefetch) as well as the one that made it, one at a time.  Entries are
+evicted least recently used first once the file grows past its size limit.
+'''
+
+import hashlib, os, sqlite3, sys, threading, time
+
+from bdtw.template import fill_indices, fill_indices_in_file
+
+# default upper limit on the total size of the cached output
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# part of every key; changes whenever what gets stored changes (2: numbers filled in)
+CACHE_FORMAT = '2'
+
+# how long to wait for another process to release the cache before giving up
+LOCK_TIMEOUT = 30
+
+
+def default_cache_path():
+  '''Returns where the cache lives by default: ~/Library/Caches on the Mac, ~/.cache elsewhere'''
+  if sys.platform == 'darwin':
+    base = os.path.join(os.path.expanduser('~'), 'Library', 'Caches')
+  else:
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+  return os.path.join(base, 'BibDeskToWord', 'render-cache.sqlite')
+  
+
+def hash_text(text):
+  '''Returns a hex digest of a (unicode or byte) string'''
+  if isinstance(text, unicode):
+    text = text.encode('utf-8')
+  return hashlib.sha1(text).hexdigest()
+  
+
+def file_hash(filename):
+  '''Returns a hex digest of a file's contents'''
+  f = open(filename, 'rb')
+  try:
+    return hash_text(f.read())
+  finally:
+    f.close()
+    
+
+class RenderCache:
+  '''Formatted output keyed on template content, publication content, and citation numbers'''
+  def __init__(self, filename=None, max_bytes=DEFAULT_MAX_BYTES):
+    self.filename = filename or default_cache_path()
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self._templates = {}  # (path, size, mtime) -> content hash
+    self._used = {}       # key -> when it was last read, not yet written to the database (see flush)
+    dirname = os.path.dirname(self.filename)
+    if dirname and not os.path.isdir(dirname):
+      os.makedirs(dirname)
+    self._lock = threading.Lock()  # the connection is shared between threads, one statement at a time
+    self.db = sqlite3.connect(self.filename, timeout=LOCK_TIMEOUT, check_same_thread=False)
+    self.db.text_factory = str
+    try:
+      self.db.execute('PRAGMA journal_mode=WAL')  # readers don't block the writer
+    except sqlite3.DatabaseError:
+      pass
+    self.db.execute('CREATE TABLE IF NOT EXISTS renders (key TEXT PRIMARY KEY, value BLOB, size INTEGER, used REAL)')
+    self.db.execute('CREATE INDEX IF NOT EXISTS renders_used ON renders (used)')
+    self.db.commit()
+    
+    
+  def close(self):
+    self.flush()
+    self.db.close()
+    
+    
+  def flush(self):
+    '''Writes when the entries read since the last flush were used, in one transaction.
+       (Reads only note the time, so a warm run doesn't commit once per field.)'''
+    self._lock.acquire()
+    try:
+      self._write_used()
+      self.db.commit()
+    finally:
+      self._lock.release()
+      
+      
+  def _write_used(self):
+    if self._used:
+      self.db.executemany('UPDATE renders SET used = ? WHERE key = ?', [ ( used, key ) for key, used in self._used.items() ])
+      self._used = {}
+    
+    
+  def template_hash(self, template):
+    '''Returns the content hash of a template file (remembered while the file is unchanged)'''
+    st = os.stat(template)
+    statkey = ( template, st.st_size, st.st_mtime )
+    if statkey not in self._templates:
+      self._templates[statkey] = file_hash(template)
+    return self._templates[statkey]
+    
+    
+  def key(self, kind, template, pubhashes, citenums):
+    '''Returns the cache key for formatting the given publications (by content hash) with
+       a template.  The kind keeps text and exported output apart.'''
+    parts = [ CACHE_FORMAT, kind, self.template_hash(template), ','.join(pubhashes), ','.join([ str(n) for n in citenums ]) ]
+    return hash_text('|'.join(parts))
+    
+    
+  def get(self, key):
+    '''Returns the cached value for a key, or None'''
+    self._lock.acquire()
+    try:
+      row = self.db.execute('SELECT value FROM renders WHERE key = ?', ( key, )).fetchone()
+      if row == None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self._used[key] = time.time()
+      return str(row[0])
+    finally:
+      self._lock.release()
+    
+    
+  def put(self, key, value):
+    '''Stores a value (a byte string) and evicts old entries if the cache is too big'''
+    self._lock.acquire()
+    try:
+      self.db.execute('INSERT OR REPLACE INTO renders (key, value, size, used) VALUES (?, ?, ?, ?)', ( key, sqlite3.Binary(value), len(value), time.time() ))
+      self._evict()
+      self.db.commit()
+    finally:
+      self._lock.release()
+    
+    
+  def _evict(self):
+    '''Removes the least recently used entries until the cache is back under its limit'''
+    total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM renders').fetchone()[0]
+    if total <= self.max_bytes:
+      return
+    target = total - self.max_bytes * 0.9  # free a bit extra so we don't evict on every put
+    self._write_used()  # (so entries read this run count as recently used)
+    doomed = []
+    for key, size in self.db.execute('SELECT key, size FROM renders ORDER BY used'):
+      doomed.append(( key, ))
+      target -= size
+      if target <= 0:
+        break
+    self.db.executemany('DELETE FROM renders WHERE key = ?', doomed)
+    
+    
+  def stats(self):
+    '''Returns a dictionary of counters describing the cache'''
+    count, size = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM renders').fetchone()
+    return { 'hits': self.hits, 'misses': self.misses, 'entries': count, 'bytes': size }
+    
+
+class CachingLibrary:
+  '''Wraps a library (BibDeskDocument or BibTeXLibrary) so its formatting goes through
+     a RenderCache.  Everything else is passed straight through to the library.
+     With no cache, formatting is passed straight through as well.  Either way,
+     the citation numbers are filled in before the text is returned.'''
+  def __init__(self, library, cache):
+    self.library = library
+    self.cache = cache
+    self._pubhashes = {}  # repr of publication -> content hash
+    
+    
+  def __getattr__(self, name):
+    return getattr(self.library, name)
+    
+    
+  def publication_index(self, citekeys=None):
+    '''Returns the library's publication index, keeping any content hashes it came with'''
+    index = self.library.publication_index(citekeys)
+    for key, pubhash in index.hashes.items():
+      self._pubhashes[repr(index.publications[key])] = pubhash
+    return index
+    
+    
+  def content_hash(self, publication):
+    '''Returns the library's content hash of a publication, asking only once per publication'''
+    pubkey = repr(publication)
+    if pubkey not in self._pubhashes:
+      self._pubhashes[pubkey] = self.library.content_hash(publication)
+    return self._pubhashes[pubkey]
+    
+    
+  def _key(self, kind, template, publications, citenums):
+    pubhashes = [ self.content_hash(publication) for publication in publications ]
+    return self.cache.key(kind, template, pubhashes, citenums)
+    
+    
+  def flush(self):
+    '''Writes out what the cache has noted during the run (see RenderCache.flush)'''
+    if self.cache != None:
+      self.cache.flush()
+      
+      
+  def templated_text(self, template, publications, citenums=()):
+    if self.cache == None:
+      return fill_indices(self.library.templated_text(template, publications), citenums)
+    key = self._key('text', template, publications, citenums)
+    text = self.cache.get(key)
+    if text != None:
+      return text.decode('utf-8')
+    text = fill_indices(self.library.templated_text(template, publications), citenums)
+    self.cache.put(key, text.encode('utf-8'))
+    return text
+    
+    
+  def export(self, filename, template, publications, citenums=()):
+    if self.cache == None:
+      self.library.export(filename, template, publications)
+      fill_indices_in_file(filename, citenums)
+      return
+    key = self._key('export', template, publications, citenums)
+    data = self.cache.get(key)
+    if data == None:
+      self.library.export(filename, template, publications)
+      fill_indices_in_file(filename, citenums)
+      f = open(filename, 'rb')
+      try:
+        self.cache.put(key, f.read())
+      finally:
+        f.close()
+    else:
+      f = open(filename, 'wb')
+      try:
+        f.write(data)
+      finally:
+        f.close()
@@ -0,0 +1,113 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''The citations of a document, held compactly.
+
+A long document cites the same few thousand keys tens of thousands of times.
+CitationTable gives each distinct cite key a small integer id the first time
+it turns up; from then on a cite field's keys are a tuple of ids (its keyids),
+and what the pipeline learns about a key -- its publication and its number in
+the bibliography -- lives in lists and arrays indexed by id rather than in an
+object per key or a dictionary per field.
+'''
+
+from array import array
+
+
+class CitationTable(object):
+  '''Cite keys by id, with the publication and bibliography number of each.  Keys
+     that resolve to a publication are the citations; they go in the bibliography.'''
+  __slots__ = ( 'ids', 'citekeys', 'publications', 'pubhashes', 'order', 'citenums' )
+  
+  def __init__(self):
+    self.ids = {}                # cite key -> id
+    self.citekeys = []           # id -> cite key, in order of first appearance
+    self.publications = []       # id -> publication, or None if the key hasn't resolved
+    self.pubhashes = []          # id -> content hash of the publication ('' if the key hasn't resolved)
+    self.order = array('l')      # ids of the citations, in bibliography order
+    self.citenums = array('l')   # id -> number in the bibliography (0: not in it), once numbered
+    
+    
+  def __len__(self):
+    '''Returns the number of citations'''
+    return len(self.order)
+    
+    
+  def intern(self, citekeys):
+    '''Returns the ids of some cite keys as a tuple, giving new keys the next ids'''
+    ids = self.ids
+    group = []
+    for citekey in citekeys:
+      id = ids.get(citekey)
+      if id == None:
+        id = ids[citekey] = len(self.citekeys)
+        self.citekeys.append(citekey)
+        self.publications.append(None)
+        self.pubhashes.append('')
+      group.append(id)
+    return tuple(group)
+    
+    
+  def resolve(self, id, publication, pubhash):
+    '''Makes a key a citation of a publication (with the given content hash), after the citations so far'''
+    self.publications[id] = publication
+    self.pubhashes[id] = pubhash
+    self.order.append(id)
+    
+    
+  def sort(self, sortindex, code):
+    '''Puts the citations in a reference order, using a bdtw.sorting.SortKeyIndex'''
+    positions = sortindex.order(self.publications_of(self.order), code)
+    if positions != None:
+      order = self.order
+      self.order = array('l', [ order[i] for i in positions ])
+      
+      
+  def number(self):
+    '''Numbers the citations 1, 2, 3... in bibliography order'''
+    citenums = array('l', [ 0 ]) * len(self.citekeys)
+    for num, id in enumerate(self.order):
+      citenums[id] = num + 1
+    self.citenums = citenums
+    
+    
+  def cited(self, group):
+    '''Returns the ids in a group that are citations, in field order'''
+    citenums = self.citenums
+    return [ id for id in group if citenums[id] ]
+    
+    
+  def by_number(self, group):
+    '''Returns the ids in a group that are citations, in bibliography order'''
+    return sorted(self.cited(group), key=self.citenums.__getitem__)
+    
+    
+  def citekeys_of(self, ids):
+    return [ self.citekeys[id] for id in ids ]
+    
+    
+  def publications_of(self, ids):
+    return [ self.publications[id] for id in ids ]
+    
+    
+  def pubhashes_of(self, ids):
+    return [ self.pubhashes[id] for id in ids ]
+    
+    
+  def citenums_of(self, ids):
+    return [ self.citenums[id] for id in ids ]
@@ -0,0 +1,269 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Runs the program from the command line, without the GUI.
+
+    python -m bdtw.cli [options] [document ...]
+
+Each document is opened, its bibliography is created or updated, and it is
+saved and closed.  .docx files are worked on directly (see bdtw.docx), other
+documents through Word.  Without documents, the frontmost Word document is
+used (and left open).  Directories are searched for .docx files, and with
+--jobs the documents are spread over a pool of processes (see bdtw.batch).
+Settings not given on the command line are taken from the document's
+bibliography field, as the dialog does.  One summary line is printed per
+document, and the exit status is 0 when every document worked, 1 when any
+failed, 2 for bad arguments, and 3 (with --strict) when there were warnings
+such as unknown cite keys.  Problem citations never stop a run; --report
+writes all of them, with their offsets, to a JSON file (see bdtw.diagnostics).
+
+Only the modules a run needs are imported, so the command starts quickly.
+'''
+
+import json, optparse, os, sys, time, traceback
+
+from bdtw.batch import find_documents, run_batch
+from bdtw.fields import find_bibliography_options
+from bdtw.pipeline import DEFAULT_BIB_CHUNK, REFERENCE_ORDERS, Interface, Options, create_bibliography, open_library, remove_bibliography
+
+
+# exit statuses
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_WARNINGS = 3
+
+
+class ConsoleInterface(Interface):
+  '''Reports progress and warnings on the console; never asks anything'''
+  def __init__(self, docname, verbose=False):
+    Interface.__init__(self)
+    self.docname = docname
+    self.verbose = verbose
+    
+    
+  def progress(self, stage, message):
+    if self.verbose:
+      print >>sys.stderr, '%s: %s' % ( self.docname, message )
+      
+      
+  def warn(self, message, title):
+    Interface.warn(self, message, title)
+    print >>sys.stderr, '%s: warning: %s' % ( self.docname, message )
+    
+
+def option_parser():
+  '''Returns the parser for the command line'''
+  parser = optparse.OptionParser(usage='%prog [options] [document ...]', 
+    description='Creates or updates the bibliography of Word documents. Settings that are not given are read from the bibliography stored in each document.')
+  parser.add_option('-b', '--bib', dest='bibfile', metavar='SOURCE', help='BibDesk document name or path to a .bib file')
+  parser.add_option('--bib-template', dest='bibtemplate', metavar='FILE', help='template for the bibliography')
+  parser.add_option('--citep-template', dest='citeptemplate', metavar='FILE', help='template for \\cite and \\citep')
+  parser.add_option('--citet-template', dest='citettemplate', metavar='FILE', help='template for \\citet (defaults to the \\cite template)')
+  parser.add_option('-s', '--sort', dest='ref_order', metavar='ORDER', choices=[ r[0] for r in REFERENCE_ORDERS ],
+    help='bibliography order: ' + ', '.join([ r[0] for r in REFERENCE_ORDERS ]))
+  parser.add_option('--rebuild', dest='incremental', action='store_false', default=True, help='reformat every citation, not just the ones that changed')
+  parser.add_option('--no-cache', dest='cache', action='store_false', default=True, help='do not use the cache of formatted output')
+  parser.add_option('--bib-chunk', type='int', default=DEFAULT_BIB_CHUNK, metavar='N',
+    help='put N references into the bibliography at a time (0 for all at once; default %d)' % DEFAULT_BIB_CHUNK)
+  parser.add_option('-j', '--jobs', type='int', default=1, metavar='N',
+    help='work on N .docx files at a time (0 for one per processor); needs --bib')
+  parser.add_option('-m', '--manifest', action='append', default=[], metavar='FILE', help='also work on the documents listed in FILE, one per line')
+  parser.add_option('--use-word', action='store_true', default=False, help='open .docx files in Word instead of working on them directly')
+  parser.add_option('--remove', action='store_true', default=False, help='remove the bibliography fields, turning them back into \\cite text')
+  parser.add_option('-n', '--dry-run', action='store_true', default=False, help='with --remove, only count the fields that would be removed')
+  parser.add_option('--profile', metavar='FILE', help='write a report of the Apple Events sent to FILE (JSON)')
+  parser.add_option('--placeholders', action='store_true', default=False, help='show unresolved cite keys in the text as [key?]')
+  parser.add_option('--report', metavar='FILE', help='write every problem citation found, per document, to FILE (JSON)')
+  parser.add_option('--strict', action='store_true', default=False, help='exit with status 3 if there were warnings')
+  parser.add_option('-v', '--verbose', action='store_true', default=False, help='print progress')
+  return parser
+  
+  
+def is_docx(filename):
+  '''Whether a document can be worked on without Word'''
+  return os.path.splitext(filename)[1].lower() == '.docx'
+  
+  
+def run_options(args, stored):
+  '''Combines the command line with the stored settings; the command line wins'''
+  def pick(value, key, default=''):
+    if value != None:
+      return value
+    return stored.get(key, default)
+  citeptemplate = pick(args.citeptemplate, 'citep_template')
+  return Options(pick(args.bibfile, 'bib_file'), pick(args.bibtemplate, 'bib_template'), citeptemplate, 
+                 pick(args.citettemplate, 'citet_template', citeptemplate), pick(args.ref_order, 'ref_order', 'Appearance'), args.incremental, args.placeholders,
+                 bib_chunk=args.bib_chunk)
+  
+  
+def format_summary(summary):
+  '''Returns the one-line description of a run'''
+  text = '%s citations in %s fields, %s reformatted' % ( summary['citations'], summary['fields'], summary['formatted'] )
+  if summary['bibliography']:
+    text += ', bibliography updated'
+  else:
+    text += ', bibliography unchanged'
+  if summary.get('problems'):
+    text += ', %s citation problem%s' % ( summary['problems'], summary['problems'] != 1 and 's' or '' )
+  return text
+  
+  
+def write_report(filename, reports):
+  '''Writes the problems found in each document (a dictionary of document name ->
+     Diagnostics.report()) to a JSON file'''
+  f = open(filename, 'w')
+  try:
+    json.dump(reports, f, indent=2, sort_keys=True)
+  finally:
+    f.close()
+  
+  
+def main(argv=None):
+  '''Runs the command line; returns the exit status'''
+  parser = option_parser()
+  try:
+    args, documents = parser.parse_args(argv)
+  except SystemExit, e:  # optparse exits on bad arguments (and --help)
+    return e.code
+  documents = find_documents(documents, args.manifest)
+  if args.jobs != 1:
+    if ( args.bibfile == None and not args.remove ) or args.use_word or args.profile or [ filename for filename in documents if not is_docx(filename) ]:
+      print >>sys.stderr, '--jobs needs .docx documents (and --bib), and cannot be used with --use-word or --profile'
+      return EXIT_USAGE
+    return run_batch_command(args, documents)
+  
+  # Word is only needed once we're sure the arguments are good, and not for .docx files
+  if args.use_word or [ filename for filename in documents if not is_docx(filename) ] or not documents:
+    try:
+      from bdtw.word import WordDocument
+    except ImportError, e:
+      print >>sys.stderr, 'appscript is needed to work with Word documents (%s)' % e
+      return EXIT_FAILED
+  cache = None
+  if args.cache and not args.remove:
+    from bdtw.cache import RenderCache
+    try:
+      cache = RenderCache()
+    except Exception, e:
+      print >>sys.stderr, 'warning: the cache could not be opened (%s)' % e
+  profiler = None
+  if args.profile:
+    from bdtw.profiler import Profiler
+    profiler = Profiler()
+    
+  status = EXIT_OK
+  libraries = {}  # one library per bib source, shared by all documents
+  citations = 0
+  reports = {}    # document -> the problems found in it
+  try:
+    for filename in documents or [ None ]:
+      docname = filename and os.path.basename(filename) or 'active document'
+      start = time.time()
+      try:
+        if filename and is_docx(filename) and not args.use_word:
+          from bdtw.docx import DocxDocument
+          worddoc = DocxDocument.open_file(filename)
+        elif filename:
+          worddoc = WordDocument.open_file(filename)
+        else:
+          worddoc = WordDocument.active()
+        if profiler != None:
+          worddoc = profiler.attach(worddoc)
+        ui = ConsoleInterface(docname, args.verbose)
+        if profiler != None:
+          ui = profiler.interface(ui)
+        done = False
+        try:
+          if args.remove:
+            removed = remove_bibliography(worddoc, ui, args.dry_run)
+            print '%s: %s fields %s (%0.1f s)' % ( docname, removed, args.dry_run and 'would be removed' or 'removed', time.time() - start )
+          else:
+            options = run_options(args, find_bibliography_options(worddoc))
+            options.validate()
+            if profiler != None:
+              options.render_ahead = 0  # format in step with the writes, so each event is charged to its own field
+            if not libraries.has_key(options.bibfile):
+              libraries[options.bibfile] = open_library(options.bibfile)
+              if profiler != None:
+                libraries[options.bibfile] = profiler.attach(libraries[options.bibfile])
+            summary = create_bibliography(worddoc, libraries[options.bibfile], options, ui, cache)
+            citations += summary['citations']
+            print '%s: %s (%0.1f s)' % ( docname, format_summary(summary), time.time() - start )
+          done = not args.dry_run
+        finally:
+          if filename:  # documents we opened are only saved if the run worked
+            worddoc.close(save=done)
+          reports[filename or docname] = ui.diagnostics.report()
+        if args.strict and ui.warnings and status == EXIT_OK:
+          status = EXIT_WARNINGS
+      except AssertionError, e:
+        print >>sys.stderr, '%s: failed: %s' % ( docname, e )
+        status = EXIT_FAILED
+      except Exception, e:
+        if args.verbose:
+          traceback.print_exc()
+        print >>sys.stderr, '%s: failed: %s: %s' % ( docname, e.__class__.__name__, e )
+        status = EXIT_FAILED
+  finally:
+    if cache != None:
+      cache.close()
+  if profiler != None:
+    profiler.write_report(args.profile, citations)
+  if args.report:
+    write_report(args.report, reports)
+  return status
+  
+
+def run_batch_command(args, documents):
+  '''Works on the documents in a pool of processes; returns the exit status'''
+  start = time.time()
+  library = None
+  if not args.remove:
+    try:
+      library = open_library(args.bibfile)
+    except AssertionError, e:
+      print >>sys.stderr, 'failed: %s' % e
+      return EXIT_FAILED
+  templates = [ t for t in ( args.bibtemplate, args.citeptemplate, args.citettemplate ) if t ]
+  results = run_batch(documents, library, lambda worddoc: run_options(args, find_bibliography_options(worddoc)), args.jobs or None, args.cache, args.remove, templates, args.dry_run)
+  status = EXIT_OK
+  for result in results:
+    docname = os.path.basename(result.filename)
+    for warning in result.warnings:
+      print >>sys.stderr, '%s: warning: %s' % ( docname, warning )
+    if result.error != None:
+      if args.verbose and result.traceback:
+        print >>sys.stderr, result.traceback
+      print >>sys.stderr, '%s: failed: %s' % ( docname, result.error )
+      status = EXIT_FAILED
+    elif result.removed != None:
+      print '%s: %s fields %s (%0.1f s)' % ( docname, result.removed, args.dry_run and 'would be removed' or 'removed', result.seconds )
+    else:
+      print '%s: %s (%0.1f s)' % ( docname, format_summary(result.summary), result.seconds )
+    if args.strict and result.warnings and status == EXIT_OK:
+      status = EXIT_WARNINGS
+  if args.report:
+    write_report(args.report, dict([ ( result.filename, result.diagnostics ) for result in results ]))
+  failed = len([ result for result in results if result.error != None ])
+  print '%s documents, %s failed (%0.1f s)' % ( len(results), failed, time.time() - start )
+  return status
+  
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,139 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Made-up manuscripts and libraries to benchmark the pipeline with.
+
+A library is a list of bdtw.bibtex.Entry articles (keys key0, key1, ...),
+which can go into a FakeLibrary or be written out as a .bib file.  A
+manuscript is the text of a document that cites them with a mix of \\cite,
+\\citep, \\citet and \\nocite commands:
+
+    library = make_library(20000)
+    worddoc = make_document(5000, 20000, reuse=0.5)
+
+write_templates writes a numbered citation template and a bibliography
+template to format them with (the benchmarks and the tests share these).
+
+Everything is drawn from a random generator seeded with the arguments, so the
+same arguments always give the same corpus, and a benchmark run today can be
+compared with one from last month.
+'''
+
+import codecs, os, random
+
+from bdtw.bibtex import Entry
+from bdtw.fake import FIELD_BEGIN, FIELD_END, FIELD_SEPARATOR, FakeLibrary, FakeWordDocument
+
+# the commands a manuscript cites with, and how often (relative to each other) each is used
+COMMAND_MIX = ( ( 'citep', 6 ), ( 'cite', 2 ), ( 'citet', 2 ), ( 'nocite', 1 ) )
+
+# the fewest and most cite keys in one command
+GROUP_SIZE = ( 1, 3 )
+
+# made-up names and words for the entries
+SURNAMES = ( u'Smith', u'Jones', u'van der Berg', u'Nguyen', u'M\xfcller', u'Garc\xeda', u'de la Fontaine', u'Kim', 
+             u'O\'Brien', u'\xd6zt\xfcrk', u'Zhang', u'Rossi', u'Andersen', u'Kowalski', u'Dubois', u'Tanaka' )
+WORDS = ( u'adaptive', u'analysis', u'bounded', u'citation', u'distributed', u'evidence', u'field', u'growth', 
+          u'latency', u'model', u'network', u'ordering', u'parallel', u'queue', u'retrieval', u'study', u'theory' )
+JOURNALS = ( u'Journal of Things', u'Proceedings of the Society', u'Letters', u'Review of Studies' )
+
+# a numbered citation template and a bibliography template, as in BDtW-Templates.zip
+CITE_TEMPLATE = u'[<$publications>:::Index:<$itemIndex/>:::<?$publications>, </$publications>]'
+BIB_TEMPLATE = u'<$publications>\n[<$itemIndex/>] <$authors.abbreviatedNormalizedName.@componentsJoinedByCommaAndAnd/> (<$fields.Year/>). <$fields.Title/>.\n</$publications>'
+
+
+def make_entries(count, seed=0):
+  '''Returns count made-up articles, keyed key0 to key<count-1>'''
+  rand = random.Random(( 'entries', count, seed ))
+  entries = []
+  for i in range(count):
+    authors = [ u'%s%s, %s.' % ( rand.choice(SURNAMES), rand.randint(0, 9) or u'', rand.choice(u'ABCDEFGHJKLMNPRSTW') ) 
+                for j in range(rand.randint(1, 4)) ]
+    title = u' '.join([ rand.choice(WORDS) for j in range(rand.randint(3, 8)) ]).capitalize() + u' %d' % i
+    entries.append(Entry('article', 'key%d' % i, { 'author': u' and '.join(authors), 'title': title, 
+                                                   'journal': rand.choice(JOURNALS), 'year': unicode(1950 + rand.randint(0, 70)) }))
+  return entries
+  
+  
+def make_library(entries, seed=0, latency=0.0):
+  '''Returns a FakeLibrary of made-up articles (see make_entries)'''
+  return FakeLibrary(make_entries(entries, seed), latency)
+  
+  
+def write_bib(filename, entries):
+  '''Writes entries (from make_entries) to a .bib file'''
+  f = codecs.open(filename, 'w', 'utf-8')
+  try:
+    for entry in entries:
+      f.write(u'@%s{%s,\n' % ( entry.type, entry.citekey ))
+      f.write(u',\n'.join([ u'  %s = {%s}' % ( name, entry.fields[name] ) for name in sorted(entry.fields) ]))
+      f.write(u'\n}\n\n')
+  finally:
+    f.close()
+    
+    
+def write_templates(directory):
+  '''Writes CITE_TEMPLATE and BIB_TEMPLATE to a directory and returns their paths'''
+  paths = []
+  for name, text in ( ( 'cite.txt', CITE_TEMPLATE ), ( 'bibliography.txt', BIB_TEMPLATE ) ):
+    path = os.path.join(directory, name)
+    f = open(path, 'wb')
+    f.write(text.encode('utf-8'))
+    f.close()
+    paths.append(path)
+  return paths
+  
+  
+def make_manuscript(citations, entries, commands=COMMAND_MIX, group=GROUP_SIZE, reuse=0.3, unknown=0.05, fields=False, seed=0):
+  '''Returns the text of a document with about citations cite keys in it, drawn from
+     a library of entries entries, and a \\bibliography command at the end.
+       commands: ( command, weight ) pairs, how often each command is used
+       group:    the fewest and most keys in one command
+       reuse:    the chance that a key is one the text has already cited
+       unknown:  the chance that a key is not in the library
+       fields:   write the commands as fields, as they are after a first run'''
+  rand = random.Random(( 'manuscript', citations, entries, seed ))
+  names = []
+  for command, weight in commands:
+    names.extend([ command ] * weight)
+  parts, cited = [], []
+  while len(cited) < citations:
+    keys = []
+    for i in range(rand.randint(group[0], group[1])):
+      if cited and rand.random() < reuse:
+        keys.append(rand.choice(cited))
+      elif rand.random() < unknown:
+        keys.append('unknown%d' % rand.randint(0, entries))
+      else:
+        keys.append('key%d' % rand.randint(0, max(entries - 1, 0)))
+    cited.extend(keys)
+    command = '%s{%s}' % ( rand.choice(names), ','.join(keys) )
+    if fields:
+      parts.append(u'Some text %s ADDIN %s%s%s. ' % ( FIELD_BEGIN, command, FIELD_SEPARATOR, FIELD_END ))
+    else:
+      parts.append(u'Some text \\%s. ' % command)
+  if fields:
+    parts.append(u'\r%s ADDIN bibliography{}%s%s' % ( FIELD_BEGIN, FIELD_SEPARATOR, FIELD_END ))
+  else:
+    parts.append(u'\r\\bibliography{}')
+  return u''.join(parts)
+  
+  
+def make_document(citations, entries, latency=0.0, **kwargs):
+  '''Returns a FakeWordDocument of a made-up manuscript (the keyword arguments are those of make_manuscript)'''
+  return FakeWordDocument.from_text(make_manuscript(citations, entries, **kwargs), latency)
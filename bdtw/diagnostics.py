@@ -0,0 +1,131 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Problems found in a document during a run, collected instead of shown one by one.
+
+A draft full of unfinished citations shouldn't need a click per problem, and an
+unattended run can't click at all.  The pipeline reports each unresolved,
+duplicate or malformed citation to Interface.diagnose and keeps going; the
+problems pile up in a Diagnostics collector, which gives a one-paragraph
+summary for the end of the run and a structured report (a list of
+dictionaries, which the command line writes out as JSON) for scripts.  Every problem is recorded where
+it occurs, so a key cited five times gives five entries with five offsets.
+'''
+
+from bdtw.scanner import find_citations, find_malformed
+
+# the kinds of problems
+UNRESOLVED = 'unresolved'  # no publication has the cite key
+DUPLICATE = 'duplicate'    # more than one publication has the cite key
+MALFORMED = 'malformed'    # a citation we couldn't read (an empty key, or a command without its braces)
+UNCONVERTED = 'unconverted'  # a citation the document couldn't turn into a field (left as text)
+
+KIND_LABELS = {
+  UNRESOLVED: 'unresolved cite keys',
+  DUPLICATE: 'cite keys matching more than one entry',
+  MALFORMED: 'malformed citations',
+  UNCONVERTED: 'citations that could not be made into fields',
+}
+
+# what an unresolved key shows as in the text when placeholders are on (as LaTeX shows [?])
+PLACEHOLDER = u'[%s?]'
+
+# how many keys the summary names for each kind
+SUMMARY_KEYS = 5
+
+
+class Diagnostic:
+  '''One problem at one place in the document'''
+  def __init__(self, kind, message, citekey='', offset=None, field=None):
+    self.kind = kind          # UNRESOLVED, DUPLICATE, MALFORMED, or UNCONVERTED
+    self.message = message
+    self.citekey = citekey    # the key involved, or the text of a malformed citation
+    self.offset = offset      # where in the document (Word's character offset), if known
+    self.field = field        # the 1-based index of the field, if the problem is in one
+    
+    
+  def as_dict(self):
+    return { 'kind': self.kind, 'message': self.message, 'citekey': self.citekey, 'offset': self.offset, 'field': self.field }
+    
+
+class Diagnostics:
+  '''Collects the problems of a run'''
+  def __init__(self):
+    self.items = []
+    self._seen = set()  # ( kind, key ) of the problems recorded so far
+    
+    
+  def __len__(self):
+    return len(self.items)
+    
+    
+  def add(self, kind, message, citekey='', field=None, offset=None):
+    '''Records a problem; field is a bdtw.fields.Field, which gives the offset if none is
+       given.  Returns True the first time a kind of problem is seen for a key.'''
+    if field != None and offset == None:
+      offset = field.start
+    self.items.append(Diagnostic(kind, message, citekey, offset, field and field.index or None))
+    if ( kind, citekey ) in self._seen:
+      return False
+    self._seen.add(( kind, citekey ))
+    return True
+    
+    
+  def locate(self, worddoc):
+    '''Updates the offsets to where the problems are in the document now.  Offsets are
+       recorded as problems are found, and filling in fields moves everything after
+       them; this costs a bulk request or two, and only when there are problems.'''
+    infields = [ d for d in self.items if d.field != None ]
+    if infields:
+      starts = worddoc.field_properties()[2]
+      for d in infields:
+        d.offset = starts[d.field-1]
+    intext = [ d for d in self.items if d.field == None and d.kind == MALFORMED ]
+    if intext:
+      for d, ( start, commandtext ) in zip(intext, find_malformed(worddoc.text())):
+        d.offset = start
+    unconverted = [ d for d in self.items if d.kind == UNCONVERTED ]
+    if unconverted:  # (they are the commands still in the text)
+      for d, ( start, end, citetext ) in zip(unconverted, find_citations(worddoc.text())):
+        d.offset = start
+    
+    
+  def keys(self, kind):
+    '''Returns the distinct keys with a kind of problem, in the order first seen'''
+    keys, seen = [], set()
+    for d in self.items:
+      if d.kind == kind and d.citekey not in seen:
+        keys.append(d.citekey)
+        seen.add(d.citekey)
+    return keys
+    
+    
+  def summary(self):
+    '''Returns a short description of everything found, or '' if nothing was'''
+    lines = []
+    for kind in ( UNRESOLVED, DUPLICATE, MALFORMED, UNCONVERTED ):
+      keys = self.keys(kind)
+      if keys:
+        named = ', '.join(keys[:SUMMARY_KEYS]) + ( len(keys) > SUMMARY_KEYS and ', ...' or '' )
+        lines.append('%s %s: %s' % ( len(keys), KIND_LABELS[kind], named ))
+    return '\n'.join(lines)
+    
+    
+  def report(self):
+    '''Returns every problem as a dictionary, in the order found'''
+    return [ d.as_dict() for d in self.items ]
@@ -0,0 +1,548 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Works on .docx files directly, without Word.
+
+A DocxDocument has the same methods as bdtw.word.WordDocument, so the whole
+pipeline can run against a .docx file on any machine, with no Apple Events at
+all.  word/document.xml is scanned once with a few regular expressions (there
+is no DOM): paragraph and run boundaries are found, the contents of each run
+are split into tokens (text, field characters, field instructions, anything
+else), and everything in between is kept as markup and written back exactly as
+it was read.
+
+The text of the document is reported the way Word reports it with field codes
+included, so offsets mean the same thing as in WordDocument: every field is a
+begin character, the instructions, a separator, the result, and an end
+character, and every paragraph ends in a return.  Only the fields of the main
+story are numbered; a field nested in another one stays part of the outer
+field's code or result.
+
+Fields are written as complex fields (w:fldChar and w:instrText) with the
+same ADDIN codes the program has always used, so Word treats documents done
+here and documents done through Word the same way.  Rich text (.doc or .rtf)
+templates need Word to import them and are not supported here.
+
+A citation can only become a field when it is plain text inside one
+paragraph; one that runs into a field, a picture or the next paragraph raises
+NotConvertible and is left as it is.  The whole of word/document.xml is read
+and tokenized in memory rather than streamed: the pipeline addresses the
+document by offset and goes back to earlier fields, so a single pass from
+start to end would not do.
+'''
+
+import bisect, itertools, os, re, stat, tempfile, zipfile
+
+from bdtw.scanner import FIELD_BEGIN, FIELD_SEPARATOR, FIELD_END, NotConvertible
+
+# the part of the package that holds the main story
+DOCUMENT_PART = 'word/document.xml'
+
+# the tags the scanner stops at; everything between them is copied as is
+BODY_RE = re.compile(r'<w:r(?=[\s>/])[^>]*>|<w:p(?=[\s>/])[^>]*>|</w:p>')
+PARAGRAPH_PROPERTIES_RE = re.compile(r'\s*<w:pPr(?=[\s>/])[^>]*?(/?)>')
+CHILD_RE = re.compile(r'\s*<([\w:.-]+)((?:\s[^>]*?)?)(/?)>')
+FIELD_CHAR_TYPE_RE = re.compile(r'w:fldCharType="(\w+)"')
+BREAK_TYPE_RE = re.compile(r'w:type="(\w+)"')
+
+# attributes and elements that must not be copied into new paragraphs
+UNIQUE_ATTRIBUTE_RE = re.compile(r'\s(?:w14:paraId|w14:textId)="[^"]*"')
+SECTION_RE = re.compile(r'<w:sectPr(?=[\s>/]).*</w:sectPr>|<w:sectPr[^>]*/>', re.S)
+
+ENTITY_RE = re.compile(r'&(#x[0-9a-fA-F]+|#[0-9]+|\w+);')
+ENTITIES = { 'amp': u'&', 'lt': u'<', 'gt': u'>', 'quot': u'"', 'apos': u"'" }
+LINE_BREAK_RE = re.compile(r'\r\n|\r|\n')
+SPECIAL_CHAR_RE = re.compile(u'([\t\x0b])')
+
+# token kinds
+MARKUP = 'markup'        # copied as is (paragraph ends carry a return as their text)
+PARAGRAPH = 'paragraph'  # the start tag and properties of a paragraph
+TEXT = 'text'            # text in a run (tabs and line breaks included)
+INSTR = 'instr'          # field instructions in a run
+CHAR = 'char'            # a field begin, separate, or end character in a run
+OBJECT = 'object'        # anything else in a run (pictures, footnote references, ...)
+
+FIELD_CHARS = { 'begin': FIELD_BEGIN, 'separate': FIELD_SEPARATOR, 'end': FIELD_END }
+
+
+class Token(object):
+  '''One piece of the document.  Tokens inside runs remember the run's start tag and
+     properties, and each is written back as a run of its own.'''
+  __slots__ = ( 'kind', 'text', 'xml', 'run' )
+  
+  def __init__(self, kind, text=u'', xml=u'', run=u''):
+    self.kind = kind
+    self.text = text  # what the token contributes to the document text
+    self.xml = xml    # the markup (or the run child) as read
+    self.run = run    # '<w:r ...><w:rPr>...</w:rPr>' for tokens inside runs
+    
+    
+  def __len__(self):
+    return len(self.text)
+    
+    
+  def serialize(self):
+    if self.kind in ( MARKUP, PARAGRAPH ):
+      return self.xml
+    if self.kind == TEXT:
+      return self.run + _text_xml(self.text) + u'</w:r>'
+    if self.kind == INSTR:
+      return self.run + u'<w:instrText xml:space="preserve">' + _escape(self.text) + u'</w:instrText></w:r>'
+    return self.run + self.xml + u'</w:r>'
+    
+
+class DocxField(object):
+  '''A (top level) field: the begin character, code tokens, separator, result tokens, and end character'''
+  def __init__(self, begin):
+    self.begin = begin
+    self.code = []
+    self.separator = None
+    self.result = []
+    self.end = None
+    
+    
+  def tokens(self):
+    tokens = [ self.begin ] + self.code
+    if self.separator != None:
+      tokens.append(self.separator)
+    tokens.extend(self.result)
+    if self.end != None:
+      tokens.append(self.end)
+    return tokens
+    
+    
+  def code_text(self):
+    return u''.join([ t.text for t in self.code ])
+    
+    
+  def result_text(self):
+    return u''.join([ t.text for t in self.result ])
+    
+    
+  def field_type(self):
+    words = self.code_text().split()
+    return words and words[0].upper() or ''
+    
+    
+  def __len__(self):
+    return sum([ len(t) for t in self.tokens() ])
+    
+    
+  def serialize(self):
+    return u''.join([ t.serialize() for t in self.tokens() ])
+    
+
+class DocxDocument:
+  '''A .docx file, held as a list of parts: Tokens and DocxFields'''
+  FIELD_ADDIN = 'ADDIN'
+  
+  def __init__(self, filename):
+    self.filename = filename
+    package = zipfile.ZipFile(filename)
+    try:
+      xml = package.read(DOCUMENT_PART).decode('utf-8')
+    finally:
+      package.close()
+    self.parts, self.fields = _group_fields(_tokenize(xml))
+    self._offsets = []     # start offset of each part, valid for the first _valid parts
+    self._fieldcounts = [] # number of fields before each part, valid for the first _valid parts
+    self._valid = 0
+    self._hint = 0         # where _index last found a field
+    
+    
+  @classmethod
+  def open_file(cls, filename):
+    '''Opens a .docx file'''
+    assert os.path.isfile(filename), 'The Word document does not exist: ' + filename
+    return cls(filename)
+    
+    
+  def save(self, filename=None):
+    '''Writes the document back to its file (or to another one).  Every part of the
+       package except the main story is copied unchanged.'''
+    filename = filename or self.filename
+    fd, tempname = tempfile.mkstemp(suffix='.docx', dir=os.path.dirname(os.path.abspath(filename)))
+    os.close(fd)
+    try:
+      source = zipfile.ZipFile(self.filename)
+      try:
+        target = zipfile.ZipFile(tempname, 'w', zipfile.ZIP_DEFLATED)
+        try:
+          for info in source.infolist():
+            if info.filename == DOCUMENT_PART:
+              target.writestr(info, u''.join([ part.serialize() for part in self.parts ]).encode('utf-8'))
+            else:
+              target.writestr(info, source.read(info.filename))
+        finally:
+          target.close()
+      finally:
+        source.close()
+      if os.path.exists(filename):
+        os.chmod(tempname, stat.S_IMODE(os.stat(filename).st_mode))
+      os.rename(tempname, filename)
+    except:
+      if os.path.exists(tempname):
+        os.remove(tempname)
+      raise
+    self.filename = filename
+    
+    
+  def close(self, save=True):
+    '''Saves the document unless save is False (there is nothing else to close)'''
+    if save:
+      self.save()
+      
+      
+  ### bookkeeping for offsets
+    
+  def _changed(self, partindex):
+    '''Records that parts from partindex on have moved'''
+    self._valid = min(self._valid, partindex)
+    
+    
+  def _locate(self, offset):
+    '''Returns the index of the part containing offset.  An offset exactly between
+       other parts and a field belongs to the part before the field.'''
+    if self._valid == 0 or offset >= self._offsets[self._valid-1] + len(self.parts[self._valid-1]):
+      # the remembered offsets don't reach this far, so recompute them
+      self._offsets, self._fieldcounts = [], []
+      pos = count = 0
+      for part in self.parts:
+        self._offsets.append(pos)
+        self._fieldcounts.append(count)
+        pos += len(part)
+        count += isinstance(part, DocxField) and 1 or 0
+      self._valid = len(self.parts)
+    i = max(bisect.bisect_right(self._offsets, offset, 0, self._valid) - 1, 0)
+    if isinstance(self.parts[i], DocxField) and i > 0 and self._offsets[i] == offset and not isinstance(self.parts[i-1], DocxField):
+      i -= 1
+    return i
+    
+    
+  def _index(self, field):
+    '''Returns the index of a field in the parts list'''
+    # start where the last one was found, since fields are usually changed back to front
+    start = min(self._hint, len(self.parts)-1)
+    for i in itertools.chain(xrange(start, -1, -1), xrange(len(self.parts)-1, start, -1)):
+      if self.parts[i] is field:
+        self._hint = i
+        return i
+    raise ValueError('The field is not in the document')
+    
+    
+  def _paragraph_start(self, partindex):
+    '''Returns the start tag and properties of the paragraph a part is in, for
+       starting new paragraphs like it'''
+    for i in xrange(partindex, -1, -1):
+      part = self.parts[i]
+      if isinstance(part, Token) and part.kind == PARAGRAPH:
+        return SECTION_RE.sub(u'', UNIQUE_ATTRIBUTE_RE.sub(u'', part.xml))
+    return u'<w:p>'
+    
+    
+  ### the WordDocument interface
+  
+  def name(self):
+    return os.path.basename(self.filename)
+    
+    
+  def text(self):
+    return u''.join([ isinstance(p, DocxField) and u''.join([ t.text for t in p.tokens() ]) or p.text for p in self.parts ])
+    
+    
+  def replace_with_field(self, start, end, code):
+    i = self._locate(start)
+    # find the parts that cover start to end; citations split across runs cover several
+    j = i
+    pos = self._offsets[i]
+    while pos + len(self.parts[j]) < end:
+      pos += len(self.parts[j])
+      j += 1
+    covered = self.parts[i:j+1]
+    for part in covered:
+      if not isinstance(part, Token) or ( part.kind != TEXT and len(part) > 0 ):
+        raise NotConvertible('Only text within a paragraph can be replaced with a field')
+    run = [ p for p in covered if len(p) > 0 ][0].run
+    field = _new_field(code, run)
+    # keep the text on either side, and anything without text (bookmarks, proofing marks) in between
+    before = self.parts[i].text[:start - self._offsets[i]]
+    after = self.parts[j].text[end - pos:]
+    replacement = []
+    if before:
+      replacement.append(Token(TEXT, before, run=self.parts[i].run))
+    replacement.extend([ p for p in covered if len(p) == 0 ])
+    replacement.append(field)
+    if after:
+      replacement.append(Token(TEXT, after, run=self.parts[j].run))
+    self.parts[i:j+1] = replacement
+    self.fields.insert(self._fieldcounts[i], field)
+    self._changed(before and i + 1 or i)  # the text before the new field hasn't moved
+    
+    
+  def add_field_at_end(self, code):
+    # the new paragraph goes after the last one in the document
+    for i in xrange(len(self.parts)-1, -1, -1):
+      if isinstance(self.parts[i], Token) and self.parts[i].kind == MARKUP and self.parts[i].text == u'\r':
+        break
+    else:
+      assert False, 'The document has no paragraphs to add the bibliography after.'
+    field = _new_field(code, u'<w:r>')
+    self.parts[i+1:i+1] = [ Token(PARAGRAPH, xml=self._paragraph_start(i)), field, Token(MARKUP, u'\r', u'</w:p>') ]
+    self.fields.append(field)
+    self._changed(i+1)
+    
+    
+  def field_properties(self):
+    starts = []
+    pos = 0
+    for part in self.parts:
+      if isinstance(part, DocxField):
+        starts.append(pos + 1)
+      pos += len(part)
+    return [ f.field_type() for f in self.fields ], [ f.code_text() for f in self.fields ], starts
+    
+    
+  def field_codes(self):
+    return [ f.code_text() for f in self.fields ]
+    
+    
+  def field_results(self):
+    return [ f.result_text() for f in self.fields ]
+    
+    
+  def set_field_code(self, index, code):
+    field = self.fields[index-1]
+    field.code = [ Token(INSTR, code, run=field.begin.run) ]
+    self._changed(0)
+    
+    
+  def set_field_result(self, index, text):
+    if isinstance(text, list):
+      text = u''.join(text)  # the same as Word does with a list of strings
+    field = self.fields[index-1]
+    if field.separator == None:
+      field.separator = Token(CHAR, FIELD_SEPARATOR, u'<w:fldChar w:fldCharType="separate"/>', field.begin.run)
+    field.result = self._result_tokens(field, text)
+    self._changed(0)
+    
+    
+  def append_field_result(self, index, text):
+    field = self.fields[index-1]
+    if field.separator == None:
+      field.separator = Token(CHAR, FIELD_SEPARATOR, u'<w:fldChar w:fldCharType="separate"/>', field.begin.run)
+    field.result.extend(self._result_tokens(field, text))  # (the first line carries on the last paragraph)
+    self._changed(0)
+    
+    
+  def _result_tokens(self, field, text):
+    '''Returns the tokens for result text, in the field's formatting and a new paragraph for each line after the first'''
+    run = field.begin.run
+    result = []
+    lines = LINE_BREAK_RE.split(text)
+    if len(lines) > 1:
+      paragraph = self._paragraph_start(self._index(field))
+    for i, line in enumerate(lines):
+      if i > 0:
+        result.extend([ Token(MARKUP, u'\r', u'</w:p>'), Token(PARAGRAPH, xml=paragraph) ])
+      if line:
+        result.append(Token(TEXT, line, run=run))
+    return result
+    
+    
+  def show_field_codes(self, index, show):
+    pass  # whether codes show is a setting of the Word window, not of the file
+    
+    
+  def insert_file_in_field(self, index, filename, strip_return=True):
+    assert False, 'Rich text templates need Word; please use .txt templates with .docx files.'
+    
+    
+  def append_file_in_field(self, index, filename):
+    assert False, 'Rich text templates need Word; please use .txt templates with .docx files.'
+    
+    
+  def copy_field_result(self, source, index):
+    source, field = self.fields[source-1], self.fields[index-1]
+    if field.separator == None:
+      field.separator = Token(CHAR, FIELD_SEPARATOR, u'<w:fldChar w:fldCharType="separate"/>', field.begin.run)
+    field.result = [ Token(t.kind, t.text, t.xml, t.run) for t in source.result ]
+    self._changed(0)
+    
+    
+  def unlink_fields(self, first, texts):
+    doomed = dict([ ( id(field), text ) for field, text in zip(self.fields[first-1:first-1+len(texts)], texts) ])
+    del self.fields[first-1:first-1+len(texts)]
+    for i, part in enumerate(self.parts):
+      if id(part) in doomed:
+        self.parts[i] = Token(TEXT, doomed[id(part)], run=part.begin.run)
+    self._changed(0)
+    
+    
+################################################################################
+###   Reading and writing the XML
+
+def _tokenize(xml):
+  '''Splits the main story into tokens'''
+  tokens = []
+  pos = 0
+  while True:
+    m = BODY_RE.search(xml, pos)
+    if m == None:
+      break
+    if m.start() > pos:
+      tokens.append(Token(MARKUP, xml=xml[pos:m.start()]))
+    tag = m.group(0)
+    pos = m.end()
+    if tag == u'</w:p>' or ( tag.startswith(u'<w:p') and tag.endswith(u'/>') ):  # end of a paragraph (or an empty one)
+      tokens.append(Token(MARKUP, u'\r', tag))
+    elif tag.startswith(u'<w:p'):  # start of a paragraph, with its properties
+      p = PARAGRAPH_PROPERTIES_RE.match(xml, pos)
+      if p != None:
+        pos = p.group(1) and p.end() or _element_end(xml, p.end(), u'w:pPr')
+      tokens.append(Token(PARAGRAPH, xml=xml[m.start():pos]))
+    elif tag.endswith(u'/>'):  # an empty run
+      tokens.append(Token(MARKUP, xml=tag))
+    else:
+      pos = _element_end(xml, pos, u'w:r')
+      tokens.extend(_run_tokens(tag, xml[m.end():pos-len(u'</w:r>')]))
+  tokens.append(Token(MARKUP, xml=xml[pos:]))
+  return tokens
+  
+  
+def _run_tokens(runtag, inner):
+  '''Splits the contents of a run into tokens'''
+  tokens = []
+  run = runtag
+  pos = 0
+  while True:
+    m = CHILD_RE.match(inner, pos)
+    if m == None:
+      break
+    name, attributes = m.group(1), m.group(2)
+    end = m.group(3) and m.end() or _element_end(inner, m.end(), name)
+    xml = inner[m.start(1)-1:end]
+    pos = end
+    if name == u'w:rPr':
+      run += xml
+    elif name == u'w:t':
+      tokens.append(Token(TEXT, not m.group(3) and _unescape(inner[m.end():end-len(u'</w:t>')]) or u'', run=run))
+    elif name == u'w:tab':
+      tokens.append(Token(TEXT, u'\t', run=run))
+    elif name == u'w:br' and BREAK_TYPE_RE.search(attributes) == None:
+      tokens.append(Token(TEXT, u'\x0b', run=run))
+    elif name == u'w:instrText':
+      tokens.append(Token(INSTR, not m.group(3) and _unescape(inner[m.end():end-len(u'</w:instrText>')]) or u'', run=run))
+    elif name == u'w:fldChar':
+      kind = FIELD_CHAR_TYPE_RE.search(attributes)
+      tokens.append(Token(CHAR, FIELD_CHARS.get(kind and kind.group(1), u''), xml, run))
+    else:
+      tokens.append(Token(OBJECT, xml=xml, run=run))
+  if not tokens:  # nothing but properties
+    return [ Token(MARKUP, xml=runtag + inner + u'</w:r>') ]
+  return tokens
+  
+  
+def _group_fields(tokens):
+  '''Collects the tokens of each top level field into a DocxField.  Returns the parts
+     and the fields.'''
+  parts = []
+  fields = []
+  field = None
+  depth = 0
+  for token in tokens:
+    if token.kind == CHAR and token.text == FIELD_BEGIN:
+      depth += 1
+      if depth == 1:
+        field = DocxField(token)
+        parts.append(field)
+        fields.append(field)
+        continue
+    if field == None:  # not in a field (a stray end or separator is kept as is)
+      parts.append(token)
+      continue
+    if token.kind == CHAR and token.text == FIELD_END:
+      depth -= 1
+      if depth == 0:
+        field.end = token
+        field = None
+        continue
+    if token.kind == CHAR and token.text == FIELD_SEPARATOR and depth == 1 and field.separator == None:
+      field.separator = token
+    elif field.separator == None:
+      field.code.append(token)
+    else:
+      field.result.append(token)
+  return parts, fields
+  
+  
+def _new_field(code, run):
+  '''Returns a new field with the given code and no result'''
+  field = DocxField(Token(CHAR, FIELD_BEGIN, u'<w:fldChar w:fldCharType="begin"/>', run))
+  field.code = [ Token(INSTR, code, run=run) ]
+  field.separator = Token(CHAR, FIELD_SEPARATOR, u'<w:fldChar w:fldCharType="separate"/>', run)
+  field.end = Token(CHAR, FIELD_END, u'<w:fldChar w:fldCharType="end"/>', run)
+  return field
+  
+  
+_end_tag_res = {}
+def _element_end(xml, pos, name):
+  '''Returns the offset just past the end tag of the element whose start tag ends at pos'''
+  tagre = _end_tag_res.get(name)
+  if tagre == None:
+    tagre = _end_tag_res[name] = re.compile(u'<(/?)%s(?=[\\s>/])([^>]*)>' % re.escape(name))
+  depth = 1
+  for m in tagre.finditer(xml, pos):
+    if m.group(1):
+      depth -= 1
+      if depth == 0:
+        return m.end()
+    elif not m.group(2).endswith(u'/'):
+      depth += 1
+  raise ValueError('Unclosed <%s> in %s' % ( name, DOCUMENT_PART ))
+  
+  
+def _text_xml(text):
+  '''Returns the run contents for some text'''
+  if text == u'':
+    return u'<w:t/>'
+  xml = []
+  for piece in SPECIAL_CHAR_RE.split(text):
+    if piece == u'\t':
+      xml.append(u'<w:tab/>')
+    elif piece == u'\x0b':
+      xml.append(u'<w:br/>')
+    elif piece:
+      xml.append(u'<w:t xml:space="preserve">' + _escape(piece) + u'</w:t>')
+  return u''.join(xml)
+  
+  
+def _escape(text):
+  return text.replace(u'&', u'&amp;').replace(u'<', u'&lt;').replace(u'>', u'&gt;')
+  
+  
+def _unescape(text):
+  if u'&' not in text:
+    return text
+  def entity(m):
+    name = m.group(1)
+    if name.startswith(u'#x'):
+      return unichr(int(name[2:], 16))
+    if name.startswith(u'#'):
+      return unichr(int(name[1:]))
+    return ENTITIES.get(name, m.group(0))
+  return ENTITY_RE.sub(entity, text)
@@ -0,0 +1,301 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''In-memory stand-ins for Word and BibDesk.
+
+These implement the same methods as bdtw.word.WordDocument and
+bdtw.bibdesk.BibDeskDocument, so the whole pipeline can run without a Mac.
+Each method counts the Apple Events the real wrapper would send and, if a
+latency is given, sleeps that long per event.  That makes it possible to
+measure a change to the pipeline by its event count and (simulated) wall time
+on any machine.
+
+The fake document keeps its text the way Word reports it with field codes
+included: every field is a begin character, the code, a separator, the result,
+and an end character, and offsets count all of them.
+'''
+
+import bisect, re, time
+
+from bdtw.bibdesk import PublicationIndex
+from bdtw.cache import hash_text
+from bdtw.template import load_template
+from bdtw.scanner import FIELD_BEGIN, FIELD_SEPARATOR, FIELD_END, NotConvertible
+
+
+class EventCounter:
+  '''Counts (and optionally simulates the latency of) Apple Events'''
+  def __init__(self, latency=0.0):
+    self.latency = latency  # seconds per event
+    self.events = 0
+    
+    
+  def _event(self, count=1):
+    self.events += count
+    if self.latency:
+      time.sleep(self.latency * count)
+      
+
+################################################################################
+###   Word
+
+class FakeField(object):
+  '''A field in a FakeWordDocument'''
+  def __init__(self, code, result=u'', field_type='ADDIN'):
+    self.code = code
+    self.result = result
+    self.field_type = field_type
+    self.show_codes = True
+    
+    
+  def __len__(self):
+    return len(self.code) + len(self.result) + 3
+    
+    
+  def text(self):
+    return FIELD_BEGIN + self.code + FIELD_SEPARATOR + self.result + FIELD_END
+    
+
+class FakeWordDocument(EventCounter):
+  '''A Word document held in memory.  The document is a list of parts, each either
+     a plain text string or a FakeField.'''
+  FIELD_ADDIN = 'ADDIN'
+  
+  def __init__(self, text=u'', latency=0.0, name='Document'):
+    EventCounter.__init__(self, latency)
+    self.docname = name
+    self.parts = [ text ]
+    self.fields = []       # the FakeFields in document order
+    self._offsets = []     # start offset of each part, valid for the first _valid parts
+    self._fieldcounts = [] # number of fields before each part, valid for the first _valid parts
+    self._valid = 0
+    
+    
+  @classmethod
+  def from_text(cls, text, latency=0.0, name='Document'):
+    '''Makes a document from text that may include fields written with the Word
+       delimiter characters (as text() returns them).  Fields don't nest.'''
+    doc = cls(u'', latency, name)
+    doc.parts = []
+    for m in re.finditer(u'%s([^%s]*)%s([^%s]*)%s|[^%s]+' % ( FIELD_BEGIN, FIELD_SEPARATOR, FIELD_SEPARATOR, FIELD_END, FIELD_END, FIELD_BEGIN ), text):
+      if m.group(0).startswith(FIELD_BEGIN):
+        field = FakeField(m.group(1), m.group(2), m.group(1).split() and m.group(1).split()[0] or '')
+        field.show_codes = False
+        doc.parts.append(field)
+        doc.fields.append(field)
+      else:
+        doc.parts.append(m.group(0))
+    doc.parts = doc.parts or [ u'' ]
+    return doc
+    
+    
+  ### bookkeeping for offsets
+    
+  def _changed(self, partindex):
+    '''Records that parts from partindex on have moved'''
+    self._valid = min(self._valid, partindex)
+    
+    
+  def _locate(self, offset):
+    '''Returns the index of the part containing offset.  An offset exactly between a
+       text part and a field belongs to the text part.'''
+    if self._valid == 0 or offset >= self._offsets[self._valid-1] + len(self.parts[self._valid-1]):
+      # the remembered offsets don't reach this far, so recompute them
+      self._offsets, self._fieldcounts = [], []
+      pos = count = 0
+      for part in self.parts:
+        self._offsets.append(pos)
+        self._fieldcounts.append(count)
+        pos += len(part)
+        count += isinstance(part, FakeField) and 1 or 0
+      self._valid = len(self.parts)
+    i = max(bisect.bisect_right(self._offsets, offset, 0, self._valid) - 1, 0)
+    if isinstance(self.parts[i], FakeField) and i > 0 and self._offsets[i] == offset and not isinstance(self.parts[i-1], FakeField):
+      i -= 1
+    return i
+    
+    
+  ### the WordDocument interface
+  
+  def name(self):
+    self._event()
+    return self.docname
+    
+    
+  def text(self):
+    self._event(5)
+    return u''.join([ isinstance(p, FakeField) and p.text() or p for p in self.parts ])
+    
+    
+  def replace_with_field(self, start, end, code):
+    self._event(8)
+    i = self._locate(start)
+    part = self.parts[i]
+    at = start - self._offsets[i]
+    if isinstance(part, FakeField) or at + end - start > len(part):
+      raise NotConvertible('Only plain text can be replaced with a field')
+    field = FakeField(code)
+    self.parts[i:i+1] = [ p for p in ( part[:at], field, part[at+end-start:] ) if p is field or p != u'' ]
+    self.fields.insert(self._fieldcounts[i], field)
+    self._changed(at > 0 and i + 1 or i)  # the text before the new field hasn't moved
+    
+    
+  def add_field_at_end(self, code):
+    self._event(5)
+    self.parts.append(u'\r')
+    field = FakeField(code)
+    self.parts.append(field)
+    self.fields.append(field)
+    
+    
+  def field_properties(self):
+    self._event(4)
+    return [ f.field_type for f in self.fields ], [ f.code for f in self.fields ], self._code_starts()
+    
+    
+  def _code_starts(self):
+    starts = []
+    pos = 0
+    for part in self.parts:
+      if isinstance(part, FakeField):
+        starts.append(pos + 1)
+      pos += len(part)
+    return starts
+    
+    
+  def field_codes(self):
+    self._event(2)
+    return [ f.code for f in self.fields ]
+    
+    
+  def field_results(self):
+    self._event(2)
+    return [ f.result for f in self.fields ]
+    
+    
+  def set_field_code(self, index, code):
+    self._event()
+    self.fields[index-1].code = code
+    self._changed(0)
+    
+    
+  def set_field_result(self, index, text):
+    self._event()
+    if isinstance(text, list):
+      text = u''.join(text)  # AppleScript coerces a list of strings to text by joining them
+    self.fields[index-1].result = text
+    self._changed(0)
+    
+    
+  def append_field_result(self, index, text):
+    self._event()
+    self.fields[index-1].result += text
+    self._changed(0)
+    
+    
+  def show_field_codes(self, index, show):
+    self._event()
+    self.fields[index-1].show_codes = show
+    
+    
+  def insert_file_in_field(self, index, filename, strip_return=True):
+    self._event(strip_return and 6 or 2)
+    f = open(filename, 'rb')
+    try:
+      text = f.read().decode('utf-8')
+    finally:
+      f.close()
+    if strip_return and text.endswith(u'\r'):
+      text = text[:-1]
+    self.fields[index-1].result = text
+    self._changed(0)
+    
+    
+  def append_file_in_field(self, index, filename):
+    self._event(2)
+    f = open(filename, 'rb')
+    try:
+      self.fields[index-1].result += f.read().decode('utf-8')
+    finally:
+      f.close()
+    self._changed(0)
+    
+    
+  def copy_field_result(self, source, index):
+    self._event()
+    self.fields[index-1].result = self.fields[source-1].result
+    self._changed(0)
+    
+    
+  def unlink_fields(self, first, texts):
+    self._event(len(texts) + 4)  # a result for each, the two ends, the range, and the unlink
+    doomed = dict([ ( id(field), text ) for field, text in zip(self.fields[first-1:first-1+len(texts)], texts) ])
+    del self.fields[first-1:first-1+len(texts)]
+    self.parts = [ doomed.get(id(part), part) for part in self.parts ]
+    self._changed(0)
+    
+    
+################################################################################
+###   BibDesk
+
+class FakeLibrary(EventCounter):
+  '''A BibDesk document held in memory.  The publications are bdtw.bibtex.Entry
+     objects.  Text templates are run with bdtw.template, as BibTeXLibrary does;
+     exports (rich text templates) write one plain line per publication.'''
+  def __init__(self, entries, latency=0.0, name='Library.bib'):
+    EventCounter.__init__(self, latency)
+    self.entries = list(entries)
+    self.name = name
+    
+    
+  def publication_index(self, citekeys=None):
+    self._event(3)  # the publications, their cite keys, and their BibTeX
+    return PublicationIndex([ e.citekey for e in self.entries ], self.entries, [ self._hash(e) for e in self.entries ])
+    
+    
+  def sort_fields(self, publications):
+    self._event(5)  # four bulk property requests and the publications themselves
+    return [ p.sort_fields() for p in publications ]
+    
+    
+  def content_hash(self, publication):
+    self._event()
+    return self._hash(publication)
+    
+    
+  def _hash(self, publication):
+    return hash_text(u'\n'.join([ publication.type, publication.citekey ] + [ n + '=' + v for n, v in sorted(publication.fields.items()) ]))
+    
+    
+  def _reference(self, publication):
+    authors = u', '.join([ author.abbreviated_normalized_name for author in publication.authors ])
+    return u'%s (%s). %s.' % ( authors, publication.field('year'), publication.field('title') )
+    
+    
+  def templated_text(self, template, publications):
+    self._event()
+    return load_template(template).render(publications)
+    
+    
+  def export(self, filename, template, publications):
+    self._event()
+    f = open(filename, 'wb')
+    try:
+      f.write(u''.join([ self._reference(p) + u'\r' for p in publications ]).encode('utf-8'))
+    finally:
+      f.close()
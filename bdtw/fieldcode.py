@@ -0,0 +1,162 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+r'''Reading field codes.
+
+A citation field's code is the \cite command it was made from, with ADDIN in
+front: " ADDIN citep[see][p. 5]{smith2000, jones1999}".  parse_code reads a code
+into a FieldCode record once, with one compiled pattern, and remembers the
+answer by code text, so a document that cites the same keys a thousand times
+parses them once.  Every stage reads the record (see bdtw.fields.Field).
+
+The syntax follows natbib:
+
+  - the command: cite, citep, citet, nocite, bibliography (or anything else,
+    which isn't ours);
+  - up to two optional arguments in brackets.  With one, it is the note after
+    the citation (\citep[p. 5]{key}); with two, the first is the note before it
+    and the second the note after (\citep[see][ch. 2]{key});
+  - the argument in braces, which may itself hold braces.  For the cite
+    commands it is the cite keys, separated by commas (outside any inner
+    braces), with the spaces around them ignored.
+'''
+
+import re
+
+# the commands whose argument is a list of cite keys
+CITE_COMMANDS = ( 'cite', 'citep', 'citet', 'nocite' )
+
+# ADDIN, the command, the optional arguments, and everything from the first brace to the last
+CODE_RE = re.compile(r'\s*ADDIN\s+([A-Za-z]+)\s*(?:\[([^\]]*)\])?\s*(?:\[([^\]]*)\])?\s*\{(.*)\}\s*$', re.DOTALL)
+
+# how many codes parse_code remembers before starting over
+MEMO_SIZE = 200000
+
+# the brackets of a formatted citation, which the notes go inside of
+BRACKETS = { u'(': u')', u'[': u']' }
+
+
+class FieldCode(object):
+  '''What a field code says.  Records are shared between fields with the same code,
+     so they are never changed once made.'''
+  __slots__ = ( 'command', 'prenote', 'postnote', 'argument', 'citekeys' )
+  
+  def __init__(self, command='', prenote=u'', postnote=u'', argument=u'', citekeys=()):
+    self.command = command    # cite, citep, citet, nocite, bibliography, or '' for fields that aren't ours
+    self.prenote = prenote    # the note before the citation ('see'), or ''
+    self.postnote = postnote  # the note after the citation ('p. 5'), or ''
+    self.argument = argument  # whatever is between the outer braces
+    self.citekeys = citekeys  # the cite keys, as a tuple (cite commands only)
+    
+    
+  def text(self):
+    '''Returns the command as it is written in the text, without its backslash'''
+    notes = u''
+    if self.prenote:
+      notes = u'[%s][%s]' % ( self.prenote, self.postnote )
+    elif self.postnote:
+      notes = u'[%s]' % self.postnote
+    return u'%s%s{%s}' % ( self.command, notes, self.argument )
+    
+    
+# the record for codes that aren't ours
+NOT_OURS = FieldCode()
+
+# code text -> FieldCode
+_memo = {}
+
+def parse_code(code):
+  '''Returns the FieldCode for the code text of a field'''
+  record = _memo.get(code)
+  if record == None:
+    if len(_memo) >= MEMO_SIZE:
+      _memo.clear()
+    record = _memo[code] = _parse(code)
+  return record
+  
+  
+def _parse(code):
+  m = isinstance(code, basestring) and CODE_RE.match(code) or None
+  if m == None:
+    return NOT_OURS
+  command, first, second, argument = m.groups()
+  prenote, postnote = u'', first or u''
+  if second != None:
+    prenote, postnote = first, second
+  citekeys = ()
+  if command in CITE_COMMANDS:
+    citekeys = tuple([ key.strip() for key in split_keys(argument) ])
+  return FieldCode(command, prenote.strip(), postnote.strip(), argument, citekeys)
+  
+  
+def split_keys(argument):
+  '''Splits the argument of a cite command at the commas that aren't inside braces'''
+  if u'{' not in argument:
+    return argument.split(u',')
+  keys = []
+  depth = start = 0
+  for pos, ch in enumerate(argument):
+    if ch == u'{':
+      depth += 1
+    elif ch == u'}':
+      depth -= 1
+    elif ch == u',' and depth == 0:
+      keys.append(argument[start:pos])
+      start = pos + 1
+  keys.append(argument[start:])
+  return keys
+  
+  
+def add_notes(text, prenote, postnote):
+  '''Adds a citation's notes to its formatted text the way natbib does.  If the text ends
+     in brackets, the postnote goes inside the last pair and the prenote inside the first:
+     "(see Smith, 2000, p. 5)", "Smith (see 2000, p. 5)".  Otherwise the notes go around
+     the text.'''
+  if not prenote and not postnote:
+    return text
+  body = text.strip()
+  before, after = text[:len(text) - len(text.lstrip())], text[len(text.rstrip()):]
+  groups = _groups(body)
+  if groups and groups[-1][1] == len(body) - 1:
+    first, last = groups[0][0] + 1, groups[-1][1]
+    if postnote:
+      body = body[:last] + u', ' + postnote + body[last:]
+    if prenote:
+      body = body[:first] + prenote + u' ' + body[first:]
+  else:
+    if prenote:
+      body = prenote + u' ' + body
+    if postnote:
+      body = body + u', ' + postnote
+  return before + body + after
+  
+  
+def _groups(text):
+  '''Returns ( start, end ) positions of the outermost bracketed groups of the text:
+     "Smith (2000), Jones (1999)" has two; "(Smith, 2000; Jones [1999])" has one.
+     A closing bracket without its opening one is ignored.'''
+  groups = []
+  inside = []  # ( position, closing bracket ) of each group we are inside
+  for pos, ch in enumerate(text):
+    if ch in BRACKETS:
+      inside.append(( pos, BRACKETS[ch] ))
+    elif inside and ch == inside[-1][1]:
+      start = inside.pop()[0]
+      if not inside:
+        groups.append(( start, pos ))
+  return groups
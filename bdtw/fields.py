@@ -0,0 +1,141 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''A snapshot of the fields in a Word document.
+
+Asking Word about a field one property at a time costs an Apple Event per
+property per field, and the bibliography pipeline used to ask for the type and
+code of every field several times over.  The snapshot fetches the types, codes
+and code offsets of all fields with one bulk request each, parses the codes
+once, and hands the parsed records to every stage.  A stage that adds or removes
+fields invalidates the snapshot so the next stage sees a fresh copy.
+'''
+
+from bdtw.fieldcode import CITE_COMMANDS, NOT_OURS, parse_code
+
+
+class Field(object):
+  '''Holds what we know about a single field in the document'''
+  __slots__ = ( 'index', 'field_type', 'code', 'start', 'parsed', 'keyids', 'result' )  # long documents have a lot of these
+  
+  def __init__(self, index, field_type, code, start):
+    self.index = index            # 1-based index of the field in the document (Word's numbering)
+    self.field_type = field_type  # Word field type (we only care about k.field_addin)
+    self.code = code              # the full field code text, e.g. " ADDIN cite{key1,key2}"
+    self.start = start            # offset of the start of the field code in the document
+    self.parsed = NOT_OURS        # what the code says (a bdtw.fieldcode.FieldCode), for ADDIN fields
+    self.keyids = ()              # the cite keys as ids in the run's CitationTable (see bdtw.citations)
+    self.result = None            # the result text, once FieldSnapshot.load_results has been called
+    
+    
+  @property
+  def command(self):
+    '''cite, citep, citet, nocite, bibliography, or '' for other fields'''
+    return self.parsed.command
+    
+    
+  @property
+  def argument(self):
+    '''Whatever is between the braces of the command'''
+    return self.parsed.argument
+    
+    
+  @property
+  def citekeys(self):
+    '''The cite keys, as a tuple (cite fields only)'''
+    return self.parsed.citekeys
+    
+
+def parse_bibliography_options(argument):
+  '''Parses the option string stored in the bibliography field
+     (bib_file:...;bib_template:...) into a dictionary'''
+  options = {}
+  for part in argument.split(';'):
+    if part.strip() == '':
+      continue
+    key, value = part.split(':', 1)
+    options[key] = value
+  return options
+
+
+def find_bibliography_options(worddoc):
+  '''Returns the options stored in the document's bibliography field as a dictionary
+     (empty if there isn't one).  This needs only the field codes, in one request, and
+     stops at the first bibliography field, so it is cheaper than a FieldSnapshot.'''
+  for code in worddoc.field_codes():
+    if not isinstance(code, basestring) or 'bibliography' not in code:
+      continue  # (most fields are citations; skip them without parsing)
+    parsed = parse_code(code)
+    if parsed.command == 'bibliography':
+      return parse_bibliography_options(parsed.argument)
+  return {}
+  
+  
+class FieldSnapshot:
+  '''The fields of a document, fetched in bulk and parsed once'''
+  def __init__(self, worddoc):
+    self.worddoc = worddoc
+    self._fields = None
+    
+    
+  def invalidate(self):
+    '''Forgets the current snapshot.  Call this after adding or removing fields.'''
+    self._fields = None
+    
+    
+  def load_results(self):
+    '''Fetches the result text of all fields in one request and stores it on the fields.
+       Call this again after changing results to see the new text.'''
+    fields = self.fields()
+    results = self.worddoc.field_results()
+    for field, result in zip(fields, results):
+      field.result = isinstance(result, basestring) and result or u''  # empty results come back as missing values
+    
+    
+  def fields(self):
+    '''Returns all fields in the document, in document order'''
+    if self._fields == None:
+      self._fields = []
+      types, codes, starts = self.worddoc.field_properties()
+      for i in range(len(types)):
+        field = Field(i+1, types[i], codes[i], starts[i])
+        if field.field_type == self.worddoc.FIELD_ADDIN:
+          field.parsed = parse_code(field.code)
+        self._fields.append(field)
+    return self._fields
+    
+    
+  def bibliography(self):
+    '''Returns the bibliography field, or None if the document doesn't have one'''
+    for field in self.fields():
+      if field.command == 'bibliography':
+        return field
+    return None
+    
+    
+  def citations(self):
+    '''Returns the cite, citep, citet, and nocite fields in document order'''
+    return [ field for field in self.fields() if field.command in CITE_COMMANDS ]
+    
+    
+  def set_code(self, field, code):
+    '''Sets the code of a field in Word and in the snapshot.  This does not move any
+       field, so the rest of the snapshot stays valid.'''
+    self.worddoc.set_field_code(field.index, code)
+    field.code = code
+    field.parsed = parse_code(code)
@@ -0,0 +1,94 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Remembers enough about the last run to skip work that wouldn't change anything.
+
+At the end of a run we store a digest in the bibliography field's options: a
+hash of what went into the bibliography, and a short signature for every
+citation field.  A field's signature covers its command, the templates and
+BibDesk document in use, its cite keys with their numbers, the content hash
+of each publication it cites, and the text Word shows for it.  On the next
+run a field whose signature is still in the digest would be formatted to
+exactly the text it already has, so it is left alone.  Editing a field's keys,
+renumbering it, switching templates, or changing one of its publications (in
+BibDesk or the .bib file) changes the signature and the field is formatted
+again.  The bibliography's signature covers its publications' content the
+same way.
+'''
+
+import hashlib
+
+# characters of each field signature we keep; the digest lives in a field code, so it needs to be
+# small, but a collision would leave a changed field unformatted without a word, so 64 bits it is
+SIGNATURE_LENGTH = 16
+
+# written at the front of every digest; a digest of another version is ignored (and the next run rebuilds it)
+DIGEST_VERSION = '2'
+
+
+def _hash(parts):
+  text = u'\x1f'.join([ unicode(part) for part in parts ])
+  return hashlib.sha1(text.encode('utf-8')).hexdigest()
+  
+
+def setup_hash(bibfile, templatehashes):
+  '''Returns a hash of the run settings that affect every field'''
+  return _hash([ bibfile ] + list(templatehashes))[:SIGNATURE_LENGTH]
+  
+
+def field_signature(setup, command, cites, result, notes=()):
+  '''Returns the signature of a citation field.  The cites are (citekey, citenum, content
+     hash) triples in field order; result is the field's current result text; notes are the field's
+     pre and post notes, if it has any (fields without notes sign as they always have).'''
+  parts = [ setup, command ] + [ '%s=%s:%s' % cite for cite in cites ] + [ result or u'' ]
+  if notes:
+    parts += [ u'notes' ] + list(notes)
+  return _hash(parts)[:SIGNATURE_LENGTH]
+  
+  
+def bibliography_signature(setup, citekeys, pubhashes):
+  '''Returns the signature of the bibliography: its settings, the cite keys in order,
+     and the content hashes of their publications'''
+  return _hash([ setup ] + list(citekeys) + list(pubhashes))[:SIGNATURE_LENGTH * 2]
+  
+
+class RunDigest:
+  '''What we remember about the last run: the bibliography signature and the set of
+     citation field signatures'''
+  def __init__(self, bibliography='', fields=()):
+    self.bibliography = bibliography
+    self.fields = set(fields)
+    
+    
+  @classmethod
+  def parse(cls, text):
+    '''Reads a digest written by encode(); a missing, damaged, or older digest is simply empty'''
+    parts = (text or '').strip().split('.')
+    if len(parts) != 3 or parts[0] != DIGEST_VERSION:
+      return cls()
+    version, bibliography, fields = parts
+    return cls(bibliography, [ fields[i:i+SIGNATURE_LENGTH] for i in range(0, len(fields), SIGNATURE_LENGTH) ])
+    
+    
+  def encode(self):
+    '''Returns the digest as a compact string (hex digits and dots, safe in the options string)'''
+    return DIGEST_VERSION + '.' + self.bibliography + '.' + ''.join(sorted(self.fields))
+    
+    
+  def __contains__(self, signature):
+    return signature in self.fields
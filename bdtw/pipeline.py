@@ -0,0 +1,471 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''The bibliography pipeline, independent of the GUI.
+
+create_bibliography and remove_bibliography do the real work of the program.
+They talk to Word through a document object (bdtw.word.WordDocument, or a
+stand-in with the same methods), to the references through a library object
+(bdtw.bibdesk.BibDeskDocument or bdtw.bibtex.BibTeXLibrary), and to the user
+through an Interface.  The GUI passes in an Interface that shows dialogs; the
+default one never asks anything, so the pipeline can also run unattended.
+'''
+
+import os, shutil, tempfile
+
+from bdtw.bibdesk import BibDeskDocument
+from bdtw.bibtex import BibTeXLibrary
+from bdtw.cache import CachingLibrary, file_hash
+from bdtw.citations import CitationTable
+from bdtw.diagnostics import DUPLICATE, MALFORMED, PLACEHOLDER, UNCONVERTED, UNRESOLVED, Diagnostics
+from bdtw.fieldcode import add_notes
+from bdtw.fields import FieldSnapshot, parse_bibliography_options
+from bdtw.incremental import RunDigest, bibliography_signature, field_signature, setup_hash
+from bdtw.prefetch import DEFAULT_DEPTH, prefetch
+from bdtw.scanner import CITE_COMMANDS, convert_citations
+from bdtw.sorting import REFERENCE_ORDERS, SortKeyIndex
+from bdtw.template import part_template
+
+
+# what a cite field's result is set to (see _render_citations)
+NOCITE, TEXT, RICH = range(3)
+
+# how many references go into the bibliography at a time (see _write_bibliography)
+DEFAULT_BIB_CHUNK = 250
+
+
+################################################################################
+###   Options for a run
+
+class Options:
+  '''The settings of a run; these are stored in the bibliography field between runs'''
+  def __init__(self, bibfile, bibtemplate, citeptemplate, citettemplate, ref_order='Appearance', incremental=True, placeholders=False, render_ahead=DEFAULT_DEPTH, bib_chunk=DEFAULT_BIB_CHUNK):
+    self.bibfile = bibfile              # BibDesk document name or path to a .bib file
+    self.bibtemplate = bibtemplate      # template for the bibliography
+    self.citeptemplate = citeptemplate  # template for \cite and \citep
+    self.citettemplate = citettemplate  # template for \citet
+    self.ref_order = ref_order          # one of the codes in REFERENCE_ORDERS
+    self.incremental = incremental      # leave fields alone that wouldn't change
+    self.placeholders = placeholders    # show unresolved cite keys in the text as [key?]
+    self.render_ahead = render_ahead    # how many cite fields may be formatted ahead of being set (0: none)
+    self.bib_chunk = bib_chunk          # how many references go into the bibliography at a time (0: all at once)
+    
+    
+  def validate(self):
+    '''Ensures the options pass muster'''
+    assert self.bibfile.strip() != '', 'Please enter a valid BibDesk file name.'
+    assert not ':' in self.bibfile and not ';' in self.bibfile, 'The BibDesk file name cannot contain a colon or semicolon.'
+    assert self.bibtemplate != '' and os.path.isfile(self.bibtemplate), 'Please enter a valid bibliography template file name.'
+    assert not ':' in self.bibtemplate and not ';' in self.bibtemplate, 'The bibliography template file name cannot contain a colon or semicolon.'
+    assert self.citeptemplate != '' and os.path.isfile(self.citeptemplate), 'Please enter a valid \\cite template file name.'
+    assert not ':' in self.citeptemplate and not ';' in self.citeptemplate, 'The reference template file name cannot contain a colon or semicolon.'
+    assert self.citettemplate != '' and os.path.isfile(self.citettemplate), 'Please enter a valid \\citet template file name.'
+    assert not ':' in self.citettemplate and not ';' in self.citettemplate, 'The reference template file name cannot contain a colon or semicolon.'
+    assert self.ref_order in [ r[0] for r in REFERENCE_ORDERS ], 'Unknown sort order: ' + self.ref_order
+    assert self.bib_chunk >= 0, 'The bibliography chunk size cannot be negative.'
+    
+    
+  def code_parts(self):
+    '''Returns the option strings that go in the bibliography field code'''
+    bibdata = []
+    bibdata.append('bib_file:' + self.bibfile)
+    bibdata.append('bib_template:' + self.bibtemplate)
+    bibdata.append('citep_template:' + self.citeptemplate)
+    bibdata.append('citet_template:' + self.citettemplate)
+    bibdata.append('ref_order:' + self.ref_order)
+    return bibdata
+    
+    
+def open_library(bibfile):
+  '''Returns the library for a bib source: a path to a .bib file is read directly,
+     anything else is taken as the name of an open BibDesk document'''
+  if os.path.splitext(bibfile)[1].lower() == '.bib' and os.path.isfile(bibfile):
+    return BibTeXLibrary(bibfile)
+  return BibDeskDocument.named(bibfile)
+  
+
+################################################################################
+###   Talking to the user
+
+class Cancelled(Exception):
+  '''Raised when the user stops a run.  The pipeline only stops between fields, so
+     every field is either done or untouched, and the next run finishes the job.'''
+  pass
+  
+
+
+class Interface:
+  '''How the pipeline reports to the user.  This default never asks anything (which
+     is what unattended runs want); the GUI overrides the methods with dialogs.'''
+  def __init__(self):
+    self.warnings = []
+    self.diagnostics = Diagnostics()  # every problem found in the document
+    
+    
+  def progress(self, stage, message):
+    '''Called as the pipeline moves through its stages (0 to 5)'''
+    pass
+    
+    
+  def working_on(self, field):
+    '''Called as the pipeline starts on each field (a fields.Field)'''
+    pass
+    
+    
+  def confirm(self, message, title):
+    '''Asks a yes/no question; the default answer is yes'''
+    return True
+    
+    
+  def cancelled(self):
+    '''Checked between fields; returning True stops the run (raising Cancelled)'''
+    return False
+    
+    
+  def warn(self, message, title):
+    '''Tells the user about a problem that doesn't stop the run'''
+    self.warnings.append(message)
+    
+    
+  def diagnose(self, kind, message, citekey='', field=None, offset=None):
+    '''Called for every problem citation found (see bdtw.diagnostics).  Records it and
+       warns the first time each key has a kind of problem; the run carries on.'''
+    if self.diagnostics.add(kind, message, citekey, field, offset):
+      self.warn(message, 'Citation Skipped')
+    
+
+################################################################################
+###   Rich text templates
+
+class RichExport:
+  '''Formats citations with a rich text template and reads them into fields.
+     Each distinct group of citations goes through the template and into Word
+     once, by way of a single temp file that is reused for the whole run.  A
+     field that needs the same text as an earlier field gets a copy of that
+     field's formatted result, one request to Word instead of a file export and
+     an insert.'''
+  def __init__(self, worddoc, library, table):
+    self.worddoc = worddoc
+    self.library = library
+    self.table = table  # the CitationTable the cites are ids in
+    self.tempname = None
+    self.inserted = {}  # (template, strip_return, citation ids) -> index of the field holding that text
+    
+    
+  def insert(self, index, template, cites, strip_return=True):
+    '''Fills the result of a field with the formatted cites (a sequence of citation ids)'''
+    group = ( template, strip_return, tuple(cites) )  # (the ids stand for both the keys and the numbers)
+    if self.inserted.has_key(group):
+      self.worddoc.copy_field_result(self.inserted[group], index)
+      return
+    self._export(template, cites)
+    self.worddoc.insert_file_in_field(index, self.tempname, strip_return)
+    self.inserted[group] = index
+    
+    
+  def append(self, index, template, cites):
+    '''Adds the formatted cites to the end of a field's result (for a bibliography written in parts)'''
+    self._export(template, cites)
+    self.worddoc.append_file_in_field(index, self.tempname)
+    
+    
+  def _export(self, template, cites):
+    if self.tempname == None:
+      f = tempfile.NamedTemporaryFile() # this creates a temp file on the system
+      self.tempname = f.name
+      f.close()
+    self.library.export(self.tempname, template, self.table.publications_of(cites), self.table.citenums_of(cites))
+    
+    
+  def close(self):
+    '''Removes the temp file'''
+    if self.tempname != None and os.path.exists(self.tempname):
+      os.remove(self.tempname)
+    self.tempname = None
+    
+
+################################################################################
+###   The pipeline
+
+def create_bibliography(worddoc, library, options, ui=None, cache=None):
+  '''Main function of the program -- creates the bibliography by linking between the two
+     applications.  Returns a dictionary of counts describing what was done, or None if
+     the user chose not to add a bibliography.'''
+  ui = ui or Interface()
+  library = CachingLibrary(library, cache)
+  bibtemplate, citeptemplate, citettemplate = options.bibtemplate, options.citeptemplate, options.citettemplate
+  summary = { 'citations': 0, 'fields': 0, 'formatted': 0, 'bibliography': False, 'problems': 0 }
+  
+  # in incremental mode, fields that would come out the same as last time are left alone
+  setup = setup_hash(options.bibfile, [ file_hash(t) for t in ( citeptemplate, citettemplate ) ])
+  bibsetup = setup_hash(options.bibfile, [ file_hash(bibtemplate) ])
+
+  # search for both \cite{*} and \bibliography{*} and turn into fields
+  ui.progress(0, 'Finding new citations...')
+  convert_citations(worddoc, lambda offset, text: ui.diagnose(MALFORMED, 'Could not read the citation: ' + text, text, offset=offset),
+                    lambda offset, text: ui.diagnose(UNCONVERTED, 'Could not make a field of the citation (it runs into a field, a picture or the next paragraph): ' + text, text, offset=offset))
+  
+  # all later stages share one snapshot of the fields (taken after the new fields are in)
+  snapshot = FieldSnapshot(worddoc)
+
+  # search the fields for the bibliography
+  _check_cancelled(ui)
+  ui.progress(1, 'Updating the bibliography field...')
+  bibfield = snapshot.bibliography()
+  if bibfield == None:
+    if not ui.confirm('No \\bibliography cite found.  Add one for ' + options.bibfile + ' at the end of the document?', 'Bibliography Not Found'):
+      return None
+    worddoc.add_field_at_end(' ADDIN bibliography{}')
+    snapshot.invalidate()  # we added a field
+    bibfield = snapshot.bibliography()
+    
+  # the digest of the last run is only good if it was made with the same settings
+  previous = RunDigest()
+  if options.incremental:
+    previous = RunDigest.parse(parse_bibliography_options(bibfield.argument).get('digest'))
+    snapshot.load_results()
+
+  # update the bibliography field with values from the dialog
+  bibdata = options.code_parts()
+  snapshot.set_code(bibfield, ' ADDIN bibliography{' + ';'.join(bibdata) + '}')  # (drops the old digest until we finish)
+
+  # create a list of all citations in order of appearance in document
+  _check_cancelled(ui)
+  ui.progress(2, 'Adding in-text citation numbers...')
+  citefields = snapshot.citations()
+  table = CitationTable()  # every distinct cite key, and the citations among them
+  for field in citefields:
+    field.keyids = table.intern(field.citekeys)
+  pubindex = library.publication_index(table.citekeys)
+  for field in citefields:
+    for id in field.keyids:  # in case there are more than one citation in this \cite
+      if table.publications[id] != None:
+        continue
+      citekey = table.citekeys[id]
+      # problems are recorded wherever they occur, and the run goes on without the key
+      if citekey.strip() == '':
+        ui.diagnose(MALFORMED, 'Empty cite key in: \\' + field.parsed.text(), field.argument, field)
+      elif pubindex.is_duplicate(citekey):
+        ui.diagnose(DUPLICATE, 'More than one BibDesk entry matched cite key: ' + citekey, citekey, field)
+      elif pubindex.is_missing(citekey):
+        ui.diagnose(UNRESOLVED, 'No BibDesk entry found for cite key: ' + citekey, citekey, field)
+      else:
+        publication = pubindex.get(citekey)
+        table.resolve(id, publication, library.content_hash(publication))  # (the hash goes in the digest)
+  ui.progress(2, 'Adding in-text citation numbers (' + str(len(table)) + ')...')      
+
+  # go through and set the index number of each cite, according to the sort order 
+  _check_cancelled(ui)
+  ui.progress(3, 'Sorting and updating index numbers...')
+  table.sort(SortKeyIndex(library), options.ref_order)  # (Appearance leaves them in document order)
+  # set the numbers based on the sort order (these are used only if we are doing numbered references)
+  table.number()
+    
+  # set the text of the cite fields
+  assert len(citefields) > 0, 'No citations found in document.'
+  richexport = RichExport(worddoc, library, table)
+  _check_cancelled(ui)
+  ui.progress(4, 'Formatting citations...')  # (before the formatting starts, so it counts toward this stage)
+  # the cites are formatted (by BibDesk) a few fields ahead of their results being set (in Word)
+  rendered = prefetch(_render_citations(citefields, table, library, options, setup, previous), options.render_ahead)
+  try:
+    for fieldindex, citefield, kind, value in rendered:
+      _check_cancelled(ui, richexport)
+      ui.progress(4, 'Formatting citations (%s/%s)...' % (fieldindex, len(citefields)))
+      ui.working_on(citefield)
+      summary['formatted'] += 1
+      if kind == NOCITE:
+        worddoc.set_field_result(citefield.index, '')
+        worddoc.show_field_codes(citefield.index, True)
+        
+      elif kind == TEXT:  # formatted text, or a placeholder for keys that didn't resolve
+        worddoc.set_field_result(citefield.index, value)
+        worddoc.show_field_codes(citefield.index, False)  # show the bibliography text
+        
+      else:  # a word document or other rich text, so export to a file and then read back in (without placeholders or notes)
+        template, cites = value
+        richexport.insert(citefield.index, template, cites)
+        worddoc.show_field_codes(citefield.index, False)  # show the bibliography text
+  finally:
+    rendered.close()  # stops the formatting if we didn't get to the end
+
+  # create the bibliography and insert into the bibliography field's result range
+  _check_cancelled(ui, richexport)
+  ui.progress(5, 'Creating the bibliography...')
+  digest = RunDigest(bibliography_signature(bibsetup, table.citekeys_of(table.order), table.pubhashes_of(table.order)))
+  if digest.bibliography == previous.bibliography and bibfield.result:
+    pass  # same references in the same order as last time
+  else:
+    summary['bibliography'] = True
+    _write_bibliography(worddoc, library, table, bibfield.index, bibtemplate, richexport, options.bib_chunk, ui)
+  richexport.close()
+  library.flush()  # (one write to the cache for the whole run)
+    
+  # remember what we did so the next run can skip unchanged fields
+  snapshot.load_results()
+  for citefield in citefields:
+    digest.fields.add(field_signature(setup, citefield.command, _signature_cites(citefield, table, options), citefield.result, _notes(citefield)))
+  snapshot.set_code(bibfield, ' ADDIN bibliography{' + ';'.join(bibdata + [ 'digest:' + digest.encode() ]) + '}')
+  
+  summary['citations'] = len(table)
+  summary['fields'] = len(citefields)
+  summary['problems'] = len(ui.diagnostics)
+  if len(ui.diagnostics) > 0:
+    ui.diagnostics.locate(worddoc)  # (the offsets moved as the fields were filled in)
+  return summary
+  
+
+def _write_bibliography(worddoc, library, table, index, template, richexport, chunk, ui):
+  '''Fills the bibliography field (at index) with the references, in table order.
+     A long list goes in chunk references at a time: each part is formatted on its
+     own and added to the end of the field's result, so no one message to BibDesk or
+     Word has to carry the whole bibliography.  A template that can't be split
+     (see bdtw.template.part_template) is done in one go whatever its length.'''
+  order = table.order
+  rich = os.path.splitext(template)[1].lower() != '.txt'
+  directory = None
+  try:
+    if chunk <= 0 or len(order) <= chunk:
+      chunk = max(len(order), 1)  # all at once
+    else:
+      directory = tempfile.mkdtemp()
+      parttemplate = part_template(template, directory)
+      if parttemplate == None:
+        chunk = len(order)
+      else:
+        template = parttemplate
+    parts = max(( len(order) + chunk - 1 ) / chunk, 1)
+    for part in range(parts):
+      if parts > 1:
+        ui.progress(5, 'Creating the bibliography (%s/%s)...' % ( part + 1, parts ))
+      cites = order[part*chunk:(part+1)*chunk]
+      if rich and part == 0:  # a word document or other rich text, so export to a file and then read back in
+        richexport.insert(index, template, cites, strip_return=False)
+      elif rich:
+        richexport.append(index, template, cites)
+      else:  # if a text template, just have BibDesk give us the references
+        text = library.templated_text(template, table.publications_of(cites), table.citenums_of(cites))
+        if part == 0:
+          worddoc.set_field_result(index, text)
+        else:
+          worddoc.append_field_result(index, text)
+    if rich:
+      worddoc.show_field_codes(index, False)  # show the bibliography text
+  finally:
+    if directory != None:
+      shutil.rmtree(directory)
+      
+      
+def _render_citations(citefields, table, library, options, setup, previous):
+  '''Yields ( fieldindex, citefield, kind, value ) for each cite field that needs its result
+     set, in document order.  The kind is NOCITE, TEXT (value is the result text), or RICH
+     (value is the template and the citation ids in order, to be exported when the field is set).'''
+  for fieldindex, citefield in enumerate(citefields):
+    addin_type = citefield.command
+    # sort the cites numerically so they appear in order of the bibliography
+    cites = table.by_number(citefield.keyids)
+    placeholder = _placeholder(citefield, table, options)
+    if len(cites) == 0 and not placeholder:
+      continue
+    # skip the field if formatting it would give the text it already has
+    if field_signature(setup, addin_type, _signature_cites(citefield, table, options), citefield.result, _notes(citefield)) in previous:
+      continue
+    # format the citation depending on the type
+    template = addin_type == 'citet' and options.citettemplate or options.citeptemplate
+    if addin_type == 'nocite':
+      yield fieldindex, citefield, NOCITE, None
+      
+    elif len(cites) == 0:  # none of the keys resolved, so just show which ones are missing
+      yield fieldindex, citefield, TEXT, placeholder
+
+    elif os.path.splitext(template)[1].lower() == '.txt':  # if a text template, just have BibDesk give us the references
+      citetext = library.templated_text(template, table.publications_of(cites), table.citenums_of(cites))
+      citetext = add_notes(citetext, citefield.parsed.prenote, citefield.parsed.postnote).splitlines()
+      if placeholder:
+        citetext.append(u' ' + placeholder)
+      yield fieldindex, citefield, TEXT, citetext
+      
+    else:  # rich text has to be exported and inserted in one go, so that is left to the writer
+      yield fieldindex, citefield, RICH, ( template, cites )
+      
+      
+def _check_cancelled(ui, richexport=None):
+  '''Raises Cancelled if the user has asked to stop (removing any temp file first)'''
+  if ui.cancelled():
+    if richexport != None:
+      richexport.close()
+    raise Cancelled('Stopped before finishing.  Everything done so far was kept; run again to finish.')
+    
+    
+def _placeholder(citefield, table, options):
+  '''Returns the text that stands in for the unresolved keys of a field ('' for none)'''
+  if not options.placeholders or citefield.command == 'nocite':
+    return u''
+  unresolved = [ table.citekeys[id].strip() for id in citefield.keyids if table.publications[id] == None ]
+  return u''.join([ PLACEHOLDER % citekey for citekey in unresolved if citekey ])
+  
+  
+def _notes(citefield):
+  '''Returns what goes into a field's signature for its notes (nothing if it has none)'''
+  if citefield.parsed.prenote or citefield.parsed.postnote:
+    return ( citefield.parsed.prenote, citefield.parsed.postnote )
+  return ()
+  
+  
+def _signature_cites(citefield, table, options):
+  '''Returns what goes into a field's signature: its cites in field order (with the content
+     of their publications), and any placeholder text'''
+  cites = table.cited(citefield.keyids)
+  signed = zip(table.citekeys_of(cites), table.citenums_of(cites), table.pubhashes_of(cites))
+  placeholder = _placeholder(citefield, table, options)
+  if placeholder:
+    signed.append(( placeholder, 0, '' ))
+  return signed
+  
+
+def remove_bibliography(worddoc, ui=None, dry_run=False):
+  '''Removes the bibliography, including all codes, turning the fields back into
+     \\cite{...} text.  Returns the number of fields removed; with dry_run, returns
+     the number that would be removed and leaves the document alone.'''
+  ui = ui or Interface()
+  # work out the text for every field first, grouped into runs of fields with
+  # no other field between them, which Word can turn into text all at once
+  runs = []  # ( index of the first field, [ text for each field ] )
+  for field in FieldSnapshot(worddoc).fields():
+    if field.command in CITE_COMMANDS:
+      text = '\\' + field.parsed.text()
+    elif field.command == 'bibliography':
+      text = '\\bibliography{}'  # leaves the location, but resets the options
+    else:
+      continue  # not one of ours
+    if len(runs) > 0 and runs[-1][0] + len(runs[-1][1]) == field.index:
+      runs[-1][1].append(text)
+    else:
+      runs.append(( field.index, [ text ] ))
+  removed = sum([ len(texts) for first, texts in runs ])
+  assert removed > 0, 'There are no bibliography codes in the Word document.'
+  if dry_run:
+    return removed
+  # go backwards since we are removing items
+  done = 0
+  for first, texts in reversed(runs):
+    _check_cancelled(ui)
+    ui.progress(done+1, 'Removing bibliography fields...')
+    worddoc.unlink_fields(first, texts)
+    done += len(texts)
+  return removed
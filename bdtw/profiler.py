@@ -0,0 +1,262 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Counts and times the Apple Events a run sends.
+
+Attach a profiler to the Word document and library and every property get,
+set, and command they send is counted and timed.  Each
+call is charged to the pipeline stage that was running (the stage numbers on
+the progress dialog, 0 to 5), to the field being worked on, and to the line
+of our code that made it.  The report written at the end says which stage and
+which lines are worth attacking:
+
+    profiler = Profiler()
+    worddoc = profiler.attach(WordDocument.active())
+    library = profiler.attach(open_library(bibfile))
+    summary = create_bibliography(worddoc, library, options, profiler.interface(ui))
+    profiler.write_report('report.json', summary['citations'])
+
+The stand-ins in bdtw.fake can be profiled too (each method call then counts
+as one call).  In the application, set BDTW_PROFILE to the report's filename.
+'''
+
+import json, os, sys, time
+
+from bdtw.pipeline import Interface
+
+# how many entries go in the "slowest" lists of the report
+REPORT_LENGTH = 20
+
+# stage names used in the report
+STAGES = {
+  0: 'Finding new citations',
+  1: 'Updating the bibliography field',
+  2: 'Resolving cite keys',
+  3: 'Sorting',
+  4: 'Formatting citations',
+  5: 'Creating the bibliography',
+}
+
+
+class _Stats:
+  '''Call count and timing for one bucket of the report'''
+  def __init__(self):
+    self.calls = 0
+    self.seconds = 0.0
+    self.slowest = 0.0
+    
+    
+  def add(self, seconds):
+    self.calls += 1
+    self.seconds += seconds
+    self.slowest = max(self.slowest, seconds)
+    
+    
+  def report(self):
+    return { 'calls': self.calls, 'seconds': round(self.seconds, 6), 'slowest': round(self.slowest, 6) }
+    
+
+class Profiler:
+  '''Collects the calls made through wrapped references'''
+  def __init__(self):
+    self.stage = None       # the pipeline stage currently running
+    self.field = None       # the field currently being worked on (its index), if any
+    self.total = _Stats()
+    self.stages = {}        # stage -> _Stats
+    self.operations = {}    # command name (get, set, create_range, ...) -> _Stats
+    self.sites = {}         # "file:line (function)" -> _Stats
+    self.fields = {}        # field index -> _Stats
+    self._here = os.path.splitext(os.path.abspath(__file__))[0]
+    
+    
+  def wrap(self, target):
+    '''Returns a stand-in for target that records every call made through it'''
+    return _Wrapper(target, self, '')
+    
+    
+  def attach(self, backend):
+    '''Profiles a WordDocument or library by wrapping the application reference
+       inside it.  Objects without one (the stand-ins in bdtw.fake) are wrapped whole.'''
+    for attr in ( 'doc', 'bibdoc' ):
+      if hasattr(backend, attr):
+        setattr(backend, attr, self.wrap(getattr(backend, attr)))
+        return backend
+    return self.wrap(backend)
+    
+    
+  def interface(self, ui=None):
+    '''Returns an Interface that tells us which stage and field the pipeline is on
+       and passes everything through to ui'''
+    return _ProfilingInterface(ui or Interface(), self)
+    
+    
+  def record(self, operation, seconds):
+    '''Charges one call to the current stage, field, and call site'''
+    self.total.add(seconds)
+    self.stages.setdefault(self.stage, _Stats()).add(seconds)
+    self.operations.setdefault(operation, _Stats()).add(seconds)
+    self.sites.setdefault(self._call_site(), _Stats()).add(seconds)
+    if self.field != None:
+      self.fields.setdefault(self.field, _Stats()).add(seconds)
+      
+      
+  def _call_site(self):
+    '''Returns the first line up the stack that isn't in this module'''
+    frame = sys._getframe(2)
+    while frame != None and os.path.splitext(os.path.abspath(frame.f_code.co_filename))[0] == self._here:
+      frame = frame.f_back
+    if frame == None:
+      return '?'
+    return '%s:%s (%s)' % ( os.path.basename(frame.f_code.co_filename), frame.f_lineno, frame.f_code.co_name )
+    
+    
+  def report(self, citations=None):
+    '''Returns the report as a dictionary (ready for JSON)'''
+    def slowest(stats):
+      items = sorted(stats.items(), key=lambda item: item[1].seconds, reverse=True)[:REPORT_LENGTH]
+      return [ dict(stat.report(), name=name) for name, stat in items ]
+    report = {
+      'total': self.total.report(),
+      'stages': [ dict(self.stages[stage].report(), stage=stage, name=STAGES.get(stage, 'Setup')) for stage in sorted(self.stages) ],
+      'operations': slowest(self.operations),
+      'slowest_sites': slowest(self.sites),
+      'slowest_fields': slowest(self.fields),
+    }
+    if citations:
+      report['citations'] = citations
+      report['calls_per_citation'] = round(float(self.total.calls) / citations, 2)
+    return report
+    
+    
+  def write_report(self, filename, citations=None):
+    '''Writes the report to a JSON file'''
+    f = open(filename, 'w')
+    try:
+      json.dump(self.report(citations), f, indent=2, sort_keys=True)
+    finally:
+      f.close()
+      
+
+class _Wrapper(object):
+  '''Stands in for an appscript reference (or any object), recording each call'''
+  def __init__(self, target, profiler, name):
+    object.__setattr__(self, '_target', target)
+    object.__setattr__(self, '_profiler', profiler)
+    object.__setattr__(self, '_name', name)
+    
+    
+  def __getattr__(self, name):
+    return _wrap_result(getattr(self._target, name), self._profiler, name)
+    
+    
+  def __setattr__(self, name, value):
+    setattr(self._target, name, value)
+    
+    
+  def __getitem__(self, key):
+    return _Wrapper(self._target[_unwrap(key)], self._profiler, self._name)
+    
+    
+  def __call__(self, *args, **kwargs):
+    args = [ _unwrap(a) for a in args ]
+    kwargs = dict([ ( k, _unwrap(v) ) for k, v in kwargs.items() ])
+    start = time.time()
+    try:
+      result = self._target(*args, **kwargs)
+    finally:
+      self._profiler.record(self._name, time.time() - start)
+    return _wrap_result(result, self._profiler, self._name)
+    
+    
+  def __repr__(self):
+    return repr(self._target)
+    
+    
+  def __eq__(self, other):
+    return self._target == _unwrap(other)
+    
+    
+  def __ne__(self, other):
+    return not self.__eq__(other)
+    
+    
+  def __hash__(self):
+    return hash(self._target)
+    
+    
+  def __len__(self):
+    return len(self._target)
+    
+    
+  def __iter__(self):
+    for item in self._target:
+      yield _wrap_result(item, self._profiler, self._name)
+      
+
+def _wrap_result(value, profiler, name):
+  '''Wraps references (which events can be sent through) and commands; data is returned as is'''
+  if isinstance(value, list):
+    return [ _wrap_result(v, profiler, name) for v in value ]
+  if callable(value) or hasattr(value, 'AS_aemreference'):
+    return _Wrapper(value, profiler, name)
+  return value
+  
+  
+def _unwrap(value):
+  if isinstance(value, _Wrapper):
+    return value._target
+  if isinstance(value, list):
+    return [ _unwrap(v) for v in value ]
+  if isinstance(value, tuple):
+    return tuple([ _unwrap(v) for v in value ])
+  if isinstance(value, dict):
+    return dict([ ( _unwrap(k), _unwrap(v) ) for k, v in value.items() ])
+  return value
+  
+
+class _ProfilingInterface(Interface):
+  '''Passes everything to another Interface and tells the profiler where we are'''
+  def __init__(self, ui, profiler):
+    Interface.__init__(self)
+    self.ui = ui
+    self.profiler = profiler
+    self.warnings = ui.warnings
+    self.diagnostics = ui.diagnostics
+    
+    
+  def progress(self, stage, message):
+    self.profiler.stage = stage
+    self.profiler.field = None
+    self.ui.progress(stage, message)
+    
+    
+  def working_on(self, field):
+    self.profiler.field = field.index
+    self.ui.working_on(field)
+    
+    
+  def confirm(self, message, title):
+    return self.ui.confirm(message, title)
+    
+    
+  def cancelled(self):
+    return self.ui.cancelled()
+    
+    
+  def warn(self, message, title):
+    self.ui.warn(message, title)
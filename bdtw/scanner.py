@@ -0,0 +1,154 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+r'''Finds \cite{...} style commands in the document text and turns them into fields.
+
+The old approach ran one wildcard search in Word for each command type and
+converted every hit through the selection, which costs a dozen Apple Events
+per citation plus the search setup for each command.  Here the text is read
+once, every command is found with a single compiled pattern, and the hits are
+converted from the end of the document back to the start so the offsets of
+the ones still waiting stay valid.
+
+Only the search is done in one go.  Word has no request that makes many
+fields at once, so each conversion still costs a fixed handful of events
+(see WordDocument.replace_with_field; bdtw.fake charges eight), and the
+cost of this stage grows with the number of new citations.  Citations are
+only converted once, so later runs pay just the one read.
+'''
+
+import re
+
+from bdtw.fieldcode import CITE_COMMANDS
+
+# the text commands we turn into fields
+TEXT_COMMANDS = CITE_COMMANDS + ( 'bibliography', )
+
+# up to two optional arguments in brackets, then the argument in braces, which may hold
+# one level of inner braces (see bdtw.fieldcode for what the parts mean)
+ARGUMENTS = r'(?:\[[^\[\]{}]*\]){0,2}\{(?:[^{}]|\{[^{}]*\})*\}'
+
+# one pattern for all commands
+CITATION_RE = re.compile(r'\\(' + '|'.join(TEXT_COMMANDS) + r')' + ARGUMENTS)
+
+# a command that CITATION_RE can't read: no braces, no closing brace, or braces nested too deep
+MALFORMED_RE = re.compile(r'\\(' + '|'.join(TEXT_COMMANDS) + r')\b(?!' + ARGUMENTS + r')')
+
+# the most of a malformed command we quote
+MALFORMED_LENGTH = 40
+
+class NotConvertible(Exception):
+  '''Raised by a document's replace_with_field when the text can't become a field (for
+     example, a .docx citation that runs into a field or the next paragraph); the
+     text is left as it was'''
+  pass
+  
+
+# the characters Word uses to delimit a field when the text includes field codes
+FIELD_BEGIN = u'\x13'
+FIELD_SEPARATOR = u'\x14'
+FIELD_END = u'\x15'
+
+
+def find_citations(text):
+  '''Returns a list of (start, end, citetext) for every text command in the given
+     document text, in document order.  The citetext is the command without its
+     leading backslash, i.e. what goes after ADDIN in the field code.  Commands
+     that are already inside a field (code or result) are skipped.'''
+  return [ ( m.start(), m.end(), m.group(0)[1:] ) for m in _outside_fields(CITATION_RE, text) ]
+  
+  
+def find_malformed(text):
+  '''Returns a list of (start, commandtext) for every text command that looks like a
+     citation but can't be read as one (outside fields, in document order)'''
+  return [ ( m.start(), _command_text(text, m.start(), m.end()) ) for m in _outside_fields(MALFORMED_RE, text) ]
+  
+  
+def _command_text(text, start, end):
+  '''Returns a command and its arguments, as far as they go, for quoting in a message'''
+  limit = min(len(text), start + MALFORMED_LENGTH)
+  pos = end
+  # the optional arguments
+  while pos < limit and text[pos] == '[':
+    close = text.find(']', pos, limit)
+    if close < 0:
+      return text[start:limit]
+    pos = end = close + 1
+  # the braced argument
+  depth = 0
+  for pos in xrange(pos, limit):
+    if text[pos] == '{':
+      depth += 1
+    elif text[pos] == '}':
+      depth -= 1
+    elif depth == 0 or text[pos] in '\r\n':
+      break
+    end = pos + 1
+    if depth == 0:
+      break
+  return text[start:end]
+  
+  
+def _outside_fields(regex, text):
+  '''Returns the matches of a pattern that aren't inside a field (code or result)'''
+  matches = []
+  depth = 0
+  pos = 0
+  hasfields = FIELD_BEGIN in text
+  for m in regex.finditer(text):
+    # track field nesting between the previous match and this one
+    if hasfields:
+      depth = _field_depth(text, pos, m.start(), depth)
+      pos = m.start()
+    if depth == 0:
+      matches.append(m)
+  return matches
+
+
+def _field_depth(text, start, end, depth):
+  '''Returns the field nesting depth after walking text[start:end]'''
+  if start >= end:
+    return depth
+  depth += text.count(FIELD_BEGIN, start, end) - text.count(FIELD_END, start, end)
+  return max(depth, 0)
+
+
+def convert_citations(worddoc, diagnose=None, unconverted=None):
+  '''Converts all text commands in the document to ADDIN fields.  The worddoc is
+     a bdtw.word.WordDocument (or anything with the same text/replace_with_field
+     methods, such as an in-memory stand-in).  Returns the number of commands
+     converted.  If given, diagnose is called with (offset, commandtext) for each
+     command that can't be read, and unconverted for each command the document
+     couldn't turn into a field (which stays as text); the offsets are into the
+     text as it was read.'''
+  text = worddoc.text()
+  matches = find_citations(text)
+  if diagnose != None:
+    for start, commandtext in find_malformed(text):
+      diagnose(start, commandtext)
+  # back to front so the offsets of earlier matches are not moved by our edits
+  failed = []
+  for start, end, citetext in reversed(matches):
+    try:
+      worddoc.replace_with_field(start, end, ' ADDIN ' + citetext)
+    except NotConvertible:
+      failed.append(( start, text[start:end] ))
+  if unconverted != None:
+    for start, commandtext in reversed(failed):
+      unconverted(start, commandtext)
+  return len(matches) - len(failed)
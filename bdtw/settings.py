@@ -0,0 +1,97 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''The dialog's settings for each document, remembered between launches.
+
+The options of a run are stored in the document's bibliography field, and the
+dialog used to read them back from Word before it appeared, which takes a
+while in a long document.  DocumentSettings remembers the options last seen
+in each document file, so the dialog can show them straight away the next
+time.  An entry only counts while the file has the modification time it had
+when the entry was stored; after the document is saved elsewhere (or edited
+by another copy of the program), the options are read from Word again.
+'''
+
+import json, os, tempfile, time
+
+from bdtw.cache import default_cache_path
+
+# how many documents to remember; the ones used least recently are forgotten first
+MAX_DOCUMENTS = 200
+
+
+def default_settings_path():
+  '''Returns where the settings are kept by default: beside the render cache'''
+  return os.path.join(os.path.dirname(default_cache_path()), 'document-settings.json')
+  
+
+def _mtime(path):
+  try:
+    return os.path.getmtime(path)
+  except OSError:
+    return None
+    
+    
+class DocumentSettings:
+  '''The bibliography options last seen in each document, keyed by the document's path'''
+  def __init__(self, filename=None):
+    self.filename = filename or default_settings_path()
+    self.documents = {}  # path -> { 'mtime': ..., 'used': ..., 'options': { option name: value } }
+    try:
+      f = open(self.filename, 'rb')
+      try:
+        self.documents = json.load(f)
+      finally:
+        f.close()
+    except ( IOError, ValueError ):
+      pass  # nothing remembered yet (or the file is damaged); start over
+      
+      
+  def get(self, path):
+    '''Returns the options remembered for a document, or None if there are none or the
+       file has changed since'''
+    entry = self.documents.get(path)
+    if entry == None or entry['mtime'] == None or entry['mtime'] != _mtime(path):
+      return None
+    return entry['options']
+    
+    
+  def put(self, path, options):
+    '''Remembers the options of a document (a dictionary, as parse_bibliography_options returns)'''
+    self.documents[path] = { 'mtime': _mtime(path), 'used': time.time(), 'options': options }
+    if len(self.documents) > MAX_DOCUMENTS:
+      for oldest in sorted(self.documents, key=lambda p: self.documents[p]['used'])[:len(self.documents) - MAX_DOCUMENTS]:
+        del self.documents[oldest]
+    self.save()
+    
+    
+  def save(self):
+    '''Writes the settings out.  They are only a convenience, so failing to is not an error.'''
+    try:
+      directory = os.path.dirname(self.filename)
+      if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+      fd, tempname = tempfile.mkstemp(dir=directory or '.', suffix='.tmp')
+      f = os.fdopen(fd, 'wb')
+      try:
+        json.dump(self.documents, f)
+      finally:
+        f.close()
+      os.rename(tempname, self.filename)
+    except ( IOError, OSError ):
+      pass
@@ -0,0 +1,167 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Sort keys for the bibliography orders.
+
+Asking the library for each citation's author names one at a time costs an
+Apple Event per author with BibDesk, and comparing the raw strings by code
+point puts a name starting with an accented letter after "Zhang".  Instead,
+the library hands over everything sorting needs for all the cited
+publications in one bulk request (its sort_fields method), and each value is
+turned into a collation key once:
+
+  - Text is compared the way people read it: with PyICU installed, by the
+    collator for the current locale; otherwise accents, case and ligatures
+    are folded away first and only break ties.
+  - Name particles ("van", "de la" -- the lowercase words BibTeX calls the von
+    part) are set aside, so "van der Berg" files under B, with the particle
+    only breaking ties.
+
+REFERENCE_ORDERS lists the orders the program offers.  Each row has a code
+(stored in the bibliography field), a label for the dialog, and a function
+from a publication's SortRecord to its key; adding an order is adding a row.
+'''
+
+import re, unicodedata
+
+try:
+  import icu  # PyICU, for locale-aware collation when it is installed
+  _collator = icu.Collator.createInstance(icu.Locale.getDefault())
+except ImportError:
+  icu = _collator = None
+
+# letters that don't decompose into a base letter and an accent
+FOLDED_LETTERS = {
+  u'\xdf': u'ss', u'\xe6': u'ae', u'\xc6': u'ae', u'\u0153': u'oe', u'\u0152': u'oe', u'\xf8': u'o', u'\xd8': u'o',
+  u'\u0142': u'l', u'\u0141': u'l', u'\u0111': u'd', u'\u0110': u'd', u'\xf0': u'd', u'\xd0': u'd', u'\xfe': u'th', u'\xde': u'th',
+  u'\u0131': u'i',
+}
+
+# punctuation and runs of spaces, which folded text leaves out
+PUNCTUATION_RE = re.compile(r'[^\w\s]', re.UNICODE)
+SPACES_RE = re.compile(r'\s+', re.UNICODE)
+
+# the first run of four digits in a year field
+YEAR_RE = re.compile(r'\d{4}')
+
+# where publications without a year go (after everything else)
+NO_YEAR = 10000
+
+
+class SortRecord(object):
+  '''The collation keys of one publication'''
+  __slots__ = ( 'authors', 'citekey', 'year', 'title' )
+  
+  def __init__(self, authors, citekey, year, title):
+    self.authors = tuple([ name_key(name) for name in authors ])
+    self.citekey = collation_key(citekey)
+    self.year = year_key(year)
+    self.title = collation_key(title)
+    
+
+# The bibliography orders that we support: code, label, and key function (None keeps the document order)
+REFERENCE_ORDERS = [
+  [ 'Appearance', 'Order of appearance in document', None ],
+  [ 'LastName', 'Alphabetical by author last names', lambda r: ( r.authors, r.year, r.title ) ],
+  [ 'CiteKey', 'Alphabetical by citation key', lambda r: r.citekey ],
+  [ 'YearLastName', 'By year, then author last names', lambda r: ( r.year, r.authors, r.title ) ],
+  [ 'Title', 'Alphabetical by title', lambda r: ( r.title, r.authors, r.year ) ],
+]
+
+
+def order_key(code):
+  '''Returns the key function of a reference order (None for document order)'''
+  for row in REFERENCE_ORDERS:
+    if row[0] == code:
+      return row[2]
+  assert False, 'Unknown sort order: ' + code
+  
+  
+class SortKeyIndex:
+  '''Sort records for publications, fetched from the library in bulk and kept per
+     publication, so each publication is fetched and collated once however many
+     times it is compared'''
+  def __init__(self, library):
+    self.library = library
+    self.records = {}  # publication -> SortRecord
+    
+    
+  def load(self, publications):
+    '''Fetches the records of any publications not already loaded, in one request'''
+    missing, seen = [], set()
+    for publication in publications:
+      if publication not in self.records and publication not in seen:
+        missing.append(publication)
+        seen.add(publication)
+    if missing:
+      for publication, fields in zip(missing, self.library.sort_fields(missing)):
+        self.records[publication] = SortRecord(*fields)
+        
+        
+  def order(self, publications, code):
+    '''Returns the positions of publications in a reference order (None for Appearance).
+       The sort is stable, so ties stay in order of appearance.'''
+    keyfunction = order_key(code)
+    if keyfunction == None:
+      return None
+    self.load(publications)
+    records = self.records
+    return sorted(xrange(len(publications)), key=lambda i: keyfunction(records[publications[i]]))
+    
+    
+################################################################################
+###   Collation
+
+# collation keys by text; the same names and words come up over and over
+_keys = {}
+
+def collation_key(text):
+  '''Returns a key that sorts text alphabetically regardless of accents and case'''
+  if not isinstance(text, unicode):
+    text = unicode(text or '', 'utf-8', 'replace')
+  if text not in _keys:
+    if _collator != None:
+      _keys[text] = _collator.getSortKey(text)
+    else:
+      # compare the folded text first; the exact text only breaks ties
+      _keys[text] = ( _fold(text), text )
+  return _keys[text]
+  
+  
+def name_key(name):
+  '''Returns the key of a normalized name ("von Last, Jr., First"): the name with
+     the particles left out, then the particles'''
+  if not isinstance(name, unicode):
+    name = unicode(name or '', 'utf-8', 'replace')
+  parts = [ p.strip() for p in name.split(',') ]
+  words = parts[0].split()
+  particles = []
+  while len(words) > 1 and words[0][:1].islower():
+    particles.append(words.pop(0))
+  return ( collation_key(u', '.join([ u' '.join(words) ] + parts[1:])), collation_key(u' '.join(particles)) )
+  
+  
+def year_key(year):
+  '''Returns a year as a number, with missing or odd years last'''
+  m = YEAR_RE.search(unicode(year or ''))
+  return m and int(m.group(0)) or NO_YEAR
+  
+  
+def _fold(text):
+  text = u''.join([ FOLDED_LETTERS.get(c, c) for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c) ])
+  return SPACES_RE.sub(u' ', PUNCTUATION_RE.sub(u'', text)).strip().lower()
@@ -0,0 +1,405 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Formats publications with BibDesk's text templates, without BibDesk.
+
+This covers the part of BibDesk's template language that citation and
+bibliography templates use:
+
+    <$key/>                          the value of a key path
+    <$key> ... <?$key> ... </$key>   repeat for each item of a collection, with
+                                     an optional separator between the items
+    <$key?> ... <?$key?> ... </$key?>
+                                     a condition on whether the key has a value,
+                                     with an optional else part
+    <$key=value?> ... <?$key=other?> ... <?$key?> ... </$key?>
+                                     a condition on the value of the key (also
+                                     != and ~ for contains; case doesn't matter)
+
+Key paths are dotted keys, as in <$authors.lastName.@firstObject/>.  A key
+applied to a list gives the list of that key for each item, and the
+collection operators @count, @firstObject, @lastObject, and
+@componentsJoinedByComma/And/CommaAndAnd work on lists.  Each publication
+answers the keys in its template_value method (see bdtw.bibtex.Entry), and
+<$itemIndex/> is a publication's place (from 1) in the list being formatted.
+As in BibDesk, a collection or condition tag that is alone on its line takes
+the whole line (including the return) with it.
+
+A template is parsed once and compiled into nested render functions, which
+are kept for as long as the file doesn't change.
+
+Numbered templates write :::Index:<$itemIndex/>::: where the number goes.
+fill_indices turns those markers into the real bibliography numbers in one
+pass over the formatted text (fill_indices_in_file does the same for a rich
+text export), so the numbers are right before the text ever reaches Word.
+'''
+
+import codecs, os, re, subprocess
+
+# collection and condition tags, and value tags
+TAG_RE = re.compile(r'<(/?)(\??)\$([\w.@]+)(?:(==|!=|=|~)([^?>]*))?(\?)?(/?)>')
+
+# a tag on a line of its own (only whitespace around it)
+LINE_BEFORE_RE = re.compile(r'(^|\n)[ \t]*\Z')
+LINE_AFTER_RE = re.compile(r'^[ \t]*(\r\n|\r|\n|$)')
+
+# where a numbered template put a citation's place in the list it formatted
+INDEX_MARKER_RE = re.compile(r':::Index:(\d+):::')
+INDEX_MARKER = ':::Index:'
+
+# an item's place in the list, where it isn't already inside an index marker
+BARE_INDEX_RE = re.compile(r'(?<!:::Index:)<\$itemIndex/>')
+
+# a template that is nothing but its list of publications
+LIST_ONLY_RE = re.compile(r'^\s*<\$publications>.*</\$publications>\s*$', re.DOTALL)
+
+# the signature at the start of a binary (OLE) Word file
+OLE_SIGNATURE = '\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+COLLECTION_OPERATORS = {
+  '@count': len,
+  '@firstObject': lambda items: items and items[0] or None,
+  '@lastObject': lambda items: items and items[-1] or None,
+  '@componentsJoinedByComma': lambda items: u', '.join([ _text(i) for i in items ]),
+  '@componentsJoinedByAnd': lambda items: u' and '.join([ _text(i) for i in items ]),
+  '@componentsJoinedByCommaAndAnd': lambda items: _join_comma_and([ _text(i) for i in items ]),
+}
+
+
+class Template:
+  '''A compiled template'''
+  def __init__(self, source):
+    self._render = _compile(_parse(_tokenize(source)))
+    
+    
+  def render(self, publications):
+    '''Formats a list of publications; returns the text'''
+    out = []
+    self._render(_Document(publications), 0, out)
+    return u''.join(out)
+    
+    
+# compiled templates by file, with the size and time they were compiled at
+_templates = {}
+
+def load_template(filename):
+  '''Returns the compiled Template in a file (compiled again only when the file changes)'''
+  st = os.stat(filename)
+  statkey = ( st.st_size, st.st_mtime )
+  if filename not in _templates or _templates[filename][0] != statkey:
+    f = open(filename, 'rb')
+    try:
+      source = f.read()
+    finally:
+      f.close()
+    if source.startswith(codecs.BOM_UTF8):
+      source = source[len(codecs.BOM_UTF8):]
+    try:
+      source = source.decode('utf-8')
+    except UnicodeDecodeError:
+      source = source.decode('mac_roman')  # older templates
+    _templates[filename] = ( statkey, Template(source) )
+  return _templates[filename][1]
+  
+  
+def fill_indices(text, citenums):
+  '''Replaces each :::Index:i::: marker in formatted text with the number of the
+     i-th citation formatted (from 1).  Works on unicode and byte strings.'''
+  if not citenums or INDEX_MARKER not in text:
+    return text
+  def number(m):
+    i = int(m.group(1))
+    if 0 < i <= len(citenums):
+      return str(citenums[i-1])
+    return m.group(0)
+  return INDEX_MARKER_RE.sub(number, text)
+  
+  
+def fill_indices_in_file(filename, citenums):
+  '''Fills in the index markers of a rich text export, rewriting the file in place.
+     RTF is text, so the markers are replaced directly; a binary Word file can't be
+     edited that way, so it is converted to RTF first (which Word reads the same).'''
+  if not citenums:
+    return
+  data = _read(filename)
+  if data.startswith(OLE_SIGNATURE):
+    if INDEX_MARKER not in data and INDEX_MARKER.encode('utf-16-le') not in data:
+      return
+    rtfname = filename + '.rtf'
+    try:
+      assert subprocess.call([ 'textutil', '-convert', 'rtf', '-output', rtfname, filename ]) == 0, 'Could not convert the exported citation to RTF: ' + filename
+      data = _read(rtfname)
+    finally:
+      if os.path.exists(rtfname):
+        os.remove(rtfname)
+  filled = fill_indices(data, citenums)
+  if filled is not data:
+    f = open(filename, 'wb')
+    try:
+      f.write(filled)
+    finally:
+      f.close()
+      
+      
+def part_template(filename, directory):
+  '''Returns the name of a template that formats a long list of publications a part at
+     a time the same way the template in filename formats it all at once, or None if
+     there is no such template.  BibDesk numbers each part from 1, so a bare
+     <$itemIndex/> is turned into an index marker for fill_indices to number (in a
+     copy of the template written to directory).  A template with anything outside
+     its <$publications> list, such as a heading, would repeat it in every part, so
+     it can't be split.  Rich text templates are read by converting them to RTF,
+     which needs textutil (i.e. a Mac).'''
+  ext = os.path.splitext(filename)[1].lower()
+  if ext == '.txt':
+    source = plain = _read(filename)
+    if plain.startswith(codecs.BOM_UTF8):
+      plain = plain[len(codecs.BOM_UTF8):]
+  else:
+    ext = '.rtf'
+    source, plain = _convert(filename, 'rtf', directory), _convert(filename, 'txt', directory)
+  if source == None or plain == None or not LIST_ONLY_RE.match(plain):
+    return None
+  if not BARE_INDEX_RE.search(source):
+    return filename
+  partname = os.path.join(directory, 'part-template' + ext)
+  f = open(partname, 'wb')
+  try:
+    f.write(BARE_INDEX_RE.sub(INDEX_MARKER + '<$itemIndex/>:::', source))
+  finally:
+    f.close()
+  return partname
+  
+  
+def _convert(filename, format, directory):
+  '''Returns the contents of a rich text file converted by textutil, or None if it can't be'''
+  output = os.path.join(directory, 'converted.' + format)
+  try:
+    if subprocess.call([ 'textutil', '-convert', format, '-output', output, filename ]) != 0:
+      return None
+    return _read(output)
+  except (OSError, IOError):
+    return None  # no textutil (not a Mac), or it didn't write the file
+  finally:
+    if os.path.exists(output):
+      os.remove(output)
+      
+      
+def _read(filename):
+  f = open(filename, 'rb')
+  try:
+    return f.read()
+  finally:
+    f.close()
+    
+    
+class _Document:
+  '''The outermost object of a template'''
+  def __init__(self, publications):
+    self.publications = publications
+    
+    
+  def template_value(self, key):
+    if key == 'publications':
+      return self.publications
+    return None
+    
+    
+################################################################################
+###   Parsing
+
+class _Tag:
+  def __init__(self, m):
+    self.close = m.group(1) == '/'
+    self.alternative = m.group(2) == '?'
+    self.keys = m.group(3).split('.')
+    self.operator = m.group(4)
+    self.operand = m.group(5) or u''
+    self.condition = m.group(6) == '?'
+    self.value = m.group(7) == '/'
+    self.text = m.group(0)
+    
+    
+def _tokenize(source):
+  '''Splits a template into text and _Tags.  Text around a collection or condition
+     tag that is alone on its line is trimmed the way BibDesk does.'''
+  tokens = []
+  pos = 0
+  for m in TAG_RE.finditer(source):
+    tokens.append(source[pos:m.start()])
+    tokens.append(_Tag(m))
+    pos = m.end()
+  tokens.append(source[pos:])
+  startofline = True  # whether the text before the next tag starts on a new line
+  for i in range(1, len(tokens), 2):
+    before, after = tokens[i-1], tokens[i+1]
+    mbefore = LINE_BEFORE_RE.search(before)
+    mafter = LINE_AFTER_RE.match(after)
+    alone = not tokens[i].value and mbefore != None and mafter != None and ( mbefore.group(1) != '' or startofline )
+    if alone:
+      tokens[i-1] = before[:mbefore.end(1)]
+      tokens[i+1] = after[mafter.end():]
+    startofline = alone
+  return tokens
+  
+  
+def _parse(tokens):
+  '''Turns the tokens into a tree of nodes: text strings, ('value', keys),
+     ('collection', keys, body, separator), and ('condition', keys, branches, else)'''
+  stack = [ ( None, [] ) ]  # ( opening tag, nodes ) for each open block
+  for token in tokens:
+    nodes = stack[-1][1]
+    if not isinstance(token, _Tag):
+      if token:
+        nodes.append(token)
+    elif token.value:
+      nodes.append(( 'value', token.keys ))
+    elif not token.close and not token.alternative:  # opens a collection or condition
+      stack.append(( token, [] ))
+    else:
+      opening = stack[-1][0]
+      assert opening != None and opening.keys == token.keys and opening.condition == token.condition, 'Unexpected %s in the template' % token.text
+      if token.alternative:  # the separator of a collection, or the next branch of a condition
+        stack.append(( token, [] ))
+        continue
+      # a closing tag: collect the blocks back to the tag that opened it
+      blocks = []
+      while True:
+        tag, nodes = stack.pop()
+        blocks.insert(0, ( tag, nodes ))
+        if not tag.alternative:
+          break
+      if token.condition:
+        branches = [ ( tag.operator, tag.operand, nodes ) for tag, nodes in blocks if tag.operator or not tag.alternative ]
+        otherwise = [ nodes for tag, nodes in blocks if tag.alternative and not tag.operator ]
+        stack[-1][1].append(( 'condition', token.keys, branches, otherwise and otherwise[0] or [] ))
+      else:
+        stack[-1][1].append(( 'collection', token.keys, blocks[0][1], len(blocks) > 1 and blocks[1][1] or [] ))
+  assert len(stack) == 1, 'The template never closes %s' % stack[-1][0].text
+  return stack[0][1]
+  
+  
+################################################################################
+###   Compiling
+
+def _compile(nodes):
+  '''Returns a function that renders a list of nodes: render(obj, index, out)'''
+  parts = [ _compile_node(node) for node in nodes ]
+  if len(parts) == 1:
+    return parts[0]
+  def render(obj, index, out):
+    for part in parts:
+      part(obj, index, out)
+  return render
+  
+  
+def _compile_node(node):
+  if not isinstance(node, tuple):
+    return lambda obj, index, out: out.append(node)
+    
+  if node[0] == 'value':
+    keys = node[1]
+    return lambda obj, index, out: out.append(_text(_resolve(obj, keys, index)))
+    
+  if node[0] == 'collection':
+    keys, body, separator = node[1], _compile(node[2]), _compile(node[3])
+    def render_collection(obj, index, out):
+      items = _resolve(obj, keys, index)
+      if not isinstance(items, list):
+        items = _true(items) and [ items ] or []
+      for i, item in enumerate(items):
+        if i > 0:
+          separator(obj, index, out)
+        body(item, i + 1, out)
+    return render_collection
+    
+  keys = node[1]
+  branches = [ ( operator, operand, _compile(nodes) ) for operator, operand, nodes in node[2] ]
+  otherwise = _compile(node[3])
+  def render_condition(obj, index, out):
+    value = _resolve(obj, keys, index)
+    for operator, operand, body in branches:
+      if _test(value, operator, operand):
+        body(obj, index, out)
+        return
+    otherwise(obj, index, out)
+  return render_condition
+  
+  
+################################################################################
+###   Values
+
+def _resolve(obj, keys, index):
+  '''Follows a key path from an object; index is the object's itemIndex'''
+  for key in keys:
+    if key == 'itemIndex':
+      obj = index
+    elif key in COLLECTION_OPERATORS:
+      obj = COLLECTION_OPERATORS[key](_list(obj))
+    elif isinstance(obj, list):
+      obj = [ _value(item, key) for item in obj ]
+    else:
+      obj = _value(obj, key)
+  return obj
+  
+  
+def _value(obj, key):
+  if hasattr(obj, 'template_value'):
+    return obj.template_value(key)
+  return None
+  
+  
+def _list(value):
+  if isinstance(value, list):
+    return value
+  return value != None and [ value ] or []
+  
+  
+def _text(value):
+  '''The text of a value, as it appears in the output'''
+  if value == None:
+    return u''
+  if isinstance(value, list):
+    return u', '.join([ _text(v) for v in value ])
+  if isinstance(value, unicode):
+    return value
+  return unicode(value)
+  
+  
+def _true(value):
+  if isinstance(value, ( list, basestring )):
+    return len(value) > 0
+  return bool(value)
+  
+  
+def _test(value, operator, operand):
+  '''Whether a value passes a condition'''
+  if not operator:
+    return _true(value)
+  text = _text(value)
+  if operator in ( '=', '==' ):
+    return text.lower() == operand.lower()
+  if operator == '!=':
+    return text.lower() != operand.lower()
+  return operand.lower() in text.lower()  # ~
+  
+  
+def _join_comma_and(items):
+  if len(items) < 3:
+    return u' and '.join(items)
+  return u', '.join(items[:-1]) + u', and ' + items[-1]
@@ -0,0 +1,201 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''A thin wrapper around the appscript reference to a Word document.
+
+Every call into Word is an Apple Event, and Apple Events are slow.  Keeping the
+Word-specific commands in one place lets the rest of the program think in terms
+of a few coarse operations (read all the text, replace a span with a field, set
+a field's result), and makes it possible to run the whole pipeline against a
+stand-in document such as bdtw.fake.FakeWordDocument.
+
+The methods of WordDocument are the document interface the pipeline uses.
+Fields are numbered from 1 in document order, as Word numbers them, and text
+offsets are Word's character offsets (field codes and the field delimiter
+characters included).
+'''
+
+import os
+
+from appscript import app, k
+import mactypes
+
+from bdtw import TIMEOUT
+
+
+class WordDocument:
+  '''Wraps an appscript reference to a Word document'''
+  FIELD_ADDIN = k.field_addin
+  
+  def __init__(self, doc):
+    self.doc = doc
+    
+    
+  @classmethod
+  def active(cls):
+    '''Returns the frontmost Word document'''
+    doc = app('Microsoft Word').active_document
+    assert doc.name.get() != k.missing_value, 'Please open a Word document to create the bibliography in.'
+    return cls(doc)
+    
+    
+  @classmethod
+  def open_file(cls, filename):
+    '''Opens a document file in Word and returns it'''
+    assert os.path.isfile(filename), 'The Word document does not exist: ' + filename
+    word = app('Microsoft Word')
+    word.open(mactypes.Alias(os.path.abspath(filename)))
+    return cls(word.active_document)
+    
+    
+  def path(self):
+    '''Returns the (POSIX) path of the document's file, or None if it has never been saved'''
+    fullname = self.doc.full_name.get()
+    if ':' not in fullname:
+      return None  # an unsaved document's full name is just its name
+    return mactypes.File.makewithhfspath(fullname).path
+    
+    
+  def close(self, save=True):
+    '''Closes the document in Word, saving it first unless save is False'''
+    self.doc.close(saving=save and k.yes or k.no)
+    
+    
+  def name(self):
+    '''Returns the name of the document'''
+    return self.doc.name.get()
+    
+    
+  def text(self):
+    '''Returns the full text of the main story, including field codes, in one request.
+       Offsets into this string are the same offsets Word uses for ranges.'''
+    end = self.doc.text_object.end_of_content.get()
+    textrange = self.doc.create_range(start=0, end_=end)
+    textrange.text_retrieval_mode.include_field_codes.set(True)
+    textrange.text_retrieval_mode.include_hidden_text.set(True)
+    return textrange.content.get(timeout=TIMEOUT)
+    
+    
+  def replace_with_field(self, start, end, code):
+    '''Replaces the text between start and end with a field that has the given code.
+       The field codes are left showing until the citation is formatted.'''
+    self.doc.create_range(start=start, end_=end).content.set('')
+    # make a new quote field (will change to ADDIN below) -- Word won't make an ADDIN directly
+    self.doc.make(new=k.field, at=self.doc.create_range(start=start, end_=start), with_properties={k.field_type: k.field_quote, k.field_text: '*'})
+    # make doesn't return the new field correctly, so find it manually
+    newfield = self.doc.create_range(start=start, end_=start+1).fields[1]
+    newfield.field_code.content.set(code)
+    newfield.result_range.content.set('')
+    newfield.show_codes.set(True)
+    
+    
+  def add_field_at_end(self, code):
+    '''Adds a field with the given code on a new line at the end of the document'''
+    # add a blank line to the end of the document
+    app('Microsoft Word').insert(text='\n', at=self.doc.text_object.characters[-1]) 
+    # make a new quote field (will change to ADDIN below)
+    self.doc.make(new=k.field, at=self.doc.text_object.characters[-1], with_properties={k.field_type: k.field_quote, k.field_text: '*'})
+    newfield = self.doc.text_object.fields[-1]
+    newfield.field_code.content.set(code)
+    newfield.result_range.content.set('')
+    newfield.show_codes.set(True)
+    
+    
+  def field_properties(self):
+    '''Returns three parallel lists with the type, code text, and code start offset
+       of every field in the document.  Each list is a single bulk request.'''
+    if self.doc.count(each=k.field) == 0:
+      return [], [], []
+    fields = self.doc.fields
+    types = fields.field_type.get(timeout=TIMEOUT)
+    codes = fields.field_code.content.get(timeout=TIMEOUT)
+    starts = fields.field_code.start_of_content.get(timeout=TIMEOUT)
+    return types, codes, starts
+    
+    
+  def field_codes(self):
+    '''Returns the code text of every field in the document, in one bulk request'''
+    if self.doc.count(each=k.field) == 0:
+      return []
+    return self.doc.fields.field_code.content.get(timeout=TIMEOUT)
+    
+    
+  def field_results(self):
+    '''Returns the result text of every field in the document, in one bulk request'''
+    if self.doc.count(each=k.field) == 0:
+      return []
+    return self.doc.fields.result_range.content.get(timeout=TIMEOUT)
+    
+    
+  def set_field_code(self, index, code):
+    '''Sets the code text of a field'''
+    self.doc.fields[index].field_code.content.set(code)
+    
+    
+  def set_field_result(self, index, text):
+    '''Sets the result text of a field'''
+    self.doc.fields[index].result_range.content.set(text)
+    
+    
+  def append_field_result(self, index, text):
+    '''Adds text to the end of a field's result, which grows to take it in'''
+    self.doc.fields[index].result_range.insert_after(text=text)
+    
+    
+  def show_field_codes(self, index, show):
+    '''Shows the code (True) or the result (False) of a field'''
+    self.doc.fields[index].show_codes.set(show)
+    
+    
+  def insert_file_in_field(self, index, filename, strip_return=True):
+    '''Replaces the result of a field with the contents of a (rich text) file'''
+    field = self.doc.fields[index]
+    field.result_range.content.set('')
+    self.doc.insert_file(file_name=mactypes.File(filename).hfspath, at=field.result_range)
+    if not strip_return:
+      return
+    # sometimes a hard return is included after insert_file -- not sure why
+    end = field.result_range.end_of_content.get()
+    todelete = self.doc.create_range(start=end-1, end_=end)
+    if todelete.content.get() == chr(13):
+      todelete.content.set('')
+      
+      
+  def append_file_in_field(self, index, filename):
+    '''Adds the contents of a (rich text) file to the end of a field's result'''
+    end = self.doc.fields[index].result_range.end_of_content.get()
+    self.doc.insert_file(file_name=mactypes.File(filename).hfspath, at=self.doc.create_range(start=end, end_=end))
+      
+      
+  def copy_field_result(self, source, index):
+    '''Sets the result of a field to a copy of another field's result, formatting
+       included, in one request'''
+    self.doc.fields[index].result_range.formatted_text.set(self.doc.fields[source].result_range.formatted_text)
+      
+      
+  def unlink_fields(self, first, texts):
+    '''Turns a run of consecutive fields, starting at index first, into plain text (one
+       string per field).  Each result is set to its text (a request per field, since
+       every field gets a different string and the text between the fields has to keep
+       its formatting), the two ends of the run are read, and then the whole run is
+       unlinked with one request: about one request per field instead of three.'''
+    for i, text in enumerate(texts):
+      self.doc.fields[first+i].result_range.content.set(text)
+    start = self.doc.fields[first].field_code.start_of_content.get() - 1  # (the field start character)
+    end = self.doc.fields[first+len(texts)-1].result_range.end_of_content.get() + 1
+    self.doc.create_range(start=start, end_=end).fields.unlink()
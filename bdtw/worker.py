@@ -0,0 +1,92 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Running the pipeline off the GUI thread.
+
+A run over a long document takes a while, and the dialog shouldn't freeze for
+it.  Worker runs a function (create_bibliography or remove_bibliography) on a
+thread of its own and hands back its result or exception when it is done.
+ThrottledInterface is the base for the interface the worker reports through:
+it passes progress on at most every PROGRESS_INTERVAL seconds (and at every
+new stage) rather than for every field, and it carries the flag the pipeline
+checks between fields to stop early (see pipeline.Cancelled).
+
+Nothing here knows about wx; the GUI supplies the methods that actually
+touch the screen, which it has to do on the GUI thread.
+'''
+
+import sys, threading, time
+
+from bdtw.pipeline import Interface
+
+# the least time between two progress reports within a stage, in seconds
+PROGRESS_INTERVAL = 0.1
+
+
+class ThrottledInterface(Interface):
+  '''An Interface that drops progress reports that come too quickly, and that can
+     be asked (from any thread) to cancel the run'''
+  def __init__(self, interval=PROGRESS_INTERVAL):
+    Interface.__init__(self)
+    self.interval = interval
+    self._cancel = threading.Event()
+    self._stage = None
+    self._last = 0.0
+    
+    
+  def progress(self, stage, message):
+    now = time.time()
+    if stage == self._stage and now - self._last < self.interval:
+      return
+    self._stage = stage
+    self._last = now
+    self.show_progress(stage, message)
+    
+    
+  def show_progress(self, stage, message):
+    '''Called with the progress reports that get through'''
+    pass
+    
+    
+  def cancel(self):
+    '''Asks the run to stop at the next safe point'''
+    self._cancel.set()
+    
+    
+  def cancelled(self):
+    return self._cancel.is_set()
+    
+
+class Worker(threading.Thread):
+  '''Runs function(*args) on its own thread, then calls finished(result, error) on that
+     thread; error is None, or the sys.exc_info() of what the function raised'''
+  def __init__(self, function, args, finished):
+    threading.Thread.__init__(self, name='BibDeskToWord worker')
+    self.daemon = True  # don't keep the program open if the dialog is closed mid-run
+    self.function = function
+    self.args = args
+    self.finished = finished
+    
+    
+  def run(self):
+    try:
+      result = self.function(*self.args)
+    except:
+      self.finished(None, sys.exc_info())
+    else:
+      self.finished(result, None)
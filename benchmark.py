@@ -0,0 +1,324 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Benchmarks of the bibliography pipeline, run against the stand-ins in bdtw.fake
+so they need neither Word nor BibDesk:
+
+    python benchmark.py stages [--citations N] [--entries N] [--latency S] [--repeat N] [--save]
+    python benchmark.py memory [--citations N] [--entries N] [--steps N]
+    python benchmark.py fieldcodes [--citations N]
+
+The documents and libraries are made up by bdtw.corpus.
+
+stages times each stage of create_bibliography, the whole run, and a second
+run over the finished document (which should find nothing to do), on a
+manuscript of N citations (default 5000) against a library of N entries
+(default 20000).  Each run is in a process of its own, and the best of
+--repeat runs counts.  The times and Apple Event counts are compared with the
+baseline in BASELINE (written by the first run, or by --save); the exit
+status is 1 if a stage got more than REGRESSION_TOLERANCE times slower (and
+by more than REGRESSION_FLOOR seconds) or sends more events than it did.
+Times are only comparable on the machine that made the baseline.
+
+memory runs create_bibliography on documents of growing size (up to N
+citations, default 50000, against a library of N entries, default 200000),
+already turned into fields, each in a process of its own, and
+reports the memory and time each run took per citation.  Both should stay
+flat as the document grows; the exit status is 1 if the largest run costs
+more than FLAT_TOLERANCE times as much per citation as the smallest.
+
+fieldcodes parses the codes of N citation fields (default 100000, with and
+without notes, about a third of them repeats) twice: once from scratch and
+once from the memo, as a second stage would.  The exit status is 1 if a field
+takes more than FIELD_CODE_BUDGET microseconds to parse from scratch.
+'''
+
+import json, multiprocessing, optparse, os, random, resource, shutil, sys, tempfile, time
+
+from bdtw import fieldcode
+from bdtw.corpus import make_document, make_library, write_templates
+from bdtw.pipeline import Interface, Options, create_bibliography
+from bdtw.profiler import STAGES
+
+# where stages keeps its baseline
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark-baseline.json')
+
+# how much slower than the baseline a stage may get before we complain
+REGRESSION_TOLERANCE = 1.5
+
+# how much slower, in seconds, a stage has to get to count (short stages are mostly noise)
+REGRESSION_FLOOR = 0.05
+
+# how much more per citation the largest run may cost than the smallest before we complain
+FLAT_TOLERANCE = 2.0
+
+# how long parsing one field code may take, in microseconds (one Apple Event takes hundreds)
+FIELD_CODE_BUDGET = 20.0
+
+# written into the baseline; a baseline of another version was counted differently and isn't compared with
+BASELINE_VERSION = 2
+
+
+def peak_memory():
+  '''Returns the peak memory use of this process so far, in bytes'''
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return sys.platform == 'darwin' and peak or peak * 1024  # (kilobytes on Linux)
+  
+  
+################################################################################
+###   Stages
+
+class StageTimer(Interface):
+  '''Records the time and the Apple Events each stage of a run takes'''
+  def __init__(self, counters):
+    Interface.__init__(self)
+    self.counters = counters  # the stand-ins whose events are counted
+    self.seconds = {}         # stage name -> seconds
+    self.events = {}          # stage name -> events
+    self.stage = None
+    
+    
+  def progress(self, stage, message):
+    if stage != self.stage:
+      self.finish()
+      self.stage = stage
+      self.started = time.time()
+      self.startevents = self.count()
+      
+      
+  def finish(self):
+    '''Charges everything since the current stage began to that stage'''
+    if self.stage != None:
+      name = STAGES[self.stage]
+      self.seconds[name] = self.seconds.get(name, 0.0) + time.time() - self.started
+      self.events[name] = self.events.get(name, 0) + self.count() - self.startevents
+    self.stage = None
+    
+    
+  def count(self):
+    '''Returns the events sent so far'''
+    return sum([ counter.events for counter in self.counters ])
+    
+    
+def _measure_stages(citations, entries, latency, templates, results):
+  library = make_library(entries, latency=latency)
+  worddoc = make_document(citations, entries, latency)
+  citetemplate, bibtemplate = templates
+  options = Options(library.name, bibtemplate, citetemplate, citetemplate, 'LastName')
+  seconds, events = {}, {}
+  for name in [ 'Whole run', 'Run again' ]:
+    timer = StageTimer([ worddoc, library ])
+    before = timer.count()
+    start = time.time()
+    create_bibliography(worddoc, library, options, timer)
+    timer.finish()
+    if name == 'Whole run':
+      seconds.update(timer.seconds)
+      events.update(timer.events)
+    seconds[name] = time.time() - start
+    events[name] = timer.count() - before
+  results.put(( seconds, events ))
+  
+  
+def measure_stages(citations, entries, latency, templates):
+  '''Runs the pipeline twice over a new document in a new process, and returns
+     the seconds and the events each stage of the first run, the whole first run,
+     and the whole second run took (two dictionaries, by name)'''
+  results = multiprocessing.Queue()
+  process = multiprocessing.Process(target=_measure_stages, args=( citations, entries, latency, templates, results ))
+  process.start()
+  result = results.get()
+  process.join()
+  return result
+  
+  
+def stages_benchmark(citations, entries, latency, repeat, save, baseline=BASELINE):
+  '''Prints the time and events of each stage against the baseline; returns whether
+     none of them regressed (saving the results as the baseline if asked to, or if
+     there isn't one yet)'''
+  directory = tempfile.mkdtemp()
+  try:
+    templates = write_templates(directory)
+    runs = [ measure_stages(citations, entries, latency, templates) for i in range(repeat) ]
+  finally:
+    shutil.rmtree(directory)
+  seconds = dict([ ( name, min([ run[0][name] for run in runs ]) ) for name in runs[0][0] ])
+  events = runs[-1][1]
+  settings = { 'citations': citations, 'entries': entries, 'latency': latency }
+  results = { 'version': BASELINE_VERSION, 'settings': settings, 'seconds': seconds, 'events': events }
+  if save or not os.path.exists(baseline):
+    _print_stages(results, None)
+    f = open(baseline, 'wb')
+    try:
+      json.dump(results, f, indent=2, sort_keys=True)
+    finally:
+      f.close()
+    print 'saved as the baseline in', baseline
+    return True
+  f = open(baseline, 'rb')
+  try:
+    base = json.load(f)
+  finally:
+    f.close()
+  if base.get('version') != BASELINE_VERSION:
+    print 'the baseline in %s was made by an older version of this benchmark; run with --save to replace it' % baseline
+    return False
+  if base['settings'] != settings:
+    print 'the baseline in %s was made with other settings (%s); run with --save to replace it' % ( baseline, base['settings'] )
+    return False
+  return _print_stages(results, base)
+  
+  
+def _print_stages(results, base):
+  '''Prints the results next to the baseline, if any; returns whether nothing regressed.
+     Events that only moved from one stage to another (the whole run sends no more than
+     before) are noted but don't count: formatting runs on a thread of its own, so where
+     a stage boundary falls between its events can shift.'''
+  names = [ STAGES[stage] for stage in sorted(STAGES) ] + [ 'Whole run', 'Run again' ]
+  moved = base != None and results['events'].get('Whole run', 0) <= base['events'].get('Whole run', 0)
+  ok = True
+  print '%-34s %10s %10s %8s %10s %10s' % ( 'stage', 'seconds', 'baseline', 'change', 'events', 'baseline' )
+  for name in names:
+    seconds, events = results['seconds'].get(name, 0.0), results['events'].get(name, 0)
+    if base == None:
+      print '%-34s %10.3f %10s %8s %10d %10s' % ( name, seconds, '', '', events, '' )
+      continue
+    baseseconds, baseevents = base['seconds'].get(name, 0.0), base['events'].get(name, 0)
+    note = ''
+    if seconds > baseseconds * REGRESSION_TOLERANCE and seconds - baseseconds > REGRESSION_FLOOR:
+      note = '  slower'
+    if events > baseevents and moved and name in STAGES.values():
+      note += '  moved events'
+    elif events > baseevents:
+      note += '  more events'
+    ok = ok and note in ( '', '  moved events' )
+    print '%-34s %10.3f %10.3f %7.0f%% %10d %10d%s' % ( name, seconds, baseseconds, ( seconds / max(baseseconds, 1e-9) - 1 ) * 100, events, baseevents, note )
+  return ok
+  
+  
+################################################################################
+###   Memory
+
+def _measure_run(citations, entries, templates, results):
+  library = make_library(entries)
+  worddoc = make_document(citations, entries, fields=True)
+  citetemplate, bibtemplate = templates
+  options = Options(library.name, bibtemplate, citetemplate, citetemplate, 'LastName')
+  before = peak_memory()
+  start = time.time()
+  summary = create_bibliography(worddoc, library, options)
+  results.put(( time.time() - start, peak_memory() - before, summary ))
+  
+  
+def measure_run(citations, entries, templates):
+  '''Runs the pipeline once in a new process, and returns its time, the memory it
+     added to the process, and its summary'''
+  results = multiprocessing.Queue()
+  process = multiprocessing.Process(target=_measure_run, args=( citations, entries, templates, results ))
+  process.start()
+  result = results.get()
+  process.join()
+  return result
+  
+
+def memory_benchmark(citations, entries, steps):
+  '''Prints the cost per citation of runs of growing size; returns whether it stayed flat'''
+  directory = tempfile.mkdtemp()
+  try:
+    templates = write_templates(directory)
+    rows = []
+    print '%10s %10s %10s %12s %12s' % ( 'citations', 'entries', 'seconds', 'bytes/cite', 'usec/cite' )
+    for step in range(steps):
+      scale = 2 ** ( step - steps + 1 )
+      size, libsize = max(1, int(citations * scale)), max(1, int(entries * scale))
+      seconds, memory, summary = measure_run(size, libsize, templates)
+      rows.append(( memory / float(size), seconds / size ))
+      print '%10d %10d %10.2f %12.0f %12.1f' % ( size, libsize, seconds, rows[-1][0], rows[-1][1] * 1e6 )
+  finally:
+    shutil.rmtree(directory)
+  flat = True
+  for i, name in enumerate([ 'memory', 'time' ]):
+    growth = rows[-1][i] / max(rows[0][i], 1e-9)
+    if growth > FLAT_TOLERANCE:
+      print '%s per citation grew %.1fx from the smallest run to the largest' % ( name, growth )
+      flat = False
+  return flat
+  
+  
+################################################################################
+###   Field codes
+
+def make_field_codes(fields):
+  '''Returns the codes of fields citation fields: plain, with notes, and with braces in the keys'''
+  rand = random.Random(fields)
+  forms = [ u' ADDIN cite{%s}', u' ADDIN citep{%s}', u' ADDIN citet{%s}', u' ADDIN citep[p. 5]{%s}', u' ADDIN citep[see][ch. 2]{%s}' ]
+  codes = []
+  for i in range(fields):
+    if i > 0 and rand.random() < 0.3:
+      codes.append(rand.choice(codes))  # the same citation again
+      continue
+    keys = [ 'key%d' % rand.randint(0, fields) for j in range(rand.randint(1, 3)) ]
+    if rand.random() < 0.05:
+      keys[0] = u'{van der Berg}%d' % i
+    codes.append(rand.choice(forms) % u', '.join(keys))
+  return codes
+  
+  
+def fieldcode_benchmark(fields):
+  '''Prints the cost of parsing the codes of many fields; returns whether it is in budget'''
+  codes = make_field_codes(fields)
+  timings = []
+  fieldcode._memo.clear()
+  for name in [ 'scratch', 'memo' ]:
+    start = time.time()
+    for code in codes:
+      fieldcode.parse_code(code)
+    timings.append(( name, time.time() - start ))
+  print '%10s %10s %10s %12s' % ( 'fields', 'parse', 'seconds', 'usec/field' )
+  for name, seconds in timings:
+    print '%10d %10s %10.3f %12.2f' % ( fields, name, seconds, seconds / fields * 1e6 )
+  cost = timings[0][1] / fields * 1e6
+  if cost > FIELD_CODE_BUDGET:
+    print 'parsing took %.1f usec per field, over the budget of %.1f' % ( cost, FIELD_CODE_BUDGET )
+    return False
+  return True
+  
+  
+################################################################################
+###   Main
+
+def main(argv=None):
+  parser = optparse.OptionParser(usage='%prog stages|memory|fieldcodes [options]')
+  parser.add_option('--citations', type='int', default=None, help='citations in the (largest) document (default 5000; 50000 for memory; 100000 for fieldcodes)')
+  parser.add_option('--entries', type='int', default=None, help='entries in the (largest) library (default 20000; 200000 for memory)')
+  parser.add_option('--latency', type='float', default=0.0, help='stages: seconds each Apple Event takes (default 0)')
+  parser.add_option('--repeat', type='int', default=5, help='stages: number of runs to take the best of (default 5)')
+  parser.add_option('--save', action='store_true', default=False, help='stages: save the results as the new baseline')
+  parser.add_option('--steps', type='int', default=4, help='memory: number of sizes, each half the next (default 4)')
+  args, commands = parser.parse_args(argv)
+  if commands == [ 'stages' ]:
+    return not stages_benchmark(args.citations or 5000, args.entries or 20000, args.latency, max(args.repeat, 1), args.save) and 1 or 0
+  if commands == [ 'memory' ]:
+    return not memory_benchmark(args.citations or 50000, args.entries or 200000, args.steps) and 1 or 0
+  if commands == [ 'fieldcodes' ]:
+    return not fieldcode_benchmark(args.citations or 100000) and 1 or 0
+  parser.error('please give a benchmark to run: stages, memory or fieldcodes')
+  
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -33,7 +33,7 @@ python setup.py py2app
 hdiutil create -fs HFS+ -volname "BibDeskToWord" -srcfolder dist "BibDeskToWord.dmg"
 
 # zip up the source code and readme file
-zip BibDeskToWord-Source.zip BibDeskToWord.py ReadMe.html screenshot.png setup.py compile_mac_app_bundle.sh
+zip -r BibDeskToWord-Source.zip BibDeskToWord.py bdtw ReadMe.html screenshot.png setup.py compile_mac_app_bundle.sh
 
 # zip up the templates
 # zip BDtW-Templates.zip BDtW*
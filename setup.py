@@ -30,6 +30,7 @@ options = {
   'author_email':     'conan@warp.byu,edu',
   'url':              'http://warp.byu.edu/',
   'packages':         [ 
+                        'bdtw',
                       ],
   'scripts':          [
                         'BibDeskToWord.py',
@@ -53,6 +54,7 @@ if len(sys.argv) >= 2 and sys.argv[1] == 'py2app':
     'py2app': {
       'argv_emulation': True,
       'packages': [ 
+        'bdtw',
        ],
       'includes': 'appscript',
     }
@@ -0,0 +1,127 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''What the tests share: a small library, text templates written to a temp directory,
+a way to make small .docx files, and a way to run the command line on them.'''
+
+import os, shutil, StringIO, sys, tempfile, unittest, zipfile
+
+from bdtw import cli
+from bdtw.bibtex import Entry
+from bdtw.corpus import BIB_TEMPLATE, CITE_TEMPLATE, write_bib
+from bdtw.docx import DOCUMENT_PART
+from bdtw.fake import FakeLibrary
+from bdtw.pipeline import Options
+
+
+# the word/document.xml of a .docx, around the paragraphs of its body
+DOCUMENT = u'''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>%s</w:body></w:document>'''
+
+# a small document for the command line (see CommandLineTestCase)
+TEXT = u'Intro \\cite{key1} and \\citet{key3,key0}.\r\\bibliography{}'
+
+
+def make_entries(count=5):
+  '''Returns count articles, keyed key0, key1, ...'''
+  return [ Entry('article', 'key%d' % i, { 'author': u'Au%d, A.' % i, 'title': u'Title %d' % i, 'year': unicode(2000 + i) }) for i in range(count) ]
+  
+  
+class PipelineTestCase(unittest.TestCase):
+  '''Writes the templates before each test and makes Options that use them'''
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.citetemplate = self.write('cite.txt', CITE_TEMPLATE)
+    self.bibtemplate = self.write('bibliography.txt', BIB_TEMPLATE)
+    self.entries = make_entries()
+    self.library = FakeLibrary(self.entries)
+    
+    
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    
+    
+  def write(self, name, text):
+    path = os.path.join(self.directory, name)
+    f = open(path, 'wb')
+    try:
+      f.write(text.encode('utf-8'))
+    finally:
+      f.close()
+    return path
+    
+    
+  def options(self, **kwargs):
+    return Options(self.library.name, self.bibtemplate, self.citetemplate, self.citetemplate, 'Appearance', **kwargs)
+    
+
+def docx_run(text):
+  return u'<w:r><w:t xml:space="preserve">%s</w:t></w:r>' % text
+  
+  
+def docx_paragraph(*runs):
+  return u'<w:p>%s</w:p>' % u''.join(runs)
+  
+  
+def write_docx(path, body):
+  '''Writes a .docx whose body is the given paragraphs (see docx_paragraph), or plain
+     text with a paragraph per line; returns the path'''
+  if not body.startswith(u'<'):
+    body = u''.join([ docx_paragraph(docx_run(line)) for line in body.split(u'\r') ])
+  package = zipfile.ZipFile(path, 'w')
+  try:
+    package.writestr(DOCUMENT_PART, (DOCUMENT % body).encode('utf-8'))
+  finally:
+    package.close()
+  return path
+  
+
+class CommandLineTestCase(PipelineTestCase):
+  '''Runs bdtw.cli.main with the caches in the temp directory and the output captured'''
+  def setUp(self):
+    PipelineTestCase.setUp(self)
+    self.environ = os.environ.copy()
+    os.environ['HOME'] = os.environ['XDG_CACHE_HOME'] = self.directory
+    self.bibfile = os.path.join(self.directory, 'library.bib')
+    write_bib(self.bibfile, self.entries)
+    
+    
+  def tearDown(self):
+    os.environ.clear()
+    os.environ.update(self.environ)
+    PipelineTestCase.tearDown(self)
+    
+    
+  def document(self, name='paper.docx', text=TEXT):
+    return write_docx(os.path.join(self.directory, name), text)
+    
+    
+  def run_cli(self, *args):
+    '''Returns the exit status, standard output, and standard error of a command'''
+    out, err = StringIO.StringIO(), StringIO.StringIO()
+    sys.stdout, sys.stderr = out, err
+    try:
+      status = cli.main(list(args))
+    finally:
+      sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    return status, out.getvalue(), err.getvalue()
+    
+    
+  def create_args(self, *args):
+    return ( '--bib', self.bibfile, '--bib-template', self.bibtemplate, '--citep-template', self.citetemplate, '--no-cache' ) + args
+    
@@ -0,0 +1,87 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Batches of .docx files: finding them, and working on them in a pool of processes.'''
+
+import json, os, unittest
+
+from bdtw import cli
+from bdtw.batch import find_documents, run_batch
+from bdtw.bibtex import BibTeXLibrary
+from bdtw.docx import DocxDocument
+from bdtw.pipeline import Options
+from tests.support import TEXT, CommandLineTestCase
+
+
+class FindDocumentsTest(CommandLineTestCase):
+  
+  def test_directories_and_manifests(self):
+    os.makedirs(os.path.join(self.directory, 'papers', 'old'))
+    for name in ( 'papers/b.docx', 'papers/a.docx', 'papers/old/c.docx', 'papers/~$a.docx', 'papers/notes.txt' ):
+      self.document(name)
+    manifest = self.write('manifest.txt', u'# chapters\n\npapers/old/c.docx\nchapter.docx\n')
+    found = find_documents([ os.path.join(self.directory, 'papers'), 'other.docx' ], [ manifest ])
+    self.assertEqual([ os.path.relpath(f, self.directory) for f in found ], 
+                     [ 'papers/a.docx', 'papers/b.docx', 'papers/old/c.docx', os.path.relpath('other.docx', self.directory), 'papers/old/c.docx', 'chapter.docx' ])
+    
+
+class BatchTest(CommandLineTestCase):
+  
+  def setUp(self):
+    CommandLineTestCase.setUp(self)
+    self.documents = [ self.document('good.docx'), self.document('unknown.docx', TEXT.replace(u'key1', u'missing')), self.document('empty.docx', u'No citations here.') ]
+    
+    
+  def test_jobs_and_report(self):
+    report = os.path.join(self.directory, 'report.json')
+    status, out, err = self.run_cli(*self.create_args('--jobs', '2', '--report', report, *self.documents))
+    self.assertEqual(status, cli.EXIT_FAILED)  # (the empty document)
+    lines = out.splitlines()
+    self.assertTrue(lines[0].startswith('good.docx: 3 citations in 2 fields'))
+    self.assertTrue(lines[1].startswith('unknown.docx: 2 citations in 2 fields, 1 reformatted, bibliography updated, 1 citation problem'))
+    self.assertTrue(lines[2].startswith('3 documents, 1 failed'))
+    self.assertTrue('empty.docx: failed' in err)
+    problems = json.load(open(report))
+    self.assertEqual(sorted(problems), sorted(self.documents))
+    self.assertEqual([ p['citekey'] for p in problems[self.documents[1]] ], [ u'missing' ])
+    self.assertEqual(len(DocxDocument.open_file(self.documents[0]).field_codes()), 3)  # (saved by the worker)
+    
+    
+  def test_pool_and_in_process_give_the_same_results(self):
+    texts = [ DocxDocument.open_file(document).text() for document in self.documents ]
+    options = Options(self.bibfile, self.bibtemplate, self.citetemplate, self.citetemplate)
+    results = []
+    for processes in ( 1, 2 ):
+      for document, text in zip(self.documents, texts):  # (start from the same text each time)
+        self.document(os.path.basename(document), text.rstrip(u'\r'))
+      library = BibTeXLibrary(self.bibfile)
+      results.append([ ( r.error, r.summary, r.diagnostics ) for r in run_batch(self.documents, library, lambda worddoc: options, processes, False) ])
+    self.assertEqual(results[0], results[1])
+    self.assertEqual([ r[1] and r[1]['fields'] for r in results[0] ], [ 2, 2, None ])
+    
+    
+  def test_remove_dry_run(self):
+    self.run_cli(*self.create_args('--jobs', '2', *self.documents[:2]))
+    status, out, err = self.run_cli('--jobs', '2', '--remove', '--dry-run', *self.documents[:2])
+    self.assertEqual(status, cli.EXIT_OK, err)
+    self.assertEqual([ line.split(' (')[0] for line in out.splitlines()[:2] ], [ 'good.docx: 3 fields would be removed', 'unknown.docx: 3 fields would be removed' ])
+    self.assertEqual(len(DocxDocument.open_file(self.documents[0]).field_codes()), 3)
+    
+
+if __name__ == '__main__':
+  unittest.main()
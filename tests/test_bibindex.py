@@ -0,0 +1,172 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''The persistent index of a .bib file: building it, looking keys up, and rebuilding.'''
+
+import io, os, shutil, tempfile, unittest
+
+from bdtw import bibindex
+from bdtw.bibindex import BibIndex, index_path, index_supported, open_index
+
+BIB = u'''@string{ jsl = "Journal of Stuff" }
+
+@article{Smith2000,
+  author = {Smith, John},
+  title = {Things},
+  journal = jsl,
+  year = 2000,
+}
+
+@inproceedings{jones1999,
+  author = {Jones, Bob},
+  title = {Other Things},
+  crossref = {proc1999},
+}
+
+@proceedings{proc1999,
+  title = {Proceedings},
+  booktitle = {Proceedings},
+  year = {1999},
+}
+'''
+
+ADDED = u'''
+@book{adams2010,
+  author = {Adams, Cy},
+  title = {A Book},
+  year = {2010},
+}
+'''
+
+
+class BibIndexTest(unittest.TestCase):
+  
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.bibfile = os.path.join(self.directory, 'library.bib')
+    self.write(BIB)
+    self.indexes = []
+    
+    
+  def tearDown(self):
+    for index in self.indexes:
+      index.close()
+    shutil.rmtree(self.directory)
+    
+    
+  def write(self, text, mode='w'):
+    f = io.open(self.bibfile, mode, encoding='utf-8')
+    f.write(text)
+    f.close()
+    
+    
+  def open(self):
+    index = open_index(self.bibfile, directory=self.directory)
+    self.indexes.append(index)
+    return index
+    
+    
+  def count_parses(self):
+    '''Counts the entries parsed from here on'''
+    parsed = []
+    original = bibindex._parse_entry
+    def counting(text, macros):
+      parsed.append(text)
+      return original(text, macros)
+    bibindex._parse_entry = counting
+    self.addCleanup(setattr, bibindex, '_parse_entry', original)
+    return parsed
+    
+    
+  def test_build_writes_the_index_file(self):
+    index = self.open()
+    self.assertEqual(index.filename, index_path(self.bibfile, 'utf-8', self.directory))
+    self.assertTrue(os.path.exists(index.filename))
+    self.assertEqual(index.count, 3)
+    self.assertTrue(index.is_current())
+    
+    
+  def test_find_ignores_case(self):
+    index = self.open()
+    self.assertEqual(len(index.find(u'SMITH2000')), 1)
+    self.assertEqual(index.find(u'smith2000'), index.find(u'Smith2000'))
+    self.assertEqual(index.find(u'nobody'), [])
+    
+    
+  def test_entries_read_only_what_is_asked_for(self):
+    index = self.open()
+    parsed = self.count_parses()
+    entries = index.entries([ u'jones1999' ])
+    self.assertEqual([ e.citekey for e in entries ], [ 'jones1999', 'proc1999' ])  # (its crossref parent comes along)
+    self.assertEqual(len(parsed), 2)
+    self.assertEqual(entries[0].field('year'), u'1999')
+    self.assertEqual(index.entries([ u'smith2000' ])[0].field('journal'), u'Journal of Stuff')
+    self.assertEqual(index.entries([ u'nobody' ]), [])
+    
+    
+  def test_sort_fields_are_stored(self):
+    index = self.open()
+    smith = index.entries([ u'Smith2000' ])[0]
+    self.assertEqual(smith._sortfields, ( [ u'Smith, J.' ], u'Smith2000', u'2000', u'Things' ))
+    
+    
+  def test_unchanged_file_is_not_rebuilt(self):
+    self.open()
+    parsed = self.count_parses()
+    self.assertTrue(self.open().is_current())
+    self.assertEqual(parsed, [])
+    
+    
+  def test_append_rebuilds_parsing_only_the_new_entry(self):
+    self.open()
+    self.write(ADDED, 'a')
+    parsed = self.count_parses()
+    index = self.open()
+    self.assertEqual(len(parsed), 1)
+    self.assertTrue(u'adams2010' in parsed[0])
+    self.assertEqual(index.count, 4)
+    self.assertEqual([ e.citekey for e in index.entries([ u'adams2010', u'smith2000' ]) ], [ 'Smith2000', 'adams2010' ])
+    
+    
+  def test_changed_macros_reparse_everything(self):
+    self.open()
+    self.write(BIB.replace(u'Journal of Stuff', u'Journal of Other Stuff'))
+    parsed = self.count_parses()
+    index = self.open()
+    self.assertEqual(len(parsed), 3)
+    self.assertEqual(index.entries([ u'smith2000' ])[0].field('journal'), u'Journal of Other Stuff')
+    
+    
+  def test_damaged_index_is_rebuilt(self):
+    filename = self.open().filename
+    f = open(filename, 'wb')
+    f.write('not an index')
+    f.close()
+    self.assertRaises(ValueError, BibIndex, filename, self.bibfile)
+    self.assertEqual(self.open().count, 3)
+    
+    
+  def test_supported_encodings(self):
+    self.assertTrue(index_supported('utf-8'))
+    self.assertTrue(index_supported('latin-1'))
+    self.assertFalse(index_supported('utf-16'))
+    self.assertFalse(index_supported('no-such-encoding'))
+    
+    
+if __name__ == '__main__':
+  unittest.main()
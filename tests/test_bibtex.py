@@ -0,0 +1,148 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Reading .bib files: entries, @string macros, crossrefs, and names.'''
+
+import io, os, shutil, tempfile, unittest
+
+from bdtw.bibtex import BibTeXLibrary, detex, iter_entries, parse_name
+
+BIB = u'''@comment{ignore @article{not, title = {me}} }
+@string{ jsl = "Journal of Stuff" }
+@preamble{ "\\newcommand{\\x}{}" }
+
+@Article{smith2000,
+  author = {Smith, John and van der Berg, Anna},
+  title = {The {DNA} of {\\"U}ber-things},
+  journal = jsl # { Letters},
+  month = mar,
+  year = 2000,
+}
+
+@inproceedings(jones1999,
+  author = "Jones, Jr., Bob",
+  title = "Quoted {"}title{"}",
+  crossref = {proc1999}
+)
+
+@proceedings{proc1999,
+  title = {Proceedings of Things},
+  booktitle = {Proceedings of Things},
+  year = {1999},
+  editor = {Kim, Lee},
+}
+'''
+
+
+class EntriesTest(unittest.TestCase):
+  
+  def read(self, chunk_size=4096):
+    return dict([ ( e.citekey, e ) for e in iter_entries(io.StringIO(BIB), chunk_size=chunk_size) ])
+    
+    
+  def test_entries_and_skipped_types(self):
+    entries = self.read()
+    self.assertEqual(sorted(entries), [ 'jones1999', 'proc1999', 'smith2000' ])
+    self.assertEqual(entries['smith2000'].type, 'article')
+    self.assertEqual(entries['jones1999'].type, 'inproceedings')
+    
+    
+  def test_macros_and_concatenation(self):
+    smith = self.read()['smith2000']
+    self.assertEqual(smith.field('journal'), u'Journal of Stuff Letters')
+    self.assertEqual(smith.field('month'), u'March')
+    self.assertEqual(smith.field('year'), u'2000')
+    
+    
+  def test_macros_are_handed_back(self):
+    macros = {}
+    list(iter_entries(io.StringIO(BIB), macros))
+    self.assertEqual(macros['jsl'], u'Journal of Stuff')
+    
+    
+  def test_values_are_detexed(self):
+    entries = self.read()
+    self.assertEqual(entries['smith2000'].field('title'), u'The DNA of \xdcber-things')
+    self.assertEqual(entries['jones1999'].field('title'), u'Quoted "title"')
+    
+    
+  def test_small_chunks_read_the_same(self):
+    whole, chunked = self.read(), self.read(chunk_size=7)
+    self.assertEqual(sorted(whole), sorted(chunked))
+    for key in whole:
+      self.assertEqual(whole[key].fields, chunked[key].fields)
+      
+
+class NameTest(unittest.TestCase):
+  
+  def test_three_forms(self):
+    for name, parts in ( ( u'John Smith', ( u'John', u'', u'Smith', u'' ) ),
+                         ( u'Anna van der Berg', ( u'Anna', u'van der', u'Berg', u'' ) ),
+                         ( u'van der Berg, Anna', ( u'Anna', u'van der', u'Berg', u'' ) ),
+                         ( u'Jones, Jr., Bob', ( u'Bob', u'', u'Jones', u'Jr.' ) ),
+                         ( u'{Barnes and Noble}', ( u'', u'', u'Barnes and Noble', u'' ) ) ):
+      author = parse_name(name)
+      self.assertEqual(( author.first, author.von, author.last, author.jr ), parts)
+      
+      
+  def test_normalized_names(self):
+    author = parse_name(u'Jean-Paul van der Berg')
+    self.assertEqual(author.normalized_name, u'van der Berg, Jean-Paul')
+    self.assertEqual(author.abbreviated_normalized_name, u'van der Berg, J.-P.')
+    
+    
+  def test_detex(self):
+    self.assertEqual(detex(u'{\\\'e}t{\\\'e} -- {\\ss}~x'), u'\xe9t\xe9 \u2013 \xdf\xa0x')
+    
+
+class LibraryTest(unittest.TestCase):
+  
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'library.bib')
+    f = io.open(self.filename, 'w', encoding='utf-8')
+    f.write(BIB)
+    f.close()
+    
+    
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    
+    
+  def test_crossref_fields_are_inherited(self):
+    jones = BibTeXLibrary(self.filename, indexed=False).publication_index().get('jones1999')
+    self.assertEqual(jones.field('booktitle'), u'Proceedings of Things')
+    self.assertEqual(jones.field('year'), u'1999')
+    self.assertEqual(jones.field('title'), u'Quoted "title"')  # (its own fields win)
+    
+    
+  def test_wanted_keys_bring_their_crossref_parents(self):
+    entries = BibTeXLibrary(self.filename, indexed=False).entries([ u'JONES1999' ])
+    self.assertEqual(sorted([ e.citekey for e in entries ]), [ 'jones1999', 'proc1999' ])
+    self.assertEqual(entries[0].field('editor'), u'Kim, Lee')
+    
+    
+  def test_index_matches_keys_without_case(self):
+    index = BibTeXLibrary(self.filename, indexed=False).publication_index()
+    self.assertEqual(len(index), 3)
+    self.assertEqual(index.get(u'Smith2000').citekey, 'smith2000')
+    self.assertTrue(index.is_missing(u'nobody'))
+    
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,75 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''The render cache: what it stores, and how often it writes.'''
+
+import os, shutil, tempfile, unittest
+
+from bdtw.cache import RenderCache
+
+
+class RenderCacheTest(unittest.TestCase):
+  
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.cache = RenderCache(os.path.join(self.directory, 'cache.sqlite'))
+    
+    
+  def tearDown(self):
+    self.cache.close()
+    shutil.rmtree(self.directory)
+    
+    
+  def used(self, key):
+    return self.cache.db.execute('SELECT used FROM renders WHERE key = ?', ( key, )).fetchone()[0]
+    
+    
+  def test_get_returns_what_was_put(self):
+    self.cache.put('k', 'value')
+    self.assertEqual(self.cache.get('k'), 'value')
+    self.assertEqual(self.cache.get('missing'), None)
+    self.assertEqual(( self.cache.hits, self.cache.misses ), ( 1, 1 ))
+    
+    
+  def test_reads_are_written_in_one_flush(self):
+    for i in range(50):
+      self.cache.put('k%d' % i, 'value')
+    self.cache.db.execute('UPDATE renders SET used = 0')
+    self.cache.db.commit()
+    changes = self.cache.db.total_changes
+    for i in range(50):
+      self.cache.get('k%d' % i)
+    self.assertEqual(self.cache.db.total_changes, changes)  # no writes while reading
+    self.assertEqual(self.used('k0'), 0)
+    self.cache.flush()
+    self.assertTrue(self.used('k0') > 0)
+    self.assertTrue(self.used('k49') > 0)
+    
+    
+  def test_close_flushes(self):
+    self.cache.put('k', 'value')
+    self.cache.db.execute('UPDATE renders SET used = 0')
+    self.cache.db.commit()
+    self.cache.get('k')
+    self.cache.close()
+    self.cache = RenderCache(os.path.join(self.directory, 'cache.sqlite'))
+    self.assertTrue(self.used('k') > 0)
+    
+
+if __name__ == '__main__':
+  unittest.main()
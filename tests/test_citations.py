@@ -0,0 +1,82 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''The citation table: ids for cite keys, numbering and reference orders.'''
+
+import unittest
+
+from bdtw.bibtex import Entry
+from bdtw.citations import CitationTable
+from bdtw.fake import FakeLibrary
+from bdtw.sorting import SortKeyIndex
+
+
+class CitationTableTest(unittest.TestCase):
+  
+  def setUp(self):
+    self.entries = {
+      'smith': Entry('article', 'smith', { 'author': u'Smith, Ann', 'year': u'2005', 'title': u'Zebras' }),
+      'adams': Entry('article', 'adams', { 'author': u'Adams, Bo', 'year': u'2010', 'title': u'Yaks' }),
+      'jones': Entry('article', 'jones', { 'author': u'Jones, Cy', 'year': u'1990', 'title': u'Xerus' }),
+    }
+    self.library = FakeLibrary(self.entries.values())
+    self.table = CitationTable()
+    self.groups = [ self.table.intern(keys) for keys in [ ( 'smith', ), ( 'adams', 'missing', 'smith' ), ( 'jones', 'adams' ) ] ]
+    for id, citekey in enumerate(self.table.citekeys):
+      if citekey in self.entries:
+        self.table.resolve(id, self.entries[citekey], 'hash-' + citekey)
+        
+        
+  def test_keys_get_ids_in_order_of_first_appearance(self):
+    self.assertEqual(self.table.citekeys, [ 'smith', 'adams', 'missing', 'jones' ])
+    self.assertEqual(self.groups, [ ( 0, ), ( 1, 2, 0 ), ( 3, 1 ) ])
+    self.assertEqual(self.table.intern([ 'jones', 'smith' ]), ( 3, 0 ))
+    self.assertEqual(len(self.table.citekeys), 4)  # (known keys don't get new ids)
+    
+    
+  def test_unresolved_keys_are_not_citations(self):
+    self.assertEqual(len(self.table), 3)
+    self.assertEqual(self.table.publications[2], None)
+    self.assertEqual(self.table.pubhashes_of([ 0, 2 ]), [ 'hash-smith', '' ])
+    
+    
+  def test_numbers_follow_appearance(self):
+    self.table.number()
+    self.assertEqual(self.table.citenums_of(range(4)), [ 1, 2, 0, 3 ])
+    self.assertEqual(self.table.cited(self.groups[1]), [ 1, 0 ])
+    self.assertEqual(self.table.by_number(self.groups[1]), [ 0, 1 ])
+    
+    
+  def test_sorting_renumbers(self):
+    self.table.sort(SortKeyIndex(self.library), 'LastName')
+    self.table.number()
+    self.assertEqual(self.table.citekeys_of(self.table.order), [ 'adams', 'jones', 'smith' ])
+    self.assertEqual(self.table.citenums_of(range(4)), [ 3, 1, 0, 2 ])
+    self.assertEqual(self.table.by_number(self.groups[1]), [ 1, 0 ])
+    self.assertEqual(self.table.by_number(self.groups[2]), [ 1, 3 ])
+    
+    
+  def test_other_orders(self):
+    index = SortKeyIndex(self.library)
+    for code, citekeys in [ ( 'YearLastName', [ 'jones', 'smith', 'adams' ] ), ( 'Title', [ 'jones', 'adams', 'smith' ] ), ( 'Appearance', [ 'jones', 'adams', 'smith' ] ) ]:
+      self.table.sort(index, code)
+      self.assertEqual(self.table.citekeys_of(self.table.order), citekeys)  # (Appearance leaves the last order alone)
+      
+      
+if __name__ == '__main__':
+  unittest.main()
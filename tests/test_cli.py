@@ -0,0 +1,84 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''The command line, run on .docx files and a .bib file.'''
+
+import json, os, sys, unittest
+
+from bdtw import cli
+from bdtw.docx import DocxDocument
+from tests.support import TEXT, CommandLineTestCase
+
+
+class CommandLineTest(CommandLineTestCase):
+  
+  def test_help_and_bad_arguments(self):
+    self.assertEqual(self.run_cli('--help')[0], cli.EXIT_OK)
+    self.assertEqual(self.run_cli('--sort', 'Shoe size')[0], cli.EXIT_USAGE)
+    self.assertEqual(self.run_cli('--jobs', '2', '--bib', self.bibfile, 'paper.doc')[0], cli.EXIT_USAGE)
+    self.assertEqual(self.run_cli('--jobs', '2', self.document())[0], cli.EXIT_USAGE)  # (no --bib)
+    
+    
+  def test_docx_run_needs_neither_word_nor_appscript(self):
+    status, out, err = self.run_cli(*self.create_args(self.document()))
+    self.assertEqual(status, cli.EXIT_OK, err)
+    self.assertTrue(out.startswith('paper.docx: 3 citations in 2 fields, 2 reformatted, bibliography updated ('))
+    self.assertFalse('bdtw.word' in sys.modules)
+    self.assertFalse('appscript' in sys.modules)
+    
+    
+  def test_settings_are_read_back_from_the_document(self):
+    document = self.document()
+    self.run_cli(*self.create_args(document))
+    status, out, err = self.run_cli(document)  # (the bibliography field remembers the rest)
+    self.assertEqual(status, cli.EXIT_OK, err)
+    self.assertTrue('0 reformatted, bibliography unchanged' in out)
+    
+    
+  def test_strict_and_report(self):
+    document = self.document(text=TEXT.replace(u'key3', u'missing'))
+    report = os.path.join(self.directory, 'report.json')
+    status, out, err = self.run_cli(*self.create_args('--strict', '--report', report, document))
+    self.assertEqual(status, cli.EXIT_WARNINGS)
+    self.assertTrue('1 citation problem' in out)
+    self.assertTrue('missing' in err)
+    problems = json.load(open(report))[document]
+    self.assertEqual([ p['citekey'] for p in problems ], [ u'missing' ])
+    self.assertEqual(self.run_cli(*self.create_args(document))[0], cli.EXIT_OK)  # (warnings only fail with --strict)
+    
+    
+  def test_remove_with_dry_run(self):
+    document = self.document()
+    self.run_cli(*self.create_args(document))
+    status, out, err = self.run_cli('--remove', '--dry-run', document)
+    self.assertTrue(': 3 fields would be removed' in out)
+    self.assertEqual(len(DocxDocument.open_file(document).field_codes()), 3)  # (not saved)
+    status, out, err = self.run_cli('--remove', document)
+    self.assertTrue(': 3 fields removed' in out)
+    self.assertEqual(DocxDocument.open_file(document).text(), TEXT + u'\r')
+    
+    
+  def test_a_failed_document_does_not_stop_the_others(self):
+    status, out, err = self.run_cli(*self.create_args(os.path.join(self.directory, 'gone.docx'), self.document()))
+    self.assertEqual(status, cli.EXIT_FAILED)
+    self.assertTrue('gone.docx: failed' in err)
+    self.assertTrue(out.startswith('paper.docx: 3 citations'))
+    
+
+if __name__ == '__main__':
+  unittest.main()
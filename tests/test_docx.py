@@ -0,0 +1,52 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Runs of the pipeline against small .docx files.'''
+
+import os, unittest
+
+from bdtw.diagnostics import UNCONVERTED
+from bdtw.docx import DocxDocument
+from bdtw.pipeline import Interface, create_bibliography
+from tests.support import PipelineTestCase, docx_paragraph, docx_run, write_docx
+
+# a PAGE field, as Word writes it
+PAGE_FIELD = u'<w:r><w:fldChar w:fldCharType="begin"/></w:r><w:r><w:instrText> PAGE </w:instrText></w:r><w:r><w:fldChar w:fldCharType="separate"/></w:r>' + docx_run(u'1') + u'<w:r><w:fldChar w:fldCharType="end"/></w:r>'
+
+
+class DocxTest(PipelineTestCase):
+  
+  def make_docx(self, body):
+    return DocxDocument.open_file(write_docx(os.path.join(self.directory, 'document.docx'), body))
+    
+    
+  def test_citation_across_a_field_is_left_and_diagnosed(self):
+    worddoc = self.make_docx(docx_paragraph(docx_run(u'See \\cite{key1} and \\cite{key2'), PAGE_FIELD, docx_run(u'}.')) + docx_paragraph(docx_run(u'\\bibliography{}')))
+    before = worddoc.text()
+    ui = Interface()
+    summary = create_bibliography(worddoc, self.library, self.options(), ui)
+    self.assertEqual(summary['fields'], 1)
+    problems = ui.diagnostics.report()
+    self.assertEqual([ p['kind'] for p in problems ], [ UNCONVERTED ])
+    text = worddoc.text()
+    self.assertTrue(text[problems[0]['offset']:].startswith(u'\\cite{key2\x13'))
+    self.assertTrue(before[before.index(u'\\cite{key2'):before.index(u'\r')] in text)
+    
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,92 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Reading field codes, and adding their notes to formatted citations.'''
+
+import unittest
+
+from bdtw.fieldcode import NOT_OURS, add_notes, parse_code
+
+
+class ParseCodeTest(unittest.TestCase):
+  
+  def test_plain(self):
+    parsed = parse_code(u' ADDIN cite{smith2000, jones1999}')
+    self.assertEqual(( parsed.command, parsed.prenote, parsed.postnote ), ( 'cite', u'', u'' ))
+    self.assertEqual(parsed.citekeys, ( u'smith2000', u'jones1999' ))
+    
+    
+  def test_one_optional_argument_is_the_postnote(self):
+    parsed = parse_code(u' ADDIN citep[p. 5]{smith2000}')
+    self.assertEqual(( parsed.prenote, parsed.postnote ), ( u'', u'p. 5' ))
+    self.assertEqual(parsed.text(), u'citep[p. 5]{smith2000}')
+    
+    
+  def test_two_optional_arguments(self):
+    parsed = parse_code(u' ADDIN citet [see] [ch. 2] {smith2000}')
+    self.assertEqual(( parsed.command, parsed.prenote, parsed.postnote ), ( 'citet', u'see', u'ch. 2' ))
+    self.assertEqual(parsed.text(), u'citet[see][ch. 2]{smith2000}')
+    
+    
+  def test_empty_prenote_is_kept_in_the_text(self):
+    parsed = parse_code(u' ADDIN citep[][p. 5]{smith2000}')
+    self.assertEqual(( parsed.prenote, parsed.postnote ), ( u'', u'p. 5' ))
+    
+    
+  def test_braces_in_keys(self):
+    self.assertEqual(parse_code(u' ADDIN cite{a{,}b, c}').citekeys, ( u'a{,}b', u'c' ))
+    
+    
+  def test_codes_that_are_not_ours(self):
+    for code in ( u' PAGE ', u' ADDIN EN.CITE', None ):
+      self.assertTrue(parse_code(code) is NOT_OURS)
+    self.assertEqual(parse_code(u' ADDIN bibliography{style:x}').citekeys, ())
+    
+    
+  def test_same_code_same_record(self):
+    self.assertTrue(parse_code(u' ADDIN cite{a}') is parse_code(u' ADDIN cite{a}'))
+    
+
+class AddNotesTest(unittest.TestCase):
+  
+  def test_no_notes(self):
+    self.assertEqual(add_notes(u'(Smith, 2000)', u'', u''), u'(Smith, 2000)')
+    
+    
+  def test_inside_the_brackets(self):
+    self.assertEqual(add_notes(u'(Smith, 2000)', u'see', u'p. 5'), u'(see Smith, 2000, p. 5)')
+    self.assertEqual(add_notes(u'[1, 2]', u'', u'p. 5'), u'[1, 2, p. 5]')
+    
+    
+  def test_textual_citation(self):
+    self.assertEqual(add_notes(u'Smith (2000)', u'', u'p. 5'), u'Smith (2000, p. 5)')
+    self.assertEqual(add_notes(u'Smith (2000)', u'see', u'p. 5'), u'Smith (see 2000, p. 5)')
+    self.assertEqual(add_notes(u'Smith (2000), Jones (1999)', u'', u'p. 5'), u'Smith (2000), Jones (1999, p. 5)')
+    
+    
+  def test_without_brackets(self):
+    self.assertEqual(add_notes(u'Smith 2000', u'see', u'p. 5'), u'see Smith 2000, p. 5')
+    self.assertEqual(add_notes(u'(Smith) 2000', u'', u'p. 5'), u'(Smith) 2000, p. 5')
+    
+    
+  def test_surrounding_space_is_kept(self):
+    self.assertEqual(add_notes(u' (Smith, 2000)\r', u'', u'p. 5'), u' (Smith, 2000, p. 5)\r')
+    
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,81 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Incremental runs: fields are skipped only when their text wouldn't change.'''
+
+import unittest
+
+from bdtw.fake import FakeWordDocument
+from bdtw.incremental import RunDigest
+from bdtw.pipeline import create_bibliography
+from tests.support import PipelineTestCase
+
+
+class IncrementalTest(PipelineTestCase):
+  
+  def setUp(self):
+    PipelineTestCase.setUp(self)
+    self.worddoc = FakeWordDocument(u'A \\cite{key1} B \\cite{key2,key3}\r\\bibliography{}')
+    self.summary = create_bibliography(self.worddoc, self.library, self.options())
+    
+    
+  def test_unchanged_run_formats_nothing(self):
+    summary = create_bibliography(self.worddoc, self.library, self.options())
+    self.assertEqual(summary['formatted'], 0)
+    self.assertFalse(summary['bibliography'])
+    
+    
+  def test_edited_publication_is_formatted_again(self):
+    self.assertTrue(u'Au2, A. (2002)' in self.worddoc.text())
+    self.entries[2].fields['year'] = u'1999'
+    summary = create_bibliography(self.worddoc, self.library, self.options())
+    self.assertEqual(summary['formatted'], 1)  # only the field citing key2
+    self.assertTrue(summary['bibliography'])
+    text = self.worddoc.text()
+    self.assertTrue(u'Au2, A. (1999)' in text)
+    self.assertFalse(u'Au2, A. (2002)' in text)
+    
+    
+  def test_unchanged_run_asks_the_library_in_bulk(self):
+    worddoc = FakeWordDocument(u''.join([ u'\\cite{key%d} ' % (i % 5) for i in range(50) ]) + u'\r\\bibliography{}')
+    create_bibliography(worddoc, self.library, self.options())
+    self.library.events = 0
+    create_bibliography(worddoc, self.library, self.options())
+    self.assertEqual(self.library.events, 3)  # just the publication index, hashes included
+    
+    
+  def test_digest_of_another_version_is_rebuilt(self):
+    code = self.worddoc.field_codes()[-1]
+    digest = code.split('digest:')[1].rstrip('}')
+    self.assertEqual(len(RunDigest.parse(digest).fields), 2)
+    old = digest.split('.', 1)[1]  # (the first digests had no version)
+    self.worddoc.fields[-1].code = code.replace(digest, old)
+    self.assertEqual(len(RunDigest.parse(old).fields), 0)
+    summary = create_bibliography(self.worddoc, self.library, self.options())
+    self.assertEqual(summary['formatted'], 2)
+    self.assertTrue(self.worddoc.field_codes()[-1].endswith(digest + '}'))
+    
+    
+  def test_rebuild_formats_everything(self):
+    summary = create_bibliography(self.worddoc, self.library, self.options(incremental=False))
+    self.assertEqual(summary['formatted'], 2)
+    self.assertTrue(summary['bibliography'])
+    
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,217 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Whole runs of the pipeline against the stand-ins in bdtw.fake.'''
+
+import unittest
+
+from bdtw.corpus import BIB_TEMPLATE
+from bdtw.diagnostics import UNRESOLVED
+from bdtw.fake import FakeLibrary, FakeWordDocument
+from bdtw.pipeline import Interface, Options, create_bibliography, remove_bibliography
+from tests.support import PipelineTestCase, make_entries
+
+TEXT = u'Intro \\cite{key1} and \\citet{key3,key0}.  Also \\citep{missing}. \\nocite{key4}\r\\bibliography{}'
+
+
+class PipelineTest(PipelineTestCase):
+  
+  def test_formats_citations_and_bibliography(self):
+    worddoc = FakeWordDocument(TEXT)
+    summary = create_bibliography(worddoc, self.library, self.options())
+    self.assertEqual(( summary['citations'], summary['fields'], summary['problems'] ), ( 4, 4, 1 ))  # (fields counts the citation fields)
+    results = worddoc.field_results()
+    self.assertEqual(results[:2], [ u'[1]', u'[2, 3]' ])
+    self.assertEqual(results[-1].splitlines()[0], u'[1] Au1, A. (2001). Title 1.')
+    self.assertEqual(len(results[-1].splitlines()), 4)
+    
+    
+  def test_remove_restores_the_text(self):
+    worddoc = FakeWordDocument(TEXT)
+    create_bibliography(worddoc, self.library, self.options())
+    create_bibliography(worddoc, self.library, self.options())
+    self.assertEqual(remove_bibliography(worddoc), 5)
+    self.assertEqual(worddoc.text(), TEXT)
+    
+    
+  def test_rerun_sends_few_events(self):
+    worddoc = FakeWordDocument(TEXT * 20)
+    create_bibliography(worddoc, self.library, self.options())
+    first = worddoc.events + self.library.events
+    worddoc.events = self.library.events = 0
+    summary = create_bibliography(worddoc, self.library, self.options())
+    self.assertEqual(summary['formatted'], 0)
+    self.assertTrue(worddoc.events + self.library.events < first / 10)
+    
+    
+  def test_unresolved_key_is_diagnosed(self):
+    worddoc = FakeWordDocument(TEXT + u' \\cite{missing}')
+    ui = Interface()
+    create_bibliography(worddoc, self.library, self.options(), ui)
+    problems = ui.diagnostics.report()
+    self.assertEqual([ ( p['kind'], p['citekey'] ) for p in problems ], [ ( UNRESOLVED, 'missing' ) ] * 2)
+    self.assertEqual(len(ui.warnings), 1)  # one warning per key, however often it is cited
+    text = worddoc.text()
+    for problem in problems:  # the offsets are where the field codes are now
+      self.assertTrue(text[problem['offset']:].split(u'\x14')[0].endswith(u'{missing}'))
+      
+      
+  def test_placeholders(self):
+    worddoc = FakeWordDocument(TEXT)
+    create_bibliography(worddoc, self.library, self.options(placeholders=True))
+    self.assertTrue(u'[missing?]' in worddoc.field_results())
+    
+
+class RecordingDocument(FakeWordDocument):
+  '''Notes which fields were filled from a file, copied from another field, or unlinked'''
+  def __init__(self, *args):
+    FakeWordDocument.__init__(self, *args)
+    self.inserted = []  # field indexes
+    self.copied = []    # ( source, index )
+    self.unlinked = []  # ( first, texts )
+    
+    
+  def insert_file_in_field(self, index, filename, strip_return=True):
+    self.inserted.append(index)
+    FakeWordDocument.insert_file_in_field(self, index, filename, strip_return)
+    
+    
+  def copy_field_result(self, source, index):
+    self.copied.append(( source, index ))
+    FakeWordDocument.copy_field_result(self, source, index)
+    
+    
+  def unlink_fields(self, first, texts):
+    self.unlinked.append(( first, list(texts) ))
+    FakeWordDocument.unlink_fields(self, first, texts)
+    
+
+class RemoveTest(PipelineTestCase):
+  
+  FIELDS = u'A \x13 ADDIN cite{key1}\x14[1]\x15 B \x13 PAGE \x143\x15 C \x13 ADDIN citep[p. 2]{key2}\x14[2, p. 2]\x15 \x13 ADDIN nocite{key3}\x14\x15\r\x13 ADDIN bibliography{style:x}\x14refs\x15'
+  
+  def test_dry_run_counts_and_changes_nothing(self):
+    worddoc = RecordingDocument.from_text(self.FIELDS)
+    self.assertEqual(remove_bibliography(worddoc, dry_run=True), 4)
+    self.assertEqual(worddoc.text(), self.FIELDS)
+    self.assertEqual(worddoc.unlinked, [])
+    
+    
+  def test_runs_are_split_by_other_fields(self):
+    worddoc = RecordingDocument.from_text(self.FIELDS)
+    self.assertEqual(remove_bibliography(worddoc), 4)
+    self.assertEqual(worddoc.unlinked, [ ( 3, [ u'\\citep[p. 2]{key2}', u'\\nocite{key3}', u'\\bibliography{}' ] ), ( 1, [ u'\\cite{key1}' ] ) ])  # (from the end)
+    self.assertEqual(worddoc.text(), u'A \\cite{key1} B \x13 PAGE \x143\x15 C \\citep[p. 2]{key2} \\nocite{key3}\r\\bibliography{}')
+    
+    
+  def test_nothing_to_remove(self):
+    self.assertRaises(AssertionError, remove_bibliography, FakeWordDocument.from_text(u'A \x13 PAGE \x143\x15'))
+    
+
+class RichExportTest(PipelineTestCase):
+  
+  def setUp(self):
+    PipelineTestCase.setUp(self)
+    richtemplate = self.write('cite.rtf', u'{\\rtf1 (rich)}')
+    self.richoptions = Options(self.library.name, self.bibtemplate, richtemplate, richtemplate, 'Appearance')
+    
+    
+  def test_each_group_is_exported_once(self):
+    worddoc = RecordingDocument(u'\\cite{key1} \\cite{key2} \\cite{key1} \\cite{key2,key1} \\cite{key1}\r\\bibliography{}')
+    self.library.events = 0
+    create_bibliography(worddoc, self.library, self.richoptions)
+    self.assertEqual(worddoc.inserted, [ 1, 2, 4 ])
+    self.assertEqual(worddoc.copied, [ ( 1, 3 ), ( 1, 5 ) ])
+    results = worddoc.field_results()
+    self.assertEqual(results[0], u'Au1, A. (2001). Title 1.')
+    self.assertEqual(results[2], results[0])
+    self.assertEqual(results[4], results[0])
+    self.assertEqual(results[3], u'Au1, A. (2001). Title 1.\rAu2, A. (2002). Title 2.')  # (in number order)
+    
+    
+  def test_same_keys_in_another_order_are_the_same_group(self):
+    worddoc = RecordingDocument(u'\\cite{key1,key2} \\cite{key2,key1} \\citet{key1,key2}\r\\bibliography{}')
+    create_bibliography(worddoc, self.library, self.richoptions)
+    self.assertEqual(worddoc.inserted, [ 1 ])
+    self.assertEqual(worddoc.copied, [ ( 1, 2 ), ( 1, 3 ) ])  # (the citet template is the same file)
+    
+    
+  def test_another_template_is_another_group(self):
+    citettemplate = self.write('citet.rtf', u'{\\rtf1 (textual)}')
+    options = Options(self.library.name, self.bibtemplate, self.richoptions.citeptemplate, citettemplate, 'Appearance')
+    worddoc = RecordingDocument(u'\\cite{key1} \\citet{key1} \\citet{key1}\r\\bibliography{}')
+    create_bibliography(worddoc, self.library, options)
+    self.assertEqual(worddoc.inserted, [ 1, 2 ])
+    self.assertEqual(worddoc.copied, [ ( 2, 3 ) ])
+    
+    
+  def test_rerun_exports_nothing(self):
+    worddoc = RecordingDocument(u'\\cite{key1} \\cite{key1}\r\\bibliography{}')
+    create_bibliography(worddoc, self.library, self.richoptions)
+    worddoc.inserted, worddoc.copied = [], []
+    summary = create_bibliography(worddoc, self.library, self.richoptions)
+    self.assertEqual(summary['formatted'], 0)
+    self.assertEqual(( worddoc.inserted, worddoc.copied ), ( [], [] ))
+    
+
+class ChunkedBibliographyTest(PipelineTestCase):
+  
+  def setUp(self):
+    PipelineTestCase.setUp(self)
+    self.entries = make_entries(12)
+    self.library = FakeLibrary(self.entries)
+    self.text = u''.join([ u'\\cite{key%d} ' % i for i in range(12) ]) + u'\r\\bibliography{}'
+    
+    
+  def bibliography(self, bibtemplate, chunk):
+    '''Returns the bibliography of a run and the number of parts it was written in'''
+    worddoc = FakeWordDocument(self.text)
+    ui = ProgressInterface()
+    create_bibliography(worddoc, self.library, Options(self.library.name, bibtemplate, self.citetemplate, self.citetemplate, 'CiteKey', bib_chunk=chunk), ui)
+    return worddoc.field_results()[-1], max(len(ui.parts), 1)
+    
+    
+  def test_parts_match_the_whole(self):
+    whole, parts = self.bibliography(self.bibtemplate, 0)
+    self.assertEqual(parts, 1)
+    self.assertEqual(whole.splitlines()[:3], [ u'[1] Au0, A. (2000). Title 0.', u'[2] Au1, A. (2001). Title 1.', u'[3] Au10, A. (2010). Title 10.' ])
+    self.assertEqual(self.bibliography(self.bibtemplate, 5), ( whole, 3 ))
+    self.assertEqual(self.bibliography(self.bibtemplate, 12), ( whole, 1 ))
+    
+    
+  def test_template_with_a_heading_is_done_whole(self):
+    bibtemplate = self.write('headed.txt', u'References\n' + BIB_TEMPLATE)
+    whole, parts = self.bibliography(bibtemplate, 0)
+    self.assertEqual(whole.splitlines()[0], u'References')
+    self.assertEqual(self.bibliography(bibtemplate, 5), ( whole, 1 ))
+    
+    
+class ProgressInterface(Interface):
+  '''Notes the parts of the bibliography'''
+  def __init__(self):
+    Interface.__init__(self)
+    self.parts = []
+    
+    
+  def progress(self, stage, message):
+    if stage == 5 and '/' in message:
+      self.parts.append(message)
+      
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,75 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Producing items ahead of the loop that uses them.'''
+
+import threading, unittest
+
+from bdtw.prefetch import prefetch
+
+
+class PrefetchTest(unittest.TestCase):
+  
+  def produce(self, count, fail_at=None):
+    '''Yields 0 to count - 1, noting each one and the thread it was made on'''
+    self.produced = []
+    self.threads = set()
+    for i in range(count):
+      if i == fail_at:
+        raise ValueError('item %d' % i)
+      self.produced.append(i)
+      self.threads.add(threading.current_thread())
+      yield i
+      
+      
+  def test_items_come_out_in_order(self):
+    self.assertEqual(list(prefetch(self.produce(100), 4)), range(100))
+    self.assertFalse(threading.current_thread() in self.threads)
+    
+    
+  def test_exception_follows_the_items_before_it(self):
+    seen = []
+    try:
+      for item in prefetch(self.produce(10, fail_at=6), 2):
+        seen.append(item)
+    except ValueError, e:
+      self.assertEqual(str(e), 'item 6')
+    else:
+      self.fail('the exception was lost')
+    self.assertEqual(seen, range(6))
+    
+    
+  def test_close_stops_the_producer(self):
+    before = threading.active_count()
+    items = prefetch(self.produce(1000), 4)
+    self.assertEqual([ items.next() for i in range(3) ], [ 0, 1, 2 ])
+    items.close()
+    self.assertEqual(threading.active_count(), before)  # (close joins the producer)
+    self.assertTrue(len(self.produced) <= 3 + 4 + 1)  # what was taken, what was queued, and one blocked put
+    
+    
+  def test_depth_0_just_iterates(self):
+    before = threading.active_count()
+    items = prefetch(self.produce(5), 0)
+    self.assertEqual(threading.active_count(), before)
+    self.assertEqual(list(items), range(5))
+    self.assertEqual(self.threads, set([ threading.current_thread() ]))
+    
+    
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,73 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Charging the calls a run makes to stages, fields, and lines of code.'''
+
+import unittest
+
+from bdtw.fake import FakeWordDocument
+from bdtw.pipeline import create_bibliography
+from bdtw.profiler import Profiler
+from tests.support import PipelineTestCase
+
+TEXT = u'A \\cite{key1} B \\citep{key2,key3} C \\nocite{key4}\r\\bibliography{}'
+
+
+class Counter(object):
+  '''Something to profile'''
+  def count(self, value):
+    return value + 1
+    
+
+class ProfilerTest(PipelineTestCase):
+  
+  def test_calls_are_charged_to_the_stage_and_the_call_site(self):
+    profiler = Profiler()
+    wrapped = profiler.wrap(Counter())
+    self.assertEqual(wrapped.count(1), 2)
+    self.assertEqual(wrapped.count(2), 3)
+    report = profiler.report()
+    self.assertEqual(report['total']['calls'], 2)
+    self.assertEqual([ ( s['name'], s['calls'] ) for s in report['stages'] ], [ ( 'Setup', 2 ) ])
+    self.assertEqual([ ( o['name'], o['calls'] ) for o in report['operations'] ], [ ( 'count', 2 ) ])
+    self.assertTrue(report['slowest_sites'][0]['name'].startswith('test_profiler.py:'))
+    
+    
+  def test_run_against_the_stand_ins(self):
+    profiler = Profiler()
+    worddoc = profiler.attach(FakeWordDocument(TEXT))
+    library = profiler.attach(self.library)
+    summary = create_bibliography(worddoc, library, self.options(render_ahead=0), profiler.interface())
+    report = profiler.report(summary['citations'])
+    stages = dict([ ( s['stage'], s['calls'] ) for s in report['stages'] ])
+    self.assertEqual(sorted(stages), [ 0, 1, 2, 4, 5 ])  # (in order of appearance, sorting asks for nothing)
+    operations = dict([ ( o['name'], o['calls'] ) for o in report['operations'] ])
+    self.assertEqual(operations['replace_with_field'], 4)  # three cites and the bibliography
+    self.assertEqual(operations['templated_text'], 3)      # two cite fields and the bibliography
+    self.assertEqual(stages[0], 1 + 4)                     # the text, and each new field
+    fields = dict([ ( f['name'], f['calls'] ) for f in report['slowest_fields'] ])
+    self.assertEqual(sorted(fields), [ 1, 2, 3 ])          # the cite fields, as they are formatted
+    self.assertEqual(fields[1], 3)                         # format, set the result, show it
+    sites = [ s['name'] for s in report['slowest_sites'] ]
+    self.assertTrue([ s for s in sites if s.startswith('scanner.py:') ])
+    self.assertEqual(report['total']['calls'], sum(stages.values()))
+    self.assertEqual(report['calls_per_citation'], round(report['total']['calls'] / 4.0, 2))
+    
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,89 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Finding \\cite commands in the text and turning them into fields.'''
+
+import unittest
+
+from bdtw.fake import FakeWordDocument
+from bdtw.scanner import convert_citations, find_citations, find_malformed
+
+
+class FindTest(unittest.TestCase):
+  
+  def test_finds_every_command(self):
+    text = u'A \\cite{a} B \\citep{b,c} C \\citet{d} D \\nocite{e}\r\\bibliography{}'
+    self.assertEqual([ c[2] for c in find_citations(text) ], [ u'cite{a}', u'citep{b,c}', u'citet{d}', u'nocite{e}', u'bibliography{}' ])
+    
+    
+  def test_offsets_cover_the_command(self):
+    text = u'A \\cite{a} B'
+    start, end, citetext = find_citations(text)[0]
+    self.assertEqual(text[start:end], u'\\cite{a}')
+    
+    
+  def test_notes_and_inner_braces(self):
+    text = u'\\citep[see][p. 5]{a} \\cite{x{y}}'
+    self.assertEqual([ c[2] for c in find_citations(text) ], [ u'citep[see][p. 5]{a}', u'cite{x{y}}' ])
+    
+    
+  def test_skips_commands_inside_fields(self):
+    text = u'\x13 ADDIN cite{a}\x14\\cite{b}\x15 \\cite{c}'
+    self.assertEqual([ c[2] for c in find_citations(text) ], [ u'cite{c}' ])
+    
+    
+  def test_malformed(self):
+    text = u'\\cite no braces \\citep{open \\cite{a}'
+    self.assertEqual([ m[1] for m in find_malformed(text) ], [ u'\\cite', u'\\citep{open \\cite{a}' ])
+    
+    
+class ConvertTest(unittest.TestCase):
+  
+  def document(self, citations):
+    return FakeWordDocument(u''.join([ u'Text \\cite{key%d}. ' % i for i in range(citations) ]))
+    
+    
+  def test_converts_to_fields(self):
+    worddoc = self.document(3)
+    self.assertEqual(convert_citations(worddoc), 3)
+    self.assertEqual(worddoc.field_codes(), [ u' ADDIN cite{key0}', u' ADDIN cite{key1}', u' ADDIN cite{key2}' ])
+    self.assertEqual(convert_citations(worddoc), 0)  # nothing left to convert
+    
+    
+  def test_events(self):
+    # one read of the text, then a fixed cost per field made (Word can't make them in bulk)
+    counts = []
+    for citations in ( 0, 100, 200 ):
+      worddoc = self.document(citations)
+      convert_citations(worddoc)
+      counts.append(worddoc.events)
+    self.assertEqual(counts[0], 5)
+    self.assertEqual(counts[2] - counts[1], counts[1] - counts[0])
+    self.assertTrue(counts[1] - counts[0] <= 8 * 100)
+    
+    
+  def test_read_once_when_nothing_to_convert(self):
+    worddoc = self.document(500)
+    convert_citations(worddoc)
+    worddoc.events = 0
+    convert_citations(worddoc)
+    self.assertEqual(worddoc.events, 5)
+    
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,89 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''The dialog's remembered settings, and when they stop counting.'''
+
+import os, shutil, tempfile, unittest
+
+from bdtw import settings
+from bdtw.settings import DocumentSettings
+
+OPTIONS = { 'bibliographyfile': u'/tmp/library.bib', 'reforder': u'LastName' }
+
+
+class DocumentSettingsTest(unittest.TestCase):
+  
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'settings', 'document-settings.json')
+    self.document = self.touch('paper.docx', 1000000000)
+    
+    
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    
+    
+  def touch(self, name, mtime):
+    path = os.path.join(self.directory, name)
+    open(path, 'wb').close()
+    os.utime(path, ( mtime, mtime ))
+    return path
+    
+    
+  def test_remembered_between_launches(self):
+    DocumentSettings(self.filename).put(self.document, OPTIONS)
+    self.assertEqual(DocumentSettings(self.filename).get(self.document), OPTIONS)
+    
+    
+  def test_forgotten_once_the_document_changes(self):
+    DocumentSettings(self.filename).put(self.document, OPTIONS)
+    os.utime(self.document, ( 1000000060, 1000000060 ))
+    self.assertEqual(DocumentSettings(self.filename).get(self.document), None)
+    
+    
+  def test_nothing_for_unknown_or_missing_documents(self):
+    remembered = DocumentSettings(self.filename)
+    self.assertEqual(remembered.get(self.document), None)
+    missing = os.path.join(self.directory, 'gone.docx')
+    remembered.put(missing, OPTIONS)
+    self.assertEqual(remembered.get(missing), None)  # (no mtime to check against)
+    
+    
+  def test_damaged_file_starts_over(self):
+    DocumentSettings(self.filename).put(self.document, OPTIONS)
+    f = open(self.filename, 'wb')
+    f.write('{ not json')
+    f.close()
+    self.assertEqual(DocumentSettings(self.filename).documents, {})
+    
+    
+  def test_least_recently_used_are_forgotten(self):
+    self.addCleanup(setattr, settings, 'MAX_DOCUMENTS', settings.MAX_DOCUMENTS)
+    settings.MAX_DOCUMENTS = 2
+    remembered = DocumentSettings(self.filename)
+    paths = [ self.touch('paper%d.docx' % i, 1000000000) for i in range(3) ]
+    for used, path in enumerate(paths[:2]):
+      remembered.put(path, OPTIONS)
+      remembered.documents[path]['used'] = used
+    remembered.put(paths[0], OPTIONS)  # used again, so paths[1] is now the oldest
+    remembered.put(paths[2], OPTIONS)
+    self.assertEqual(sorted(DocumentSettings(self.filename).documents), [ paths[0], paths[2] ])
+    
+    
+if __name__ == '__main__':
+  unittest.main()
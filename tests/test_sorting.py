@@ -0,0 +1,120 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Sort keys: folding accents and case, name particles, years, and the reference orders.'''
+
+import unittest
+
+from bdtw import sorting
+from bdtw.bibtex import Entry
+from bdtw.fake import FakeLibrary
+from bdtw.sorting import NO_YEAR, SortKeyIndex, collation_key, name_key, order_key, year_key
+
+
+@unittest.skipIf(sorting.icu != None, 'PyICU collates by locale instead')
+class CollationTest(unittest.TestCase):
+  
+  def test_accents_and_case_are_folded(self):
+    words = [ u'Zhang', u'\xc9mile', u'adams', u'\xd6zt\xfcrk', u'Ostrom', u'\xc6sop' ]
+    self.assertEqual(sorted(words, key=collation_key), [ u'adams', u'\xc6sop', u'\xc9mile', u'Ostrom', u'\xd6zt\xfcrk', u'Zhang' ])
+    
+    
+  def test_exact_text_breaks_ties(self):
+    self.assertEqual(sorted([ u'M\xfcller', u'muller', u'Muller' ], key=collation_key), [ u'Muller', u'M\xfcller', u'muller' ])
+    
+    
+  def test_punctuation_and_spaces_are_ignored(self):
+    self.assertEqual(collation_key(u"O'Brien")[0], collation_key(u'OBrien')[0])
+    self.assertEqual(collation_key(u'  de  la Cruz ')[0], u'de la cruz')
+    
+
+class NameKeyTest(unittest.TestCase):
+  
+  def test_particles_are_set_aside(self):
+    names = [ u'Chen, D.', u'van der Berg, A.', u'Bauer, C.', u'de la Fontaine, J.' ]
+    self.assertEqual(sorted(names, key=name_key), [ u'Bauer, C.', u'van der Berg, A.', u'Chen, D.', u'de la Fontaine, J.' ])
+    
+    
+  def test_particles_break_ties(self):
+    self.assertEqual(sorted([ u'von Berg, A.', u'Berg, A.', u'van Berg, A.' ], key=name_key), [ u'Berg, A.', u'van Berg, A.', u'von Berg, A.' ])
+    
+    
+  def test_first_names_come_after_the_last(self):
+    self.assertEqual(sorted([ u'Smith, John', u'Smithers, Al', u'Smith, Adam' ], key=name_key), [ u'Smith, Adam', u'Smith, John', u'Smithers, Al' ])
+    
+    
+  def test_a_lowercase_name_alone_is_not_a_particle(self):
+    self.assertEqual(name_key(u'bell hooks')[1], collation_key(u'bell'))
+    self.assertEqual(name_key(u'hooks')[1], collation_key(u''))
+    
+
+class YearKeyTest(unittest.TestCase):
+  
+  def test_years(self):
+    self.assertEqual([ year_key(y) for y in ( u'1999', u'c. 2001', 2005, u'', None, u'in press' ) ], [ 1999, 2001, 2005, NO_YEAR, NO_YEAR, NO_YEAR ])
+    
+
+def entry(citekey, author, year, title):
+  return Entry('article', citekey, { 'author': author, 'year': year, 'title': title })
+  
+  
+class SortKeyIndexTest(unittest.TestCase):
+  
+  def setUp(self):
+    self.publications = [
+      entry('c', u'Zhang, Wei', u'2001', u'Gamma'),
+      entry('a', u'van der Berg, Anna', u'1999', u'Beta'),
+      entry('b', u'\xc5berg, Nils', u'', u'Alpha'),
+      entry('d', u'Berg, Anna', u'1999', u'Beta'),
+    ]
+    self.library = FakeLibrary(self.publications)
+    self.index = SortKeyIndex(self.library)
+    
+    
+  def order(self, code):
+    positions = self.index.order(self.publications, code)
+    return positions and [ self.publications[i].citekey for i in positions ]
+    
+    
+  def test_orders(self):
+    self.assertEqual(self.order('Appearance'), None)
+    self.assertEqual(self.order('LastName'), [ 'b', 'd', 'a', 'c' ])
+    self.assertEqual(self.order('CiteKey'), [ 'a', 'b', 'c', 'd' ])
+    self.assertEqual(self.order('YearLastName'), [ 'd', 'a', 'c', 'b' ])  # (no year goes last)
+    self.assertEqual(self.order('Title'), [ 'b', 'd', 'a', 'c' ])
+    
+    
+  def test_ties_keep_the_order_of_appearance(self):
+    self.publications.append(entry('e', u'Berg, Anna', u'1999', u'Beta'))
+    self.publications.insert(0, self.publications.pop(3))
+    self.assertEqual(self.order('LastName'), [ 'b', 'd', 'e', 'a', 'c' ])
+    
+    
+  def test_records_are_fetched_once(self):
+    self.library.events = 0
+    for code in ( 'LastName', 'Title', 'CiteKey' ):
+      self.order(code)
+    self.assertEqual(self.library.events, 5)  # one bulk sort_fields request
+    
+    
+  def test_unknown_order(self):
+    self.assertRaises(AssertionError, order_key, 'Shoe size')
+    
+
+if __name__ == '__main__':
+  unittest.main()
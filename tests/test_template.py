@@ -0,0 +1,166 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Formatting with text templates, including the ones in BDtW-Templates.zip.'''
+
+import os, shutil, tempfile, time, unittest, zipfile
+
+from bdtw.bibtex import Entry
+from bdtw.template import Template, fill_indices, load_template, part_template
+
+# the templates shipped with the program
+TEMPLATES_ZIP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'BDtW-Templates.zip')
+
+ONE = Entry('article', 'smith2000', { 'author': u'Smith, John', 'year': u'2000', 'title': u'One' })
+TWO = Entry('article', 'smith2001', { 'author': u'Smith, John and Jones, Ann', 'year': u'2001', 'title': u'Two' })
+THREE = Entry('book', 'berg2002', { 'author': u'van der Berg, Anna and Smith, John and Jones, Ann', 'year': u'2002', 'title': u'Three' })
+EDITED = Entry('book', 'kim2003', { 'editor': u'Kim, Lee', 'year': u'2003', 'title': u'Edited' })
+
+
+class ShippedTemplatesTest(unittest.TestCase):
+  
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    package = zipfile.ZipFile(TEMPLATES_ZIP)
+    try:
+      for name in package.namelist():
+        if name.startswith('BDtW-Templates/') and name.endswith('.txt'):
+          f = open(os.path.join(self.directory, os.path.basename(name)), 'wb')
+          f.write(package.read(name))
+          f.close()
+    finally:
+      package.close()
+      
+      
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    
+    
+  def render(self, name, publications):
+    return load_template(os.path.join(self.directory, name)).render(publications)
+    
+    
+  def test_author_year(self):
+    self.assertEqual(self.render('BDtW-AuthorYearParenCite.txt', [ ONE ]), u'(Smith, 2000)')
+    self.assertEqual(self.render('BDtW-AuthorYearParenCite.txt', [ ONE, TWO, THREE ]), u'(Smith, 2000; Smith & Jones, 2001; Berg et al., 2002)')
+    
+    
+  def test_author_year_textual(self):
+    self.assertEqual(self.render('BDtW-AuthorYearParenCiteT.txt', [ ONE, TWO, THREE ]), u'Smith (2000), Smith and Jones (2001), Berg et al. (2002)')
+    self.assertEqual(self.render('BDtW-AuthorYearParenCiteT.txt', [ EDITED ]), u'(2003)')  # (no authors; BibDesk does the same)
+    
+    
+  def test_numbered(self):
+    text = self.render('BDtW-NumberedBracketedCite.txt', [ ONE, THREE ])
+    self.assertEqual(text, u'[:::Index:1:::, :::Index:2:::]')
+    self.assertEqual(fill_indices(text, [ 4, 7 ]), u'[4, 7]')
+    
+    
+  def test_numbered_textual(self):
+    self.assertEqual(self.render('BDtW-NumberedBracketedCiteT.txt', [ ONE, TWO ]), u'Smith [1] and Smith and Jones [2]')
+    
+
+class TemplateLanguageTest(unittest.TestCase):
+  
+  def render(self, source, publications=( ONE, TWO, THREE )):
+    return Template(source).render(list(publications))
+    
+    
+  def test_collections_and_separators(self):
+    self.assertEqual(self.render(u'<$publications><$citeKey/><?$publications>|</$publications>'), u'smith2000|smith2001|berg2002')
+    self.assertEqual(self.render(u'<$publications><$authors><$lastName/><?$authors>+</$authors>;</$publications>'), u'Smith;Smith+Jones;Berg+Smith+Jones;')  # (lastName leaves out the von part)
+    
+    
+  def test_operators(self):
+    self.assertEqual(self.render(u'<$publications><$authors.@count/></$publications>'), u'123')
+    self.assertEqual(self.render(u'<$publications.@lastObject.authors.lastName.@componentsJoinedByCommaAndAnd/>'), u'Berg, Smith, and Jones')
+    self.assertEqual(self.render(u'<$publications.@firstObject.authors.abbreviatedNormalizedName.@componentsJoinedByAnd/>'), u'Smith, J.')
+    
+    
+  def test_conditions(self):
+    source = u'<$publications><$fields.Year=2001?>a<?$fields.Year~02?>b<?$fields.Year?>c<?$fields.Year?>d</$fields.Year?></$publications>'
+    self.assertEqual(self.render(source), u'cab')
+    self.assertEqual(self.render(u'<$publications><$fields.Journal?>j<?$fields.Journal?>-</$fields.Journal?><$pubType!=article?>!</$pubType!=article?></$publications>'), u'---!')
+    
+    
+  def test_tag_alone_on_its_line_takes_the_line(self):
+    self.assertEqual(self.render(u'<$publications>\n<$citeKey/>\n</$publications>\n'), u'smith2000\nsmith2001\nberg2002\n')
+    self.assertEqual(self.render(u'A\n  <$publications>\n<$citeKey/>\n  </$publications>  \nB'), u'A\nsmith2000\nsmith2001\nberg2002\nB')
+    self.assertEqual(self.render(u'A <$publications><$citeKey/> </$publications>\nB'), u'A smith2000 smith2001 berg2002 \nB')
+    
+
+class LoadTemplateTest(unittest.TestCase):
+  
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.directory, 'cite.txt')
+    
+    
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    
+    
+  def write(self, data):
+    f = open(self.filename, 'wb')
+    f.write(data)
+    f.close()
+    
+    
+  def test_compiled_once_until_the_file_changes(self):
+    self.write('<$publications><$citeKey/></$publications>')
+    template = load_template(self.filename)
+    self.assertTrue(load_template(self.filename) is template)
+    self.write('(<$publications><$citeKey/></$publications>)')
+    os.utime(self.filename, ( time.time() + 10, time.time() + 10 ))
+    self.assertEqual(load_template(self.filename).render([ ONE ]), u'(smith2000)')
+    
+    
+  def test_encodings(self):
+    self.write('\xef\xbb\xbf\xc3\xa9<$publications><$citeKey/></$publications>')  # UTF-8 with a BOM
+    self.assertEqual(load_template(self.filename).render([ ONE ]), u'\xe9smith2000')
+    self.write('\x8e-<$publications><$citeKey/></$publications>')  # Mac Roman
+    os.utime(self.filename, ( time.time() + 20, time.time() + 20 ))
+    self.assertEqual(load_template(self.filename).render([ ONE ]), u'\xe9-smith2000')
+    
+
+class PartTemplateTest(LoadTemplateTest):
+  
+  def part(self, data):
+    self.write(data)
+    return part_template(self.filename, self.directory)
+    
+    
+  def test_bare_index_gets_a_marker(self):
+    partname = self.part('\xef\xbb\xbf<$publications>\n[<$itemIndex/>] <$citeKey/>\n</$publications>\n')
+    self.assertEqual(partname, os.path.join(self.directory, 'part-template.txt'))
+    rendered = load_template(partname).render([ ONE, TWO ])
+    self.assertEqual(fill_indices(rendered, [ 7, 9 ]), u'[7] smith2000\n[9] smith2001\n')
+    
+    
+  def test_template_without_a_bare_index_is_used_as_it_is(self):
+    self.assertEqual(self.part('<$publications><$citeKey/>\n</$publications>'), self.filename)
+    self.assertEqual(self.part('<$publications>:::Index:<$itemIndex/>:::\n</$publications>'), self.filename)
+    
+    
+  def test_heading_cant_be_split(self):
+    self.assertEqual(self.part('References\n<$publications><$itemIndex/>\n</$publications>'), None)
+    self.assertFalse(os.path.exists(os.path.join(self.directory, 'part-template.txt')))
+    
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,120 @@
+################################################################################
+###
+###  Copyright (c) 2009, Conan Albrecht <conan@warp.byu.edu>
+###
+###  This program is free software: you can redistribute it and/or modify
+###  it under the terms of the GNU Lesser General Public License as published by
+###  the Free Software Foundation, either version 3 of the License, or
+###  (at your option) any later version.
+###
+###  This program is distributed in the hope that it will be useful,
+###  but WITHOUT ANY WARRANTY; without even the implied warranty of
+###  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+###  GNU General Public License for more details.
+###
+###  You should have received a copy of the GNU Lesser General Public License
+###  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+###  
+################################################################################
+'''Running off the GUI thread: throttled progress, cancelling, and the worker.'''
+
+import threading, unittest
+
+from bdtw.fake import FakeWordDocument
+from bdtw.pipeline import Cancelled, create_bibliography
+from bdtw.worker import ThrottledInterface, Worker
+from tests.support import PipelineTestCase
+
+TEXT = u'A \\cite{key1} B \\cite{key2} C \\cite{key3} D \\cite{key4}\r\\bibliography{}'
+
+
+class RecordingInterface(ThrottledInterface):
+  '''Notes the progress that gets through, and cancels after a number of fields'''
+  def __init__(self, interval=60, cancel_after=None):
+    ThrottledInterface.__init__(self, interval)
+    self.shown = []
+    self.cancel_after = cancel_after
+    self.fields = 0
+    
+    
+  def show_progress(self, stage, message):
+    self.shown.append(stage)
+    
+    
+  def working_on(self, field):
+    self.fields += 1
+    if self.fields == self.cancel_after:
+      self.cancel()
+      
+
+class ThrottledInterfaceTest(unittest.TestCase):
+  
+  def test_repeats_within_a_stage_are_dropped(self):
+    ui = RecordingInterface()
+    for stage in [ 1, 1, 1, 2, 2, 4, 4, 4, 5 ]:
+      ui.progress(stage, 'message')
+    self.assertEqual(ui.shown, [ 1, 2, 4, 5 ])
+    
+    
+  def test_reports_pass_once_the_interval_is_up(self):
+    ui = RecordingInterface(interval=0)
+    for stage in [ 4, 4, 4 ]:
+      ui.progress(stage, 'message')
+    self.assertEqual(ui.shown, [ 4, 4, 4 ])
+    
+    
+  def test_cancel_from_another_thread(self):
+    ui = RecordingInterface()
+    self.assertFalse(ui.cancelled())
+    thread = threading.Thread(target=ui.cancel)
+    thread.start()
+    thread.join()
+    self.assertTrue(ui.cancelled())
+    
+    
+class CancelTest(PipelineTestCase):
+  
+  def test_cancelled_run_stops_between_fields(self):
+    worddoc = FakeWordDocument(TEXT)
+    ui = RecordingInterface(cancel_after=2)
+    self.assertRaises(Cancelled, create_bibliography, worddoc, self.library, self.options(), ui)
+    results = worddoc.field_results()
+    self.assertEqual([ bool(result) for result in results ], [ True, True, False, False, False ])
+    self.assertEqual(ui.shown, [ 0, 1, 2, 3, 4 ])
+    
+    
+  def test_next_run_finishes_the_job(self):
+    worddoc = FakeWordDocument(TEXT)
+    self.assertRaises(Cancelled, create_bibliography, worddoc, self.library, self.options(), RecordingInterface(cancel_after=2))
+    create_bibliography(worddoc, self.library, self.options())
+    complete = FakeWordDocument(TEXT)
+    create_bibliography(complete, self.library, self.options())
+    self.assertEqual(worddoc.field_results(), complete.field_results())
+    summary = create_bibliography(worddoc, self.library, self.options())
+    self.assertEqual(summary['formatted'], 0)  # the finished run stored its digest again
+    
+    
+class WorkerTest(unittest.TestCase):
+  
+  def run_worker(self, function, *args):
+    finished = []
+    worker = Worker(function, args, lambda result, error: finished.append(( result, error, threading.current_thread() )))
+    worker.start()
+    worker.join()
+    self.assertEqual(len(finished), 1)
+    self.assertTrue(finished[0][2] is worker)  # called back on the worker's thread
+    return finished[0][:2]
+    
+    
+  def test_result_is_handed_back(self):
+    self.assertEqual(self.run_worker(lambda a, b: a + b, 2, 3), ( 5, None ))
+    
+    
+  def test_exception_is_handed_back(self):
+    result, error = self.run_worker(lambda: 1 / 0)
+    self.assertEqual(result, None)
+    self.assertTrue(error[0] is ZeroDivisionError)
+    
+    
+if __name__ == '__main__':
+  unittest.main()